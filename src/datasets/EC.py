@@ -717,77 +717,91 @@ loadEC_Stn = loadEC
 
 
 ## some helper functions to test conditions
-# defined in module main to facilitate pickling
-def test_prov(val,index,dataset,axis):
+# defined in module main to facilitate pickling; all tests return boolean masks over the station axis
+def getStationValues(dataset, varname, axis):
+  ''' return values of a (meta-data) variable with the station axis first '''
+  var = dataset[varname]
+  data = var.getArray(copy=False) if var.data else var[:]
+  if var.ndim > 1 and var.axisIndex(axis) != 0: data = np.rollaxis(data, var.axisIndex(axis))
+  return data
+def test_prov(val,dataset,axis):
   ''' check if station province is in provided list ''' 
-  return dataset.stn_prov[index] in val
-def test_begin(val,index,dataset,axis):
+  return np.in1d(getStationValues(dataset, 'stn_prov', axis), val)
+def test_begin(val,dataset,axis):
   ''' check if station record begins before given year ''' 
-  return dataset.stn_begin_date[index] <= val # converted to month beforehand 
-def test_end(val,index,dataset,axis):
+  return getStationValues(dataset, 'stn_begin_date', axis) <= val # converted to month beforehand 
+def test_end(val,dataset,axis):
   ''' check if station record ends after given year ''' 
-  return dataset.stn_end_date[index] >= val # converted to month beforehand 
-def test_minlen(val,index,dataset,axis):
+  return getStationValues(dataset, 'stn_end_date', axis) >= val # converted to month beforehand 
+def test_minlen(val,dataset,axis):
   ''' check if station record is longer than a minimum period ''' 
-  return dataset.stn_rec_len[index] >= val 
-def test_maxzse(val,index,dataset,axis, lcheckVar=True):
+  return getStationValues(dataset, 'stn_rec_len', axis) >= val 
+def test_maxzse(val,dataset,axis, lcheckVar=True):
   ''' check that station elevation error does not exceed a threshold ''' 
   if not dataset.hasVariable('zs_err'):
     if lcheckVar: raise DatasetError
-    else: return True # EC datasets don't have this field...
-  else: return np.abs(dataset.zs_err[index]) <= val
-def test_maxz(val,index,dataset,axis, lcheckVar=True):
+    else: return np.ones(len(dataset.getAxis(axis)), dtype=np.bool) # EC datasets don't have this field...
+  else: return np.abs(getStationValues(dataset, 'zs_err', axis)) <= val
+def test_maxz(val,dataset,axis, lcheckVar=True):
   ''' check that station elevation does not exceed a threshold ''' 
   if not dataset.hasVariable('stn_zs'):
     if lcheckVar: raise DatasetError
-    else: return True # EC datasets don't have this field...
-  else: return np.abs(dataset.stn_zs[index]) <= val
-def test_lat(val,index,dataset,axis):
+    else: return np.ones(len(dataset.getAxis(axis)), dtype=np.bool) # EC datasets don't have this field...
+  else: return np.abs(getStationValues(dataset, 'stn_zs', axis)) <= val
+def test_lat(val,dataset,axis):
   ''' check if station is located within selected latitude band '''
-  return val[0] <= dataset.stn_lat[index] <= val[1] 
-def test_lon(val,index,dataset,axis):
+  lat = getStationValues(dataset, 'stn_lat', axis)
+  return np.logical_and(val[0] <= lat, lat <= val[1]) 
+def test_lon(val,dataset,axis):
   ''' check if station is located within selected longitude band ''' 
-  return val[0] <= dataset.stn_lon[index] <= val[1] 
-def test_cluster(val,index,dataset,axis, cluster_name='cluster_id', lcheckVar=True):
+  lon = getStationValues(dataset, 'stn_lon', axis)
+  return np.logical_and(val[0] <= lon, lon <= val[1]) 
+def test_cluster(val,dataset,axis, cluster_name='cluster_id', lcheckVar=True):
   ''' check if station is member of a cluster '''
   if not dataset.hasVariable(cluster_name):
     if lcheckVar: raise DatasetError
-    else: return True # most datasets don't have this field...
+    else: return np.ones(len(dataset.getAxis(axis)), dtype=np.bool) # most datasets don't have this field...
   elif isinstance(val, (int,np.integer)): 
-    return dataset[cluster_name][index] == val
+    return getStationValues(dataset, cluster_name, axis) == val
   elif isinstance(val, (tuple,list,np.ndarray)):
-    return dataset[cluster_name][index] in val
-  else: ValueError, val
-def test_name(val,index,dataset,axis):
+    clusters = getStationValues(dataset, cluster_name, axis)
+    return np.in1d(clusters, val).reshape(clusters.shape)
+  else: raise ValueError, val
+def test_name(val,dataset,axis):
   ''' check if station name is in provided list (val) '''
+  names = np.char.strip(getStationValues(dataset, 'station_name', axis))
   if isinstance(val, basestring): 
-    return dataset['station_name'][index].strip() == val
+    return names == val
   elif isinstance(val, (tuple,list)):
-    return dataset['station_name'][index].strip() in val
-  else: ValueError, val
+    return np.in1d(names, val)
+  else: raise ValueError, val
 # apply tests to list
-def apply_test_suite(tests, index, dataset, axis):
-  ''' apply an entire test suite to '''
-  # just call all individual tests for given index
-  results = [test(index,dataset,axis) for test in tests]
-  results = [np.all(res) if isinstance(res,np.ndarray) else res for res in results]  
-  return all(results)
+def apply_test_suite(tests, dataset, axis):
+  ''' apply an entire test suite to all stations and return a combined mask '''
+  mask = np.ones(len(dataset.getAxis(axis)), dtype=np.bool)
+  for test in tests:
+    res = np.asarray(test(dataset,axis))
+    # N.B.: all values along additional dimensions have to pass the test
+    if res.ndim > 1: res = np.all(res.reshape((res.shape[0],-1)), axis=1)
+    mask &= res
+  return mask
 
 ## select a set of common stations for an ensemble, based on certain conditions
 def selectStations(datasets, stnaxis='station', master=None, linplace=False, lall=False, 
                   lcheckVar=False, cluster_name='cluster_id', **kwcond):
-  ''' A wrapper for selectCoords that selects stations based on common criteria '''
+  ''' A wrapper for selectElements that selects stations based on common criteria; the criteria are 
+      evaluated as vectorized boolean masks over the station axis, and only the station meta data 
+      is loaded (not the entire dataset). '''
   if linplace: raise NotImplementedError, "Option 'linplace' does not work currently."
-  # pre-load NetCDF datasets
+  # check meta-data fields
   for dataset in datasets: 
-    if isinstance(dataset,DatasetNetCDF): dataset.load()
     if dataset.station_name.ndim > 1 and not dataset.station_name.hasAxis(stnaxis):
       raise DatasetError, "Meta-data fields must only have a 'station' axis and no other!" 
   # list of possible constraints
   tests = [] # a list of tests to run on each station
   #loadlist =  (datasets[imaster],) if not lall and imaster is not None else datasets 
   # test definition
-  varcheck = [True]*len(datasets)
+  varcheck = [True]*len(datasets); varnames = []
   for key,val in kwcond.iteritems():
     key = key.lower()
     if key == 'prov':
@@ -838,17 +852,22 @@ def selectStations(datasets, stnaxis='station', master=None, linplace=False, lal
       tests.append(functools.partial(test_name, val))
     else:
       raise NotImplementedError, "Unknown condition/test: '{:s}'".format(key)
+    varnames.append(varname)
     # record, which datasets have all variables 
     varcheck = [dataset.hasVariable(varname) and vchk for dataset,vchk in zip(datasets,varcheck)]
   if not all(varcheck): 
     if lall and lcheckVar: raise DatasetError, varcheck
     else: warn("Some Datasets do not have all variables: {:s}".format(varcheck))
-  # define test function (all tests must pass)
+  # pre-load station meta data required for tests (data variables remain on disk)
+  for dataset in datasets: 
+    for varname in varnames:
+      if dataset.hasVariable(varname): dataset[varname].load()
+  # define mask function (all tests must pass)
   if len(tests) > 0:
-    testFct = functools.partial(apply_test_suite, tests)
-  else: testFct = None
-  # pass on call to generic function selectCoords
-  datasets = selectElements(datasets=datasets, axis=stnaxis, testFct=testFct, master=master, linplace=linplace, lall=lall)
+    maskFct = functools.partial(apply_test_suite, tests)
+  else: maskFct = None
+  # pass on call to generic function selectElements
+  datasets = selectElements(datasets=datasets, axis=stnaxis, maskFct=maskFct, master=master, linplace=linplace, lall=lall)
   # return sliced datasets
   return datasets
   
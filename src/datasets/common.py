@@ -14,7 +14,8 @@ import numpy as np
 import os
 import functools
 # internal imports
-from utils.misc import expandArgumentList
+from utils.misc import expandArgumentList, apply_over_arguments
+from processing.multiprocess import apply_in_processes
 from geodata.misc import AxisError, DatasetError, DateError, ArgumentError, EmptyDatasetError, DataError, VariableError
 from geodata.base import Dataset, Variable, Axis, Ensemble
 from geodata.netcdf import DatasetNetCDF
@@ -422,19 +423,22 @@ class BatchLoad(object):
   ''' A decorator class that wraps custom functions to load specific datasets. List arguments can be
       expanded to load multiple datasets and places them in a list or Ensemble. 
       Keyword arguments are passed on to the dataset load functions; arguments listed in load_list 
-      are applied to the datasets according to expansion rules, otherwise they are applied to all. '''
+      are applied to the datasets according to expansion rules, otherwise they are applied to all. 
+      Expanded datasets can be loaded concurrently in NP worker processes (netCDF-C is not thread-
+      safe); datasets loaded in worker processes are returned as in-memory Datasets/Ensembles. '''
   
   def __init__(self, load_fct):
     ''' initialize wrapping of original operation '''
     self.load_fct = load_fct
     
   def __call__(self, load_list=None, lproduct='outer', inner_list=None, outer_list=None, 
-               lensemble=None, ens_name=None, ens_title=None, **kwargs):
+               lensemble=None, ens_name=None, ens_title=None, NP=1, **kwargs):
     ''' wrap original function: expand argument list, execute load_fct over argument list, 
-        and return a list or Ensemble of datasets '''
+        and return a list or Ensemble of datasets (in the order of the argument list) '''
     # decide, what to do
     if load_list is None and inner_list is None and outer_list is None:
-      # normal operation: no expansion      
+      # normal operation: no expansion (pass on NP, if the load function accepts it)
+      if inspect.isfunction(self.load_fct) and 'NP' in inspect.getargspec(self.load_fct).args: kwargs['NP'] = NP
       datasets =  self.load_fct(**kwargs)
     else:
       # expansion required
@@ -442,11 +446,10 @@ class BatchLoad(object):
       # figure out arguments
       kwargs_list = expandArgumentList(expand_list=load_list, lproduct=lproduct, 
                                        inner_list=inner_list, outer_list=outer_list, **kwargs)
-      # load datasets
-      datasets = []
-      for kwargs in kwargs_list:    
-        # load dataset
-        datasets.append(self.load_fct(**kwargs))    
+      # load datasets (in worker processes, if NP > 1)
+      if NP > 1: datasets = apply_over_arguments(functools.partial(loadInMemory, self.load_fct), kwargs_list, 
+                                                 NP=NP, lprocesses=True)
+      else: datasets = apply_over_arguments(self.load_fct, kwargs_list, NP=1)
       # construct ensemble
       if lensemble:
         datasets = Ensemble(members=datasets, name=ens_name, title=ens_title, basetype='Dataset')
@@ -542,20 +545,41 @@ def loadDataset(name=None, station=None, shape=None, mode='climatology', basin_l
 # loadDataset version with BatchLoad capability
 loadDatasets = BatchLoad(loadDataset)
 
+# helper functions to return datasets from worker processes
+def detachDataset(dataset):
+  ''' load data and replace NetCDF datasets (also Ensemble members) by in-memory copies, and close 
+      the files; open NetCDF files can not be pickled and returned from worker processes '''
+  if isinstance(dataset, Ensemble):
+    members = [detachDataset(member) for member in dataset.members]
+    dataset = Ensemble(*members, name=dataset.ens_name, title=dataset.ens_title, basetype=dataset.basetype, 
+                       idkey=dataset.idkey, NP=dataset.NP)
+  elif isinstance(dataset, DatasetNetCDF):
+    dataset.load(); newset = dataset.copy(asNC=False) # only links to the data
+    dataset.close(); dataset = newset
+  elif isinstance(dataset, Dataset): dataset.load()
+  return dataset
+
+def loadInMemory(load_fct, **kwargs):
+  ''' call load_fct and return the loaded datasets in memory (executed in worker processes) '''
+  return detachDataset(load_fct(**kwargs))
+
 # function to extract common points that meet a specific criterion from a list of datasets
-def selectElements(datasets, axis, testFct=None, master=None, linplace=False, lall=False):
+def selectElements(datasets, axis, testFct=None, maskFct=None, master=None, linplace=False, lall=False):
   ''' Extract common points that meet a specific criterion from a list of datasets. 
-      The test function has to accept the following input: index, dataset, axis'''
+      The test function has to accept the following input: index, dataset, axis; alternatively, a 
+      vectorized mask function can be supplied, which accepts dataset and axis as input and returns 
+      a boolean array over the entire axis (this is much faster for long axes).'''
   if linplace: raise NotImplementedError("Option 'linplace' does not work currently.")
   # check input
   if not isinstance(datasets, (list,tuple,Ensemble)): raise TypeError(datasets)
   if not all(isinstance(dataset,Dataset) for dataset in datasets): raise TypeError(dataset)
   if not callable(testFct) and testFct is not None: raise TypeError(testFct)
+  if not callable(maskFct) and maskFct is not None: raise TypeError(maskFct)
+  if testFct is not None and maskFct is not None: raise ArgumentError("The options 'testFct' and 'maskFct' are mutually exclusive!")
   if isinstance(axis, Axis): axis = axis.name
   if not isinstance(axis, basestring): raise TypeError(axis)
   if lall and master is not None: raise ArgumentError("The options 'lall' and 'imaster' are mutually exclusive!")
   # save some ensemble parameters for later  
-  lnotest = testFct is None
   lens = isinstance(datasets,Ensemble)
   if lens:
     enskwargs = dict(basetype=datasets.basetype, idkey=datasets.idkey, 
@@ -574,42 +598,33 @@ def selectElements(datasets, axis, testFct=None, master=None, linplace=False, la
   if not imaster is None and not isinstance(imaster,(int,np.integer)): raise TypeError(imaster)
   elif imaster >= len(datasets) or imaster < 0: raise ValueError 
   maxis = axes.pop(imaster) # extraxt shortest axis for loop
-  if lall: 
-    tmpds = tuple(datasets)
-    if imaster != 0: tmpds = (tmpds[imaster],)+tmpds[:imaster]+tmpds[imaster+1:]
-    test_fct = lambda i,ds: testFct(i, ds, axis) # prepare test function arguments
-  else: 
-    test_fct = lambda i: testFct(i, datasets[imaster], axis) 
-  # loop over coordinate axis
-  itpls = [] # list of valid index tuple
-  for i,x in enumerate(maxis.coord):
-    # check other axes
-    if all([x in ax.coord for ax in axes]): # only the other axes
-      # no condition
-      if lnotest:
-        # just find and add indices
-        itpls.append((i,)+tuple(ax.coord.searchsorted(x) for ax in axes))
-      # check condition using shortest dataset
-      elif lall: 
-        # check test condition on all datasets (slower)
-        tmpidx = (i,)+tuple(ax.coord.searchsorted(x) for ax in axes)
-        if all(test_fct(ii,ds) for ii,ds in zip(tmpidx,tmpds)):
-          # add corresponding indices in each dataset to list
-          itpls.append(tmpidx)
-      else:
-        # check test condition on only one dataset (faster, default)
-        if test_fct(i):
-          # add corresponding indices in each dataset to list
-          itpls.append((i,)+tuple(ax.coord.searchsorted(x) for ax in axes))
-          # N.B.: since we can expect exact matches, plain searchsorted is fastest (side='left') 
+  tmpds = tuple(datasets)
+  if imaster != 0: tmpds = (tmpds[imaster],)+tmpds[:imaster]+tmpds[imaster+1:]
+  # convert per-element test function into mask function (slow, for backwards-compatibility)
+  if testFct is not None:
+    maskFct = lambda ds, ax: np.asarray([testFct(i, ds, ax) for i in xrange(len(ds.getAxis(ax)))], dtype=np.bool)
+  # find coordinates that are present in all datasets (vectorized)
+  mcoord = maxis.coord
+  lvalid = np.ones(len(mcoord), dtype=np.bool)
+  for ax in axes: lvalid &= np.in1d(mcoord, ax.coord, assume_unique=True)
+  idxtpl = (np.arange(len(mcoord)),)+tuple(ax.coord.searchsorted(mcoord) for ax in axes)
+  # N.B.: since we can expect exact matches, plain searchsorted is fastest (side='left'); indices of
+  #       coordinates that are not present are invalid, but will be masked by lvalid
+  # evaluate test condition using boolean masks
+  if maskFct is not None:
+    if lall: 
+      # check test condition on all datasets (slower)
+      for ds,idx in zip(tmpds,idxtpl):
+        mask = np.asarray(maskFct(ds, axis), dtype=np.bool)
+        lvalid[lvalid] &= mask[idx[lvalid]]
+    else:
+      # check test condition on only one dataset (faster, default)
+      lvalid &= np.asarray(maskFct(tmpds[0], axis), dtype=np.bool)
   # check if there is anything left...
-  if len(itpls) == 0: raise DatasetError("Aborting: no data points match all criteria!")
+  if not np.any(lvalid): raise DatasetError("Aborting: no data points match all criteria!")
   # construct axis indices for each dataset (need to remember to move shortest axis back in line)
-  idxs = [[] for ds in datasets] # create unique empty lists
-  for itpl in itpls:
-    for i,idx in enumerate(itpl): idxs[i].append(idx)
+  idxs = [np.asarray(idx[lvalid], dtype='int') for idx in idxtpl]
   idxs.insert(imaster,idxs.pop(0)) # move first element back in line (where shortest axis was)
-  idxs = [np.asarray(idxlst, dtype='int') for idxlst in idxs]      
   # slice datasets using only positive results  
   datasets = [ds(lidx=True, linplace=linplace, **{axis:idx}) for ds,idx in zip(datasets,idxs)]
   if lens: datasets = Ensemble(*datasets, **enskwargs)
@@ -617,6 +632,37 @@ def selectElements(datasets, axis, testFct=None, master=None, linplace=False, la
   return datasets
 
 
+# helper function for loadEnsemble (module-level, so that it can be executed in worker processes)
+def loadMember(loadarg, ldataset=False, lminmax=False, obs_list=None, ldetach=False, **kwargs):
+  ''' helper function to load an individual dataset/ensemble member; if ldetach, the data are returned 
+      in memory (see detachDataset) '''
+  # clean up arguments
+  name = loadarg.pop('names',None); name_tag = loadarg.pop('name_tags',None)
+  slcs = loadarg.pop('slices',None); obsslcs = loadarg.pop('obsslices',None)
+  slcs = dict() if slcs is None else slcs.copy(); 
+  prd = loadarg.pop('period',None); obsprd = loadarg.pop('obs_period',None)
+  if name in obs_list: prd = obsprd or prd 
+  # special handling of periods for time-series: user for slicing by year!
+  mode = loadarg['mode'].lower(); lts = 'time' in mode and 'series' in mode 
+  if lts and prd: slcs['years'] = prd          
+  if obsslcs and name in obs_list: slcs.update(**obsslcs) # add special slices for obs
+  if not lts: 
+    if prd: loadarg['period'] = prd
+    elif 'years' in slcs: loadarg['period'] = slcs['years']
+    if 'years' in slcs: del slcs['years'] # will cause an error with climatologies
+  # N.B.: currently VarNC's can only be sliced once, because we can't combine slices yet
+  # load individual dataset
+  loadarg.update(kwargs) # WRF_exps, CESM_exps, etc.
+  dataset = loadDataset(name=name, slices=slcs, **loadarg)
+  if name_tag is not None: 
+    if name_tag.startswith('_'): dataset.name += name_tag
+    else: dataset.name = name_tag
+  # apply slicing
+  if slcs: dataset = dataset(lminmax=lminmax, **slcs) # slice immediately 
+  if ldetach: dataset = detachDataset(dataset) # load data into memory and close files
+  elif not ldataset: dataset.load() # load data
+  return dataset
+
 # a function to load station data
 def loadEnsemble(names=None, name=None, title=None, varlist=None, aggregation=None, season=None, prov=None, 
                  shape=None, station=None, slices=None, obsslices=None, years=None, period=None, obs_period=None, 
@@ -624,9 +670,13 @@ def loadEnsemble(names=None, name=None, title=None, varlist=None, aggregation=No
                  lcheckVar=False, lwrite=False, ltrimT=True, name_tags=None, dataset_mode='time-series', 
                  lminmax=False, master=None, lall=True, ensemble_list=None, ensemble_product='inner', 
                  lensembleAxis=False, WRF_exps=None, CESM_exps=None, WRF_ens=None, CESM_ens=None, 
-                 bias_correction=None, obs_list=observational_datasets, basin_list=None, aggargs=None, **kwargs):
+                 bias_correction=None, obs_list=observational_datasets, basin_list=None, aggargs=None, 
+                 NP=1, NIO=None, **kwargs):
   ''' a convenience function to load an ensemble of time-series, based on certain criteria; works 
-      with either stations or regions; seasonal/climatological aggregation is also supported '''
+      with either stations or regions; seasonal/climatological aggregation is also supported; 
+      members can be loaded concurrently in worker processes (netCDF-C is not thread-safe) and are 
+      returned as in-memory Datasets; NIO limits the number of loading processes (default: NP), 
+      while NP threads are used for subsequent in-memory operations on the Ensemble '''
   # prepare ensemble
   if varlist is not None:
     varlist = list(varlist)[:] # copy list
@@ -638,7 +688,7 @@ def loadEnsemble(names=None, name=None, title=None, varlist=None, aggregation=No
         if var not in varlist: varlist.append(var)
   # perpare ensemble and arguments
   if ldataset and ensemble_list: raise ArgumentError()
-  elif not ldataset: ensemble = Ensemble(name=name, title=title, basetype='Dataset')
+  elif not ldataset: ensemble = Ensemble(name=name, title=title, basetype='Dataset', NP=NP)
   # expand argument list
   if ensemble_list is None: ensemble_list = ['names'] if not ldataset else None
   elif 'aggregation' in ensemble_list: raise ArgumentError("'aggregation' can not be expanded")
@@ -647,31 +697,14 @@ def loadEnsemble(names=None, name=None, title=None, varlist=None, aggregation=No
                                 slices=slices, obsslices=obsslices, period=period, obs_period=obs_period, 
                                 years=years, name_tags=name_tags, ltrimT=ltrimT, bias_correction=bias_correction, 
                                 lensembleAxis=lensembleAxis, expand_list=ensemble_list, lproduct=ensemble_product, **kwargs)
-  for loadarg in loadargs:
-    # clean up arguments
-    name = loadarg.pop('names',None); name_tag = loadarg.pop('name_tags',None)
-    slcs = loadarg.pop('slices',None); obsslcs = loadarg.pop('obsslices',None)
-    slcs = dict() if slcs is None else slcs.copy(); 
-    prd = loadarg.pop('period',None); obsprd = loadarg.pop('obs_period',None)
-    if name in obs_list: prd = obsprd or prd 
-    # special handling of periods for time-series: user for slicing by year!
-    mode = loadarg['mode'].lower(); lts = 'time' in mode and 'series' in mode 
-    if lts and prd: slcs['years'] = prd          
-    if obsslcs and name in obs_list: slcs.update(**obsslcs) # add special slices for obs
-    if not lts: 
-      if prd: loadarg['period'] = prd
-      elif 'years' in slcs: loadarg['period'] = slcs['years']
-      if 'years' in slcs: del slcs['years'] # will cause an error with climatologies
-    # N.B.: currently VarNC's can only be sliced once, because we can't combine slices yet
-    # load individual dataset
-    dataset = loadDataset(name=name, WRF_exps=WRF_exps, CESM_exps=CESM_exps, WRF_ens=WRF_ens, 
-                          CESM_ens=CESM_ens, basin_list=basin_list, slices=slcs, **loadarg)
-    if name_tag is not None: 
-      if name_tag.startswith('_'): dataset.name += name_tag
-      else: dataset.name = name_tag
-    # apply slicing
-    if slcs: dataset = dataset(lminmax=lminmax, **slcs) # slice immediately 
-    if not ldataset: ensemble += dataset.load() # load data and add to ensemble
+  # load datasets (in worker processes, if NP > 1) and add to ensemble in order
+  NPIO = 1 if ldataset else NP if NIO is None else min(NP,NIO)
+  memargs = dict(ldataset=ldataset, lminmax=lminmax, obs_list=obs_list, ldetach=NPIO > 1, WRF_exps=WRF_exps, 
+                 CESM_exps=CESM_exps, WRF_ens=WRF_ens, CESM_ens=CESM_ens, basin_list=basin_list)
+  datasets = apply_in_processes([(loadMember, (loadarg,), memargs) for loadarg in loadargs], NP=NPIO)
+  if not ldataset: 
+    for dataset in datasets: ensemble += dataset
+  else: dataset = datasets[-1]
   # if input was not a list, just return dataset
   if ldataset: ensemble = dataset.load() # load data
   # select specific stations (if applicable)
@@ -14,6 +14,7 @@ import scipy.stats as ss
 from scipy.interpolate import griddata
 import numbers
 import functools
+import types
 import gc # garbage collection
 from warnings import warn
 # my own imports
@@ -23,13 +24,16 @@ from geodata.misc import checkIndex, isEqual, isInt, isNumber, AttrDict, joinDic
   EnsembleError
 from geodata.misc import genStrArray, translateSeasons
 from geodata.misc import VariableError, AxisError, DataError, DatasetError, ArgumentError, EmptyDatasetError
-from processing.multiprocess import apply_along_axis
-from utils.misc import histogram, binedges, detrend, percentile, tabulate
+from processing.multiprocess import apply_along_axis, apply_in_threads
+from utils.misc import histogram, binedges, detrend, percentile, tabulate, StreamingHistogram, movingWindow
      
 # used for climatology and seasons
 monthlyUnitsList = ('month','months','month of the year')
 # global casting rule (for operations between arrays of different type)
 casting_rule = 'same_kind' # default since NumPy 1.7
+# instance attributes added by geodata.gdal (removed for pickling and restored from the grid definition)
+gdal_atts = ('gdal','isProjected','projection','geotransform','mapSize','bands','wrap360','xlon','ylat',
+             'griddef','gridfolder')
 
 class UnaryCheckAndCreateVar(object):
   ''' Decorator class for unary arithmetic operations that implements some sanity checks and 
@@ -1245,6 +1249,44 @@ class Variable(object):
     else: 
       return None
     
+  def _streamBlocks(self, axis_idx, blksize):
+    ''' A generator that returns blocks of data along an axis; if data are not loaded, blocks are read 
+        directly from file (VarNC), without loading the entire array; masked values are set to NaN. '''
+    if not self.data and hasattr(self,'ncvar'):
+      # direct file access does not work with squeezed dimensions or preset slices
+      if self.slices or self.ncvar.ndim != self.ndim + (1 if self.ncstrvar else 0): self.load()
+    if not isInt(blksize) or blksize < 1: raise ArgumentError(blksize)
+    idx = [slice(None),]*self.ndim
+    for i in xrange(0, self.shape[axis_idx], blksize):
+      idx[axis_idx] = slice(i, i+blksize)
+      data = self.__getitem__(tuple(idx)) # direct file access for VarNC
+      if isinstance(data, np.ma.MaskedArray): data = data.astype(np.float_).filled(np.NaN)
+      yield data
+  
+  def _streamLimits(self, axis_idx, blksize):
+    ''' Determine the data range block by block (like limits, but without loading data). '''
+    if self.data: return self.limits()
+    mn = np.inf; mx = -np.inf
+    for data in self._streamBlocks(axis_idx, blksize):
+      if data.size > 0: mn = np.fmin(mn, np.nanmin(data)); mx = np.fmax(mx, np.nanmax(data))
+    return mn,mx
+  
+  def _streamHistogram(self, axis_idx, blksize, binedgs):
+    ''' Accumulate a StreamingHistogram along an axis block by block. '''
+    sh = StreamingHistogram(binedgs)
+    for data in self._streamBlocks(axis_idx, blksize): sh.update(data, axis=axis_idx)
+    return sh
+  
+  def _streamVar(self, data, axis_idx, coord, axatts, varatts):
+    ''' Create a new Variable from a streaming reduction, replacing the reduction axis (like reduce). '''
+    raxatts = self.axes[axis_idx].atts.copy()
+    raxatts.update(axatts); raxatts.pop('coord',None)
+    axes = list(self.axes)
+    axes[axis_idx] = Axis(coord=coord, atts=raxatts)
+    vatts = self.atts.copy()
+    if varatts is not None: vatts.update(varatts)
+    return self.copy(data=data, axes=axes, atts=vatts)
+  
   # decorator arguments: slcaxes are passed on to slicing, axis and axes are converted to axidx
   #                      (axes is a list of reduction axes that are applied in sequence)
   # ReduceVar(asVar=None, axis=None, axes=None, lcheckAxis=True, **slcaxes)
@@ -1401,8 +1443,10 @@ class Variable(object):
     return rvar
   
   def histogram(self, bins=None, binedgs=None, ldensity=True, asVar=True, name=None, axis=None, axis_idx=None, 
-                lflatten=False, lcheckVar=True, lcheckAxis=True, haxatts=None, hvaratts=None, fillValue=None, **kwargs):
-    ''' Generate a histogram of along a given axis and preserve the other axes. '''
+                lflatten=False, lcheckVar=True, lcheckAxis=True, haxatts=None, hvaratts=None, fillValue=None, 
+                blksize=None, **kwargs):
+    ''' Generate a histogram of along a given axis and preserve the other axes; if blksize is given, 
+        the histogram is accumulated in blocks along the axis (VarNC data are not loaded). '''
     # some input checking
     if lflatten and axis is not None: raise ArgumentError
     if not lflatten and axis is None: 
@@ -1418,8 +1462,11 @@ class Variable(object):
       if lcheckAxis: raise AxisError, "Variable '{:s}' has no axis '{:s}'.".format(self.name, axis)
       else: return None
     kwargs['density'] = ldensity # overwrite parameter
+    lstream = blksize is not None and not lflatten
     # figure out bins
-    bins, binedgs = binedges(bins=bins, binedgs=binedgs, limits=self.limits(), lcheckVar=lcheckVar)
+    if lstream and binedgs is None: limits = self._streamLimits(axis_idx, blksize) # extra pass, if not loaded
+    else: limits = self.limits()
+    bins, binedgs = binedges(bins=bins, binedgs=binedgs, limits=limits, lcheckVar=lcheckVar)
     # setup histogram axis and variable attributes (special case)
     if asVar:
       axatts = self.atts.copy() # variable values become axis
@@ -1458,6 +1505,11 @@ class Variable(object):
       # create new Axis and Variable objects (1-D)
       if asVar: hvar = Variable(data=hdata, axes=(Axis(coord=bins, atts=axatts),), atts=varatts)
       else: hvar = hdata
+    elif lstream: # accumulate histogram in a single pass, block by block
+      sh = self._streamHistogram(axis_idx, blksize, binedgs=binedgs)
+      hdata = np.moveaxis(sh.histogram(density=ldensity), -1, axis_idx)
+      if asVar: hvar = self._streamVar(hdata, axis_idx, coord=bins, axatts=axatts, varatts=varatts)
+      else: hvar = hdata
     else: # use reduce to only apply to selected axis      
       # create a helper function that apllies the histogram along the specified axis
       def histfct(data, axis=None):
@@ -1528,9 +1580,12 @@ class Variable(object):
     return cvar
 
   def percentile(self, q=None, asVar=True, name=None, axis=None, axis_idx=None, lflatten=False,  
-                 lcheckVar=True, lcheckAxis=True, qaxatts=None, qvaratts=None, fillValue=None, **kwargs):
+                 lcheckVar=True, lcheckAxis=True, qaxatts=None, qvaratts=None, fillValue=None, 
+                 blksize=None, bins=None, binedgs=None, **kwargs):
     ''' Compute percentiles along a given axis and preserve the other axes. 
-        N.B.: this involves sorting the array and hence makes a full copy of the data '''
+        N.B.: this involves sorting the array and hence makes a full copy of the data; if blksize 
+              is given, percentiles are estimated in a single pass from a histogram (bins/binedgs) 
+              that is accumulated in blocks along the axis (VarNC data are not loaded) '''
     # some input checking
     if lflatten and axis is not None: raise ArgumentError
     if not lflatten and axis is None: 
@@ -1581,6 +1636,15 @@ class Variable(object):
       # create new Axis and Variable objects (1-D)
       if asVar: qvar = Variable(data=qdata, axes=(Axis(coord=qcoord, atts=axatts),), atts=varatts)
       else: qvar = qdata
+    elif blksize is not None: # estimate percentiles from a streaming histogram
+      if binedgs is None: limits = self._streamLimits(axis_idx, blksize) # extra pass, if not loaded
+      else: limits = None
+      if bins is None and binedgs is None: bins = 100 # default resolution
+      bins, binedgs = binedges(bins=bins, binedgs=binedgs, limits=limits, lcheckVar=lcheckVar)
+      sh = self._streamHistogram(axis_idx, blksize, binedgs=binedgs)
+      qdata = np.moveaxis(sh.percentile(q), -1, axis_idx)
+      if asVar: qvar = self._streamVar(qdata, axis_idx, coord=qcoord, axatts=axatts, varatts=varatts)
+      else: qvar = qdata
     else: # use reduce to only apply to selected axis      
       # create a helper function that apllies the histogram along the specified axis
       def qfct(data, axis=None):
@@ -2276,16 +2340,14 @@ class Variable(object):
     else:
       iaxis = self.axisIndex(axis, lcheck=lcheckAxis)
       # get axis coordinates
-      ax = self.axes[iaxis].coord if ldetrend else None
-      if ldetrend or lsmooth:
-        if lsmooth and ax.size <= window_len: window_len = ax.size-1 # shrink window, if data too short
-        # prepare parallel function call
-        aaa_fct = functools.partial(detrend, ax=ax, lcopy=False, 
-                                    ldetrend=ldetrend, ltrend=ltrend, degree=degree, rcond=rcond, w=w, 
-                                    lsmooth=lsmooth, lresidual=lresidual, window_len=window_len, window=window)
-        # apply along selected axis
-        data = apply_along_axis(aaa_fct, iaxis, data, laax=True)
-        # reassigning array (apply_along_axis creates a new results array)
+      ax = self.axes[iaxis].coord if ldetrend or ltrend else None
+      if ldetrend or ltrend or lsmooth:
+        if lsmooth and data.shape[iaxis] <= window_len: window_len = data.shape[iaxis]-1 # shrink window, if data too short
+        # detrend all time-series at once, using a shared least-squares factorization
+        data = detrend(data, ax=ax, axis=iaxis, lcopy=False, 
+                       ldetrend=ldetrend, ltrend=ltrend, degree=degree, rcond=rcond, w=w, 
+                       lsmooth=lsmooth, lresidual=lresidual, window_len=window_len, window=window)
+        # N.B.: masked values are converted to NaN and re-masked
     # standardize (subtract mean and divide by standard deviation)
     if lstandardize:
       # in-place with unsafe casting
@@ -2297,6 +2359,25 @@ class Variable(object):
     units = '' if lstandardize else self.units # no units after normalization
     # return results to decorator/wrapper
     return data, name, units
+  
+  @UnaryCheckAndCreateVar
+  def movingStat(self, window=None, stat='mean', axis='time', name=None, linplace=False, lcheckVar=True, 
+                 lcheckAxis=True, minobs=1, ddof=0):
+    ''' Compute moving-window statistics ('mean', 'sum', 'max', 'min', 'std' or 'var') along an axis, 
+        using a centered window (truncated at the boundaries); missing values are ignored '''
+    if self.dtype.kind in ('S',): 
+      if lcheckVar: raise VariableError, "Moving-window statistics do not work with string Variables!"
+      else: return None
+    if not self.hasAxis(axis):
+      if lcheckAxis: raise AxisError, "Variable '{:s}' has no axis '{:s}'.".format(self.name, axis)
+      else: return None
+    data = movingWindow(self.data_array, window, stat=stat, axis=self.axisIndex(axis), mode='same', 
+                        minobs=minobs, ddof=ddof)
+    # meta data
+    if name is None: name = '{:s}_{:s}{:d}'.format(self.name, stat, window) # e.g. 'pr_max5'
+    units = '({:s})^2'.format(self.units) if stat == 'var' else self.units
+    # return results to decorator/wrapper
+    return data, name, units
     
   def fitDist(self, axis='time', nsamples=None, dist=None, lflatten=False, name=None, atts=None, 
               var_dists=None, lsuffix=False, asVar=True, lcheckVar=True, lcheckAxis=True, 
@@ -2315,6 +2396,43 @@ class Variable(object):
     # return new variable
     return dvar
   
+  def bootstrap(self, statistic='mean', axis='time', nbs=1000, nsamples=None, ljoint=True, seed=None, NP=None, 
+                name=None, bootstrap_axis='bootstrap', asVar=True, lcheckVar=True, lcheckAxis=True, **kwargs):
+    ''' Evaluate a statistic along 'axis' for nbs bootstrap resamples of that axis; the result has a new 
+        outer-most bootstrap axis and the first element is the statistic of the original sample, so that 
+        confidence intervals can be obtained as percentiles along the bootstrap axis. Statistics can be 
+        named (e.g. 'mean', 'std', 'percentile' with 'q') or vectorized functions with an 'axis' keyword; 
+        resampling is reproducible with 'seed' and can be spread over NP worker processes. '''
+    from geodata.stats import bootstrap
+    if self.dtype.kind in ('S',): 
+      if lcheckVar: raise VariableError, "Bootstrapping does not work with string Variables!"
+      else: return None
+    if not self.hasAxis(axis):
+      if lcheckAxis: raise AxisError, "Variable '{:s}' has no axis '{:s}'.".format(self.name, axis)
+      else: return None
+    if not self.data: self.load()
+    # get data with sample axis last (masked values are replaced by NaN)
+    iaxis = self.axisIndex(axis)
+    if self.masked: data = self.data_array.astype(np.float).filled(np.NaN)
+    else: data = self.data_array
+    data = np.rollaxis(data, axis=iaxis, start=self.ndim)
+    bsdata = bootstrap(data, statistic=statistic, nbs=nbs, nsamples=nsamples, ljoint=ljoint, seed=seed, 
+                       NP=NP, **kwargs)
+    if asVar:
+      axes = self.axes[:iaxis] + self.axes[iaxis+1:]
+      if bsdata.shape != (nbs,)+data.shape[:-1]: 
+        raise NotImplementedError, "Only statistics that reduce the sample axis can be returned as Variables."
+      if self.masked: bsdata = ma.masked_invalid(bsdata, copy=False)
+      bsatts = dict(name=bootstrap_axis,units='',long_name='Bootstrap Samples')
+      statname = statistic if isinstance(statistic,basestring) else statistic.__name__
+      varatts = self.atts.copy()
+      varatts['name'] = name or '{:s}_{:s}'.format(self.name,statname)
+      varatts['long_name'] = 'Bootstrap {:s} of {:s}'.format(statname.title(), self.atts.get('long_name',self.name.title()))
+      bsvar = Variable(data=bsdata, axes=(Axis(coord=np.arange(nbs), atts=bsatts),)+axes, atts=varatts)
+    else: bsvar = bsdata
+    # return bootstrap Variable or array
+    return bsvar
+  
   @UnaryCheckAndCreateVar
   def _apply_ufunc(self, ufunc=None, linplace=False, lwarn=True, **kwargs):
     ''' Apply ufunc to data and return new Variable instance '''
@@ -2333,6 +2451,22 @@ class Variable(object):
     # return results to decorator/wrapper
     return data, name, units    
   
+  def __getstate__(self):
+    ''' support pickling (e.g. to return loaded Variables from worker processes): bound methods and 
+        GDAL attributes can't be pickled and are restored from the grid definition '''
+    state = {key:value for key,value in self.__dict__.iteritems() if not isinstance(value,types.MethodType)}
+    if state.get('gdal',False): state['_gdal'] = dict(griddef=state['griddef'], gridfolder=state['gridfolder'])
+    for att in gdal_atts: state.pop(att,None)
+    return state
+  
+  def __setstate__(self, state):
+    ''' support pickling: restore instance attributes and GDAL functionality '''
+    gdalargs = state.pop('_gdal',None)
+    self.__dict__.update(state)
+    if gdalargs is not None:
+      from geodata.gdal import addGDALtoVar # optional dependency
+      addGDALtoVar(self, **gdalargs)
+  
   def __getattr__(self, attr):
     ''' If the call is a numpy ufunc method that is not implemented by Variable, call the ufunc method
         on data using _apply_ufunc; if the call is a scipy.stats distribution or test that is supported
@@ -2340,6 +2474,7 @@ class Variable(object):
         selected to the variable. '''
     # N.B.: this method is only called as a fallback, if no class/instance attribute exists,
     #       i.e. Variable methods and attributes will always have precedent 
+    if attr.startswith('__'): raise AttributeError(attr) # special methods are not forwarded (e.g. pickle)
     # check if a ufunc of that name exists
     if hasattr(np,attr):
       ufunc = getattr(np,attr)
@@ -3344,11 +3479,29 @@ class Dataset(object):
     # return new dataset
     return newset
 
+  def __getstate__(self):
+    ''' support pickling (e.g. to return loaded Datasets from worker processes): bound methods and 
+        GDAL attributes can't be pickled and are restored from the grid definition '''
+    state = {key:value for key,value in self.__dict__.iteritems() if not isinstance(value,types.MethodType)}
+    if state.get('gdal',False): 
+      state['_gdal'] = dict(griddef=state['griddef'], gridfolder=state['gridfolder'], lwrap360=state['wrap360'])
+    for att in gdal_atts: state.pop(att,None)
+    return state
+  
+  def __setstate__(self, state):
+    ''' support pickling: restore instance attributes and GDAL functionality '''
+    gdalargs = state.pop('_gdal',None)
+    self.__dict__.update(state)
+    if gdalargs is not None:
+      from geodata.gdal import addGDALtoDataset # optional dependency
+      addGDALtoDataset(self, **gdalargs)
+
   def __getattr__(self, attr):
     ''' if the call is a Variable method that is not provided by Dataset, call the Variable method
         on all Variables using _apply_to_all '''
     # N.B.: this method is only called as a fallback, if no class/instance attribute exists,
     #       i.e. Dataset methods and attributes will always have precedent 
+    if attr.startswith('__'): raise AttributeError(attr) # special methods are not forwarded (e.g. pickle)
     if len(self.variables) == 0: 
       raise EmptyDatasetError("Unable to to apply request to Variables; Dataset empty: \n{:s}".format(str(self)))
     # check if Variables have this attribute
@@ -3366,10 +3519,14 @@ class Dataset(object):
     else: raise AttributeError, attr # raise previous exception
       
 
-def concatVars(variables, axis=None, coordlim=None, idxlim=None, asVar=True, offset=None, 
+def concatVars(variables, axis=None, coordlim=None, idxlim=None, asVar=True, offset=None, out=None,
                name=None, units=None, axatts=None, varatts=None, lcheckAxis=True, lensembleAxis=None):
   ''' A function to concatenate Variables from different sources along a given axis;
-      this is useful to generate a continuous time series from an ensemble. '''
+      this is useful to generate a continuous time series from an ensemble. 
+      Members are read one at a time and copied into the output (members that were not loaded 
+      before are unloaded again, if possible), so that peak memory is only slightly larger than 
+      the output; 'out' can be a preallocated array, or a writable DatasetNetCDF, in which case 
+      the new Variable is created in the NetCDF file and data is streamed directly to disk. '''
   if lensembleAxis and axis is None: axis = 'ensemble'
   elif isinstance(axis,(Axis,basestring)) and not any([var.hasAxis(axis) for var in variables]):
     if lensembleAxis is None: lensembleAxis = True
@@ -3386,7 +3543,11 @@ def concatVars(variables, axis=None, coordlim=None, idxlim=None, asVar=True, off
   var0 = variables[0] # shortcut
   if not all([var.shape == var0.shape  for var in variables]): 
     raise AxisError, "All Variables need to have the same shape for concatenation!"
-  if not var0.data: var.load()
+  # figure out output type
+  lsink = isinstance(out,Dataset) # stream into a (NetCDF) Dataset
+  if lsink and not 'w' in getattr(out,'mode',''): 
+    raise DatasetError, "Output Dataset '{:s}' has to be a NetCDF Dataset in write mode.".format(out.name)
+  elif not lsink and out is not None and not isinstance(out,np.ndarray): raise TypeError, out
   # get some axis info
   if lnew:
     tax = 0 # add ensemble axis as first axis (assuming C order)
@@ -3396,10 +3557,11 @@ def concatVars(variables, axis=None, coordlim=None, idxlim=None, asVar=True, off
     if offset is None: offset = axt.coord[0] 
     if not isNumber(offset): raise TypeError
     delta = axt.coord[1] - axt.coord[0]
-    for var in variables:
-      axdiff = np.diff(axt.coord)
-      if lcheckAxis and not (axdiff.min()+100*floateps >= delta >=  axdiff.max()-100*floateps): 
-        raise AxisError, "Concatenation axis has to be evenly spaced!"
+    if lcheckAxis:
+      for var in variables:
+        axdiff = np.diff(var.getAxis(axis).coord)
+        if not (axdiff.min()+100*floateps >= delta >= axdiff.max()-100*floateps): 
+          raise AxisError, "Concatenation axis has to be evenly spaced!"
   # slicing options
   lcoordlim = False; lidxlim = False
   if coordlim is not None and idxlim is not None: 
@@ -3438,24 +3600,8 @@ def concatVars(variables, axis=None, coordlim=None, idxlim=None, asVar=True, off
     newshape = list(var0.shape)
     newshape[tax] = tlen
     newshape = tuple(newshape)
-  # load data
-  data = []
-  for var in variables:
-    if not var.data: var.load()
-    if lcoordlim: 
-      array = var(**coordlim)     
-    elif lidxlim:
-      array = var.getArray().take(xrange(*idxslc.indices(len(axt))), axis=tax)
-    else: 
-      array = var.getArray()
-    if lnew: array = array.reshape((1,)+array.shape) # add singleton dimension to concatenate over
-    data.append(array)
-  # concatenate
-  data = np.concatenate(data, axis=tax)
-  assert data.shape[tax] == tlen
-  assert data.shape == newshape
-  # cast as variable
-  if asVar:      
+  # create new axes and attributes
+  if asVar or lsink:      
     # create new concatenation axis
     if axis_obj is not None:
       if not isinstance(axis_obj, Axis): raise TypeError, axis_obj
@@ -3474,23 +3620,72 @@ def concatVars(variables, axis=None, coordlim=None, idxlim=None, asVar=True, off
       coord = np.arange(offset,tlen*delta+offset,delta) 
       if axatts is not None: tmpatts.update(axatts)      
       axes = list(var0.axes); axes[tax] = Axis(coord=coord, atts=tmpatts)
-    # create new variable
+    # new variable attributes
     vatts = var0.atts.copy()
     vatts['name'] = name or var0.name; vatts['units'] = units or var0.units
     if varatts is not None: vatts.update(varatts)
-    return var0.copy(data=data, axes=axes, atts=vatts)
-    # or return data
-  else: return data
+  # prepare output (preallocate to avoid temporary copies from np.concatenate)
+  dtype = np.result_type(*[var.dtype for var in variables])
+  if lsink:
+    # create empty NetCDF Variable in output Dataset and write directly to file
+    if out.hasVariable(vatts['name']): raise DatasetError, "Variable '{:s}' already exists in '{:s}'.".format(vatts['name'],out.name)
+    out.addVariable(Variable(axes=axes, atts=vatts, dtype=dtype), asNC=True, copy=True)
+    outvar = out.getVariable(vatts['name'])
+    data = outvar.ncvar
+  elif out is not None:
+    if out.shape != newshape: raise AxisError, "Output array has shape {:s}, expected {:s}.".format(str(out.shape),str(newshape))
+    data = out
+  else: data = np.empty(newshape, dtype=dtype)
+  mask = None; lmasked = False
+  # load data one member at a time and copy into output
+  slc = [slice(None)]*len(newshape); i0 = 0
+  for var,te in zip(variables,tes):
+    lunload = not var.data and not getattr(var,'slices',None) # only keep data loaded, if it was loaded before
+    # N.B.: sliced NetCDF Variables discard their slices when loaded, so they can't be reloaded later
+    if lunload: var.load()
+    if lcoordlim: 
+      array = var(asVar=False, **coordlim)     
+    elif lidxlim:
+      array = var.getArray(copy=False).take(xrange(*idxslc.indices(len(axt))), axis=tax)
+    else: 
+      array = var.getArray(copy=False)
+    if lnew: slc[tax] = i0 # ensemble members are stored in a singleton slice
+    else: slc[tax] = slice(i0,i0+te)
+    if lsink: 
+      data[tuple(slc)] = array # NetCDF module handles masked values
+    else:
+      data[tuple(slc)] = ma.getdata(array)
+      if isinstance(array, ma.MaskedArray): lmasked = True
+      if ma.is_masked(array):
+        if mask is None: mask = np.zeros(newshape, dtype=np.bool)
+        mask[tuple(slc)] = ma.getmaskarray(array)
+    del array
+    if lunload: var.unload()
+    i0 += 1 if lnew else te
+  assert i0 == tlen
+  # return NetCDF Variable (data remains on disk)
+  if lsink:
+    outvar.ncvar.group().sync()
+    return outvar 
+  if lmasked: data = ma.array(data, mask=ma.nomask if mask is None else mask, copy=False)
+  assert data.shape == newshape
+  # cast as variable
+  if asVar: return var0.copy(data=data, axes=axes, atts=vatts)
+  else: return data # or return data
   
   
 def concatDatasets(datasets, name=None, axis=None, coordlim=None, idxlim=None, offset=None, axatts=None,
                    title=None, lensembleAxis=None, lignoreConst=True, time_axes=None, check_vars=None,
-                   lcpOther=True, lcpAny=False, ldeepcopy=True, lcheckVars=True, lcheckAxis=True):
+                   lcpOther=True, lcpAny=False, ldeepcopy=True, lcheckVars=True, lcheckAxis=True, sink=None):
   ''' A function to concatenate Datasets from different sources along a given axis; this
       function essentially applies concatVars to every Variable and creates a new dataset. 
       When concatenating station or shape arrays, use check_vars with an array of unique ID's
       to make sure they are all in the same order (since only the first axis and ID variable
-      (pseudo-axis) will be retained. '''
+      (pseudo-axis) will be retained. 
+      If a writable DatasetNetCDF is passed as 'sink', concatenated Variables are streamed 
+      directly into the NetCDF file, and the sink Dataset is returned. '''
+  if sink is not None and not 'w' in getattr(sink,'mode',''): 
+    raise DatasetError, "Sink Dataset has to be a NetCDF Dataset in write mode."
   if lensembleAxis and axis is None: axis = 'ensemble'
   if lignoreConst and time_axes is None: time_axes = ('time','year')
   elif isinstance(axis,(Axis,basestring)) and not any([ds.hasAxis(axis) for ds in datasets]):
@@ -3560,7 +3755,7 @@ def concatDatasets(datasets, name=None, axis=None, coordlim=None, idxlim=None, o
           if lall: 
             variables[varname] = concatVars([ds.variables[varname] for ds in datasets], axis=axis, asVar=True,
                                             coordlim=coordlim, idxlim=idxlim, offset=offset, axatts=axatts,
-                                            lcheckAxis=lcheckAxis, lensembleAxis=lensembleAxis)
+                                            lcheckAxis=lcheckAxis, lensembleAxis=lensembleAxis, out=sink)
           else:
             if lcheckVars:       
               raise DatasetError, "Variable '{:s}' is not present in all Datasets!".format(varname)
@@ -3575,7 +3770,15 @@ def concatDatasets(datasets, name=None, axis=None, coordlim=None, idxlim=None, o
       while catax is None:
         catax = variables.values()[c].getAxis(axis, lcheck=False); c += 1 # return None if not present
       axes[axis] = catax # add new concatenation axis
-    # copy first dataset and replace concatenation axis and variables
+  # add remaining variables to sink and return sink
+  if sink is not None:
+    for varname,var in variables.iteritems():
+      if var is not None and not sink.hasVariable(varname):
+        if not var.data: var.load()
+        sink.addVariable(var, asNC=True, copy=True, deepcopy=ldeepcopy)
+    sink.sync()
+    return sink
+  # copy first dataset and replace concatenation axis and variables
   return datasets[0].copy(axes=axes, name=name, title=title, variables=variables, varlist=None, 
                           varargs=None, axesdeep=True, varsdeep=False)
 
@@ -3591,6 +3794,7 @@ class Ensemble(object):
   idkey     = 'name'  # property of members used for unique identification
   ens_name  = ''      # name of the ensemble
   ens_title = ''      # printable title used for the ensemble
+  NP        = 1       # number of threads used to dispatch method calls to members
   
   def __init__(self, *members, **kwargs):
     ''' Initialize an ensemble from a list of members (the list arguments);
@@ -3603,12 +3807,18 @@ class Ensemble(object):
     idkey        = property of members used for unique identification
     ens_name     = name of the ensemble (string)
     ens_title    = printable title used for the ensemble (string)
+    NP           = number of threads used to dispatch method calls to members (default: 1, serial);
+                   threads only overlap numpy computations that release the GIL, and members with 
+                   NetCDF variables are always processed serially (not thread-safe); for parallel 
+                   loading use worker processes (e.g. loadEnsemble with NP > 1)
     '''
     # add members
     self.members = list(members)
     # add certain properties
     self.ens_name = kwargs.pop('name','')
     self.ens_title = kwargs.pop('title','')
+    self.NP = kwargs.pop('NP',self.NP)
+    if not isinstance(self.NP,(int,np.integer)) or self.NP < 1: raise ArgumentError, self.NP
     # no need to be too restrictive
     if 'basetype' in kwargs:
       self.basetype = kwargs.pop('basetype') # don't want to add that later! 
@@ -3633,13 +3843,25 @@ class Ensemble(object):
       self.idkeys.append(memid)
       self.__dict__[memid] = member
       
+  def _lthreads(self):
+    ''' internal helper method to decide if member calls can be dispatched to threads: netCDF-C is 
+        not thread-safe, so that members with NetCDF variables or axes are processed serially '''
+    if self.NP == 1: return False
+    from geodata.netcdf import VarNC # avoid circular import
+    for member in self.members:
+      if isinstance(member,Dataset): varlist = member.variables.values() + member.axes.values()
+      elif isinstance(member,Variable): varlist = [member] + list(member.axes)
+      else: varlist = []
+      if any(isinstance(var,VarNC) for var in varlist): return False
+    return True
+  
   def _recastList(self, fs):
     ''' internal helper method to decide if a list or Ensemble should be returned '''
     if all(f is None for f in fs): return None # suppress list of None's
     elif all([not callable(f) and not isinstance(f, (Variable,Dataset)) for f in fs]): return fs  
     elif all([isinstance(f, (Variable,Dataset)) for f in fs]):
       # N.B.: technically, Variable instances are callable, but that's not what we want here...
-      ens_args = dict(name=self.ens_name, title=self.ens_title)
+      ens_args = dict(name=self.ens_name, title=self.ens_title, NP=self.NP)
       if all([isinstance(f, Axis) for f in fs]): 
         return fs
       # N.B.: axes are often shared, so we can't have an ensemble
@@ -3684,6 +3906,7 @@ class Ensemble(object):
   def __getattr__(self, attr):
     ''' This is where all the magic happens: defer calls to methods etc. to the 
         ensemble members and return a list of values. '''
+    if attr.startswith('__'): raise AttributeError(attr) # special methods are not forwarded (e.g. pickle)
     # intercept some list methods
     #print dir(self.members), attr, attr in dir(self.members)
     # determine whether we need a wrapper
@@ -3698,9 +3921,11 @@ class Ensemble(object):
           for arg in args: # swap nested list order ("transpose") 
             for i in xrange(len(argslists)): 
               argslists[i].append(arg[i])
-          res = [f(*args, **kwargs) for args,f in zip(argslists,fs)]
+          tasks = [(f, args, kwargs) for args,f in zip(argslists,fs)]
         else:
-          res = [f(*args, **kwargs) for f in fs]
+          tasks = [(f, args, kwargs) for f in fs]
+        # execute member calls (concurrently, if NP > 1 and no NetCDF access); results are returned in order
+        res = apply_in_threads(tasks, NP=self.NP if self._lthreads() else 1)
         return self._recastList(res) # code is reused, hens pulled out
       # return function wrapper
       return wrapper
@@ -3783,6 +4008,39 @@ class Ensemble(object):
     # return check
     return not self.hasMember(member)
   
+  def stackMembers(self, varname=None, axis='ensemble', axatts=None, name=None, units=None, 
+                   varatts=None, lcheckAxis=True):
+    ''' Stack members with matching grids into a single Variable (or Dataset) with a new (leading) 
+        ensemble axis, which is backed by one contiguous array; statistics over the ensemble (mean, 
+        spread, percentiles, significance tests etc.) can then be computed as vectorized reductions 
+        along the ensemble axis, instead of per-member calls; for Dataset members, 'varname' selects 
+        a Variable to stack, otherwise all Variables are stacked using concatDatasets. '''
+    if len(self.members) == 0: raise EnsembleError("Can not stack an empty Ensemble!")
+    if isinstance(axis,Axis) and len(axis) != len(self.members): raise AxisError(axis)
+    if self.basetype is Dataset or all(isinstance(member,Dataset) for member in self.members):
+      if varname is None:
+        # stack all variables and return new Dataset with ensemble axis
+        return concatDatasets(self.members, name=name or self.ens_name, title=self.ens_title, axis=axis, 
+                              axatts=axatts, lensembleAxis=True, lcheckAxis=lcheckAxis)
+      variables = [member.getVariable(varname) for member in self.members]
+    elif varname is not None: raise ArgumentError("Argument 'varname' only applies to Dataset members.")
+    else: variables = self.members
+    # check that grids/axes match (members are stacked using the axes of the first member)
+    var0 = variables[0]
+    for var in variables[1:]:
+      if var.shape != var0.shape:
+        raise AxisError("Member '{:s}' has shape {:s}, expected {:s}.".format(var.name,str(var.shape),str(var0.shape)))
+      if lcheckAxis:
+        for ax,ax0 in zip(var.axes,var0.axes):
+          if ax.name != ax0.name or ( ax.data and ax0.data and not isEqual(ax.coord,ax0.coord) ):
+            raise AxisError("Axis '{:s}' of member '{:s}' does not match.".format(ax.name,var.name))
+    # stack member data using concatVars
+    if axatts is None: axatts = dict()
+    else: axatts = axatts.copy()
+    axatts.setdefault('long_name', ', '.join(str(getattr(member,self.idkey)) for member in self.members))
+    return concatVars(variables, axis=axis, asVar=True, name=name, units=units, axatts=axatts, 
+                      varatts=varatts, lcheckAxis=False, lensembleAxis=True)
+  
 #   def __mul__(self, n):
 #     ''' how to combine with other objects '''
 #     if isInt(n):
@@ -3840,7 +4098,7 @@ class Ensemble(object):
     elif isinstance(item, (list,tuple,np.ndarray)):
       # index/label list like ndarray
       members = [self[i] for i in item] # select members
-      kwargs = dict(basetype=self.basetype, idkey=self.idkey, name=self.ens_name, title=self.ens_title)
+      kwargs = dict(basetype=self.basetype, idkey=self.idkey, name=self.ens_name, title=self.ens_title, NP=self.NP)
       return Ensemble(*members,**kwargs) # return new ensemble with selected members
     else: raise TypeError
   
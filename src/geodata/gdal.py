@@ -14,13 +14,13 @@ import numpy as np
 import numpy.ma as ma
 from collections import OrderedDict
 import types  # needed to bind functions to objects
-import os, gzip # griddef pickles compress well
+import os, gzip, shutil # griddef pickles compress well
 try: import cPickle as pickle
 except: import pickle
 
 
 # gdal imports
-from osgeo import gdal, osr, ogr
+from osgeo import gdal, osr, ogr, gdal_array
 from utils.misc import flip
 # register RAM driver
 ramdrv = gdal.GetDriverByName('MEM')
@@ -36,6 +36,7 @@ from geodata.base import Variable, Axis, Dataset
 from geodata.misc import printList, isEqual, isInt, isFloat, isNumber , ArgumentError,\
   VariableError
 from geodata.misc import DataError, AxisError, GDALError, DatasetError
+from processing.multiprocess import TaskQueue
 
 # read data root folder from environment variable
 data_root = os.getenv('DATA_ROOT')
@@ -498,6 +499,46 @@ def getGeotransform(xlon=None, ylat=None, geotransform=None):
   return geotransform
 
 
+## functions to write raster files
+
+# default file extensions for raster formats (GDAL driver names)
+raster_extensions = dict(AAIGrid='.asc', GTiff='.tif', ENVI='.bil', HFA='.img')
+
+def writeRasterFile(filepath, data, geotransform, projection, noDataValue=None, driver='AAIGrid', options=None, 
+                    lcompress=False):
+  ''' write an array with shape (bands, y, x) to a raster file, using the specified GDAL driver and creation 
+      options; ASCII rasters can be gzipped and GeoTIFFs compressed (lcompress); this is a module function, 
+      so that it can be executed in a pool of worker processes; returns the actual file path '''
+  if data.ndim == 2: data = data.reshape((1,)+data.shape)
+  if data.ndim != 3: raise AxisError, data.shape
+  options = list(options) if options else []
+  lgzip = False
+  if lcompress:
+    if driver == 'AAIGrid': lgzip = True 
+    elif driver == 'GTiff': 
+      if not any([opt.upper().startswith('COMPRESS=') for opt in options]): options.append('COMPRESS=DEFLATE')
+    else: raise NotImplementedError, "Compression is not supported for raster format '{:s}'.".format(driver)
+  # wrap the array in a GDAL dataset (NUMPY driver), without copying the data
+  dataset = gdal_array.OpenArray(np.ascontiguousarray(data)) # no copy, if already contiguous
+  if dataset is None: raise GDALError, "Unable to wrap array in GDAL dataset for raster file '{:s}'.".format(filepath)
+  dataset.SetGeoTransform(geotransform)
+  dataset.SetProjection(projection)
+  if noDataValue is not None:
+    for i in xrange(dataset.RasterCount): dataset.GetRasterBand(i + 1).SetNoDataValue(float(noDataValue))
+  # write raster file
+  rasdrv = gdal.GetDriverByName(driver)
+  if rasdrv is None: raise GDALError, "Unknown GDAL raster driver: '{:s}'".format(driver)
+  rasfile = rasdrv.CreateCopy(filepath, dataset, 0, options)
+  if rasfile is None: raise GDALError, "Unable to write raster file '{:s}' ({:s} driver).".format(filepath,driver)
+  # for good form, indirectly close the datasets (flushes the file)
+  rasfile = None; dataset = None; rasdrv = None
+  # compress ASCII raster
+  if lgzip:
+    with open(filepath, 'rb') as src, gzip.open(filepath+'.gz', 'wb') as dst: shutil.copyfileobj(src, dst)
+    os.remove(filepath); filepath += '.gz'
+  return filepath
+
+
 ## functions to add GDAL functionality to existing Variable and Dataset instances
 
 def addGDALtoVar(var, griddef=None, projection=None, geotransform=None, gridfolder=None, loverride=False):
@@ -629,8 +670,11 @@ def addGDALtoVar(var, griddef=None, projection=None, geotransform=None, gridfold
     var.copy = types.MethodType(copy, var)
         
     # define GDAL-related 'class methods'  
-    def getGDAL(self, load=True, allocate=True, wrap360=False, fillValue=None, noDataValue=None, lupperleft=False, lfillNaN=False):
-      ''' Method that returns a gdal dataset, ready for use with GDAL routines. '''
+    def getGDAL(self, load=True, allocate=True, wrap360=False, fillValue=None, noDataValue=None, lupperleft=False, 
+                lfillNaN=False, lnumpy=False):
+      ''' Method that returns a gdal dataset, ready for use with GDAL routines; if lnumpy=True, the prepared 
+          array, geotransform and NoData value are returned instead (e.g. to write files in other processes). '''
+      if lnumpy and not load: raise ArgumentError, "Can only return a numpy array, if data is loaded."
       lperi = False
       if self.gdal and self.projection is not None:
         axstr = "'x' and 'y'" if isProjected else "'lon' and 'lat'"
@@ -650,20 +694,20 @@ def addGDALtoVar(var, griddef=None, projection=None, geotransform=None, gridfold
             tmp = np.zeros((self.bands, self.mapSize[0], self.mapSize[1]+1))
             tmp[:,:,0:-1] = data; tmp[:,:,-1] = data[:,:,0]
             data = tmp
-        elif allocate: 
-          data = np.zeros((self.bands,) + self.mapSize, dtype=self.dtype) + fillValue
+        # N.B.: allocated (empty) datasets are filled directly in GDAL (see below)
         # if we have a fillValue, replace NaN's with the fillValues
-        if lfillNaN and fillValue is not None and np.issubdtype(data.dtype, np.inexact): 
+        if load and lfillNaN and fillValue is not None and np.issubdtype(data.dtype, np.inexact): 
           data[np.isnan(data)] = fillValue
         # to insure correct wrapping, geographic coordinate systems with longitudes reanging 
         # from 0 to 360 can optionally be shifted back by 180, to conform to GDAL conventions 
         # (the shift will only affect the GDAL Dataset, not the actual Variable) 
+        # N.B.: flips are applied as views and the shift is applied when the array is copied below
+        shift = 0 # shift along the x-axis
         if wrap360:
           geotransform = list(self.geotransform)
           shift = int( 180. / geotransform[1] )
-          assert len(self.xlon) == data.shape[2], "Make sure the X-Axis is the last one!"
+          assert len(self.xlon) == self.mapSize[1], "Make sure the X-Axis is the last one!"
           # N.B.: GDAL enforces the following shape: (band, lat, lon)
-          if load: data = np.roll(data, shift, axis=2) # shift data along the x-axis
           geotransform[0] = geotransform[0] - shift*geotransform[1] # record shift in geotransform 
         else: geotransform = self.geotransform
         # enforce orientation
@@ -672,39 +716,52 @@ def addGDALtoVar(var, griddef=None, projection=None, geotransform=None, gridfold
           geotransform = (geotransform[0],geotransform[1],geotransform[2],
                           geotransform[3] + self.mapSize[0]*geotransform[5], # shift North
                           geotransform[4], -1*geotransform[5]) # make dy < 0
-          data = flip(data, axis=-2) # flip y-axis
+          if load: data = flip(data, axis=-2) # flip y-axis
         elif not lupperleft and geotransform[5] < 0:
           # use lower-left corner as reference; default in GeoPy and works, if dy > 0
           geotransform = (geotransform[0],geotransform[1],geotransform[2],
                           geotransform[3] + self.mapSize[0]*geotransform[5], # shift South, dy < 0 !!!
                           geotransform[4], -1*geotransform[5]) # make dy > 0
-          data = flip(data, axis=-2) # flip y-axis
+          if load: data = flip(data, axis=-2) # flip y-axis
         # determine GDAL data type        
-        if self.dtype == 'float32': gdt = gdal.GDT_Float32
-        elif self.dtype == 'float64': gdt = gdal.GDT_Float64
-        elif self.dtype == 'int16': gdt = gdal.GDT_Int16
-        elif self.dtype == 'int32': gdt = gdal.GDT_Int32
+        if self.dtype == 'float32': dtype = 'f4'; gdt = gdal.GDT_Float32
+        elif self.dtype == 'float64': dtype = 'f8'; gdt = gdal.GDT_Float64
+        elif self.dtype == 'int16': dtype = 'i2'; gdt = gdal.GDT_Int16
+        elif self.dtype == 'int32': dtype = 'i4'; gdt = gdal.GDT_Int32
         elif np.issubdtype(self.dtype,(float,np.inexact)):
-          data = data.astype('f4'); gdt = gdal.GDT_Float32          
+          dtype = 'f4'; gdt = gdal.GDT_Float32          
         elif np.issubdtype(self.dtype,(int,np.integer)):
-          data = data.astype('i2'); gdt = gdal.GDT_Int16  
+          dtype = 'i2'; gdt = gdal.GDT_Int16  
         elif np.issubdtype(self.dtype,(bool,np.bool)):
-          data = data.astype('i2'); gdt = gdal.GDT_Int16  
+          dtype = 'i2'; gdt = gdal.GDT_Int16  
         else: raise TypeError, 'Cannot translate numpy data type into GDAL data type!'
         #print self.name, self.dtype, data.dtype
-        # create GDAL dataset 
-        xe = len(self.xlon); ye = len(self.ylat) 
-        if lperi: dataset = ramdrv.Create(self.name, int(xe)+1, int(ye), int(self.bands), int(gdt))
-        else: dataset = ramdrv.Create(self.name, int(xe), int(ye), int(self.bands), int(gdt)) 
-        # N.B.: for some reason a dataset is always initialized with 6 bands
+        if load: 
+          # apply shift, flip and type conversion in one copy (if necessary) and wrap the numpy 
+          # buffer in a GDAL dataset (NUMPY driver), so that all bands are assigned without copying
+          # N.B.: NUMPY datasets are read-only, so this can only be used for source data
+          if shift: 
+            # GDAL can only wrap a single contiguous buffer, so a shift always requires a copy; the two 
+            # halves are assigned directly, so that the type conversion does not add another copy
+            nx = data.shape[2]; ns = shift%nx; shifted = np.empty(data.shape, dtype=dtype)
+            shifted[:,:,ns:] = data[:,:,:nx-ns]; shifted[:,:,:ns] = data[:,:,nx-ns:]
+            data = shifted
+          else: data = np.ascontiguousarray(data, dtype=dtype) # no copy, if already contiguous and of that type
+          if lnumpy: return data, tuple(geotransform), float(noDataValue) if self.masked else None
+          dataset = gdal_array.OpenArray(data)
+          if dataset is None: raise GDALError, "Unable to wrap array of Variable '{:s}' in GDAL dataset.".format(self.name)
+        else: 
+          # create empty GDAL dataset (MEM driver), which is writable (e.g. as target for ReprojectImage)
+          xe = len(self.xlon); ye = len(self.ylat) 
+          if lperi: dataset = ramdrv.Create(self.name, int(xe)+1, int(ye), int(self.bands), int(gdt))
+          else: dataset = ramdrv.Create(self.name, int(xe), int(ye), int(self.bands), int(gdt)) 
+          if allocate: # initialize with fill value, without allocating a numpy array
+            for i in xrange(self.bands): dataset.GetRasterBand(i + 1).Fill(float(fillValue))
+        if self.masked and ( load or allocate ): 
+          for i in xrange(self.bands): dataset.GetRasterBand(i + 1).SetNoDataValue(float(noDataValue))
         # set projection parameters
         dataset.SetGeoTransform(geotransform)  # does the order matter?
         dataset.SetProjection(self.projection.ExportToWkt())  # is .ExportToWkt() necessary?        
-        if load or allocate: 
-          # assign data
-          for i in xrange(self.bands):
-            dataset.GetRasterBand(i + 1).WriteArray(data[i, :, :])
-            if self.masked: dataset.GetRasterBand(i + 1).SetNoDataValue(float(noDataValue))
       else: dataset = None
       # return dataset
       return dataset
@@ -908,14 +965,24 @@ def addGDALtoVar(var, griddef=None, projection=None, geotransform=None, gridfold
     
     # save variable as Arc/Info ASCII Grid / ASCII raster file using GDAL
     def ASCII_raster(self, prefix=None, folder=None, ext='.asc', filepath=None, wrap360=False, 
-                     fillValue=None, noDataValue=None, lcoord=False, lfortran=True, formatter=None):
+                     fillValue=None, noDataValue=None, lcoord=False, lfortran=True, formatter=None, 
+                     driver='AAIGrid', options=None, lcompress=False, lbands=False, NP=None, tasks=None):
       ''' Export data to  Arc/Info ASCII Grid (ASCII raster format); if no filename is given, the filename will 
           be constructed from the variable name and the slice; note that each file can only contain a single 
           horizontal slice. 
+          Other (binary) formats can be selected using the GDAL driver name (e.g. 'GTiff' or 'ENVI') and 
+          creation options; lcompress gzips ASCII rasters and compresses GeoTIFFs; if lbands=True, the last 
+          non-horizontal axis is written as bands of a single file (not for ASCII rasters). Files are 
+          written in parallel by NP processes; tasks is used internally to queue files for writing.
           N.B.: The implementation is recursive, i.e. variables with more than two dimensions are sliced and 
           each a number of speperate calls to this function equal to the length of the dimension is issued; this
           is repeated for every dimension (over two), until the input is two-dimensional.
       '''
+      if lbands and driver == 'AAIGrid': raise ArgumentError, "ASCII rasters can only contain a single band."
+      if ext == '.asc' and driver != 'AAIGrid': ext = raster_extensions.get(driver,'') # default extension
+      # queue write tasks; slices are written in parallel while the next slices are processed 
+      ltop = tasks is None
+      if ltop: tasks = TaskQueue(NP=NP)
       # figure out filepath
       if filepath:
         # N.B.: This is basically a special option to export 2D fields to a custom path; if the dataset
@@ -936,25 +1003,23 @@ def addGDALtoVar(var, griddef=None, projection=None, geotransform=None, gridfold
           raise IOError, "Need to specify a folder or absolute path to export to ASCII raster file."
         prefix = prefix or self.name
       # handle different cases with recursion
-      if self.ndim == 2: 
+      if self.ndim == 2 or ( lbands and self.ndim == 3 ): 
         # N.B.: GDAL can only write 2D datasets to ASCII raster; multi-dimensional datasets are 
         #       sliced recursively until they are 2D; at this point the recursion ends and the 
         #       sliced dataset/Variable can be exported to ASCII raster format (one per file).
-        # get GDAL datast
-        dataset = getGDAL(self, load=True, allocate=True, wrap360=wrap360, lupperleft=True, 
-                          lfillNaN=True, fillValue=fillValue, noDataValue=noDataValue)
+        # get prepared (flipped, shifted and typed) array; the GDAL dataset is created by the worker process
+        data, geotransform, ndv = getGDAL(self, load=True, allocate=True, wrap360=wrap360, lupperleft=True, 
+                                          lfillNaN=True, fillValue=fillValue, noDataValue=noDataValue, lnumpy=True)
         # N.B.: apparently the raster driver always assumes that the geotransform reference point is the upper left corner
-        # get ASCII raster file driver
-        ascii = gdal.GetDriverByName('AAIGrid')
         # construct filepath for 2D fields
         if not filepath: 
           filepath = '{:s}/{:s}'.format(folder,prefix)
           if ext: filepath = '{:s}{:s}'.format(filepath,ext)
-        # easy: just write ASCII raster file
-        ascii.CreateCopy(filepath, dataset)
+        # the file is written by a worker process, so only pass data and meta data
+        args = (filepath, data, geotransform, self.projection.ExportToWkt())
+        kwargs = dict(noDataValue=ndv, driver=driver, options=options, lcompress=lcompress)
+        tasks.append( (writeRasterFile, args, kwargs) )
         filelist = filepath # this will be returned
-        # for good form, indirectly close the dataset
-        dataset = None; ascii = None
       elif self.ndim > 2: 
         # for ND fields, a new file for each band is necessary, hence filepath changes for every band
         fax = self.axes[0] # take first axis to iterate over
@@ -983,11 +1048,16 @@ def addGDALtoVar(var, griddef=None, projection=None, geotransform=None, gridfold
           else: pf = prefix.format(i+one) # start index at 1 --- Fortran convention
           # now call this function recursively for every slice, until input is 2D
           filepath = ASCII_raster(slcvar, prefix=pf, folder=folder, ext=ext, filepath=None, 
-                                  wrap360=wrap360, fillValue=fillValue, noDataValue=noDataValue)
+                                  wrap360=wrap360, fillValue=fillValue, noDataValue=noDataValue, 
+                                  driver=driver, options=options, lcompress=lcompress, lbands=lbands, tasks=tasks)
           if isinstance(filepath, basestring): filelist.append(filepath)
           else: filelist.extend(filepath)
           # N.B.: the function basically returns the last filepath
       else: raise NotImplementedError, self
+      # wait for remaining files and return actual file paths (in the same order)
+      if ltop:
+        filepaths = tasks.join()
+        filelist = filepaths[0] if isinstance(filelist, basestring) else filepaths
       # return full path to file
       return filelist
     # add new method to object
@@ -1225,10 +1295,12 @@ def addGDALtoDataset(dataset, griddef=None, projection=None, geotransform=None,
     
     # save variable as Arc/Info ASCII Grid / ASCII raster file using GDAL
     def ASCII_raster(self, varlist=None, prefix=None, folder=None, ext='.asc', wrap360=False, 
-                     fillValue=None, noDataValue=None, lcoord=False, lfortran=True, formatter=None):
+                     fillValue=None, noDataValue=None, lcoord=False, lfortran=True, formatter=None, 
+                     driver='AAIGrid', options=None, lcompress=False, lbands=False, NP=None):
       ''' Export data to  Arc/Info ASCII Grid (ASCII raster format); the filename will be constructed 
           from a prefix, the variable name and the slice; note that each file can only contain a single 
-          horizontal slice (2D).  
+          horizontal slice (2D). Other raster formats can be selected using the GDAL driver name (see 
+          Variable method); files of all variables are written in parallel by NP processes.
       '''
       # check arguments
       if varlist is None: varlist = self.variables.keys()
@@ -1244,7 +1316,7 @@ def addGDALtoDataset(dataset, griddef=None, projection=None, geotransform=None,
         raise ArgumentError, "A valid folder is necessary to export a dataset to ASCII raster format."
       if not os.path.exists(folder): os.makedirs(folder) # make sure folder exists
       # loop over variables
-      filedict = dict()
+      filedict = dict(); tasks = TaskQueue(NP=NP)
       for varname,vartag in varlist.iteritems():
         var = self.variables[varname] # variable isntance
         if vartag is None: vartag = var.name
@@ -1253,11 +1325,15 @@ def addGDALtoDataset(dataset, griddef=None, projection=None, geotransform=None,
           # add prefix to variable name
           pf = '{:s}_{:s}'.format(prefix,vartag) if prefix else vartag
           # call export function on each variable
-          filelist = var.ASCII_raster(prefix=pf, folder=folder, ext=ext, filepath=None, wrap360=wrap360, 
-                                      fillValue=fillValue, noDataValue=noDataValue, lcoord=lcoord, 
-                                      lfortran=lfortran, formatter=formatter)
-          if isinstance(filelist,basestring): filelist = [filelist]
-          filedict[vartag] = filelist
+          i0 = len(tasks) # queue write tasks for all variables
+          var.ASCII_raster(prefix=pf, folder=folder, ext=ext, filepath=None, wrap360=wrap360, 
+                           fillValue=fillValue, noDataValue=noDataValue, lcoord=lcoord, lfortran=lfortran, 
+                           formatter=formatter, driver=driver, options=options, lcompress=lcompress, 
+                           lbands=lbands, tasks=tasks)
+          filedict[vartag] = (i0,len(tasks))
+      # wait for remaining files and assign actual file paths
+      filepaths = tasks.join()
+      filedict = {vartag:filepaths[i0:i1] for vartag,(i0,i1) in filedict.iteritems()}
       return filedict
     # add new method to object
     dataset.ASCII_raster = types.MethodType(ASCII_raster, dataset)    
@@ -12,8 +12,10 @@ subclasses for handling distribution functions over grid points.
 import numpy as np
 import numpy.ma as ma
 import scipy.stats as ss
+from scipy.optimize import fmin
+from scipy.special import gamma as gamma_fct
 from numpy.linalg.linalg import LinAlgError
-from processing.multiprocess import apply_along_axis
+from processing.multiprocess import apply_along_axis, apply_in_processes
 import functools
 # internal imports
 from geodata.base import Variable, Axis
@@ -109,25 +111,32 @@ def shapiro_wrapper(data, reta=False, ignoreNaN=True):
 ## bivariate statistical tests
     
 # Kolmogorov-Smirnov Test on 2 samples
-def ks_2samp(sample1, sample2, lstatistic=False, ignoreNaN=True, **kwargs):
+def ks_2samp(sample1, sample2, lstatistic=False, ignoreNaN=True, lvectorize=True, **kwargs):
   ''' Apply the Kolmogorov-Smirnov Test, to test whether two samples are drawn from the same
       underlying (continuous) distribution; a high p-value means, the two samples are likely
       drawn from the same distribution. 
       The Kolmogorov-Smirnov Test is a non-parametric test that works well for all types of 
-      distributions (normal and non-normal). '''
+      distributions (normal and non-normal). 
+      If lvectorize=True, a vectorized Numpy implementation is used; otherwise the SciPy 
+      function is applied at every point. '''
   if lstatistic: raise NotImplementedError, "Return of test statistic is not yet implemented; only p-values are returned."
   testfct = functools.partial(ks_2samp_wrapper, ignoreNaN=ignoreNaN)
-  pvar = apply_stat_test_2samp(sample1, sample2, fct=testfct, laax=True, 
+  pvar = apply_stat_test_2samp(sample1, sample2, fct=testfct, laax=not lvectorize, 
                                lpval=True, lrho=False, **kwargs)
   return pvar
 kstest = ks_2samp # alias
 
 # apply-along-axis wrapper for the Kolmogorov-Smirnov Test on 2 samples
-def ks_2samp_wrapper(data, size1=None, ignoreNaN=True):
+def ks_2samp_wrapper(data, size1=None, axis=None, ignoreNaN=True):
   ''' Apply the Kolmogorov-Smirnov Test, to test whether two samples are drawn from the same
       underlying (continuous) distribution. This is a wrapper for the SciPy function that 
-      removes NaN's, allows application over a field, and only returns the p-value. '''
-  if ignoreNaN:
+      removes NaN's, allows application over a field, and only returns the p-value; if an axis
+      is specified, the vectorized implementation is used (NaN's are always removed). '''
+  if axis is not None:
+    data1, data2 = np.split(data, [size1], axis=axis)
+    D, pval = myss.ks_2samp(data1, data2, axis=axis); del D
+    return pval
+  elif ignoreNaN:
     data1 = data[:size1]; data2 = data[size1:]
     nonans1 = np.invert(np.isnan(data1)) # test for NaN's
     nonans2 = np.invert(np.isnan(data2))
@@ -145,7 +154,7 @@ def ttest_ind(sample1, sample2, equal_var=True, lstatistic=False, ignoreNaN=True
   ''' Apply the Stundent's T-test for two independent samples, to test whether the samples 
       are drawn from the same underlying (continuous) distribution; a high p-value means, 
       the two samples are likely drawn from the same distribution. 
-      The T-test implementation is vectoriezed (unlike all other tests).'''
+      The T-test implementation is vectorized and ignores NaN's.'''
   if lstatistic: raise NotImplementedError, "Return of test statistic is not yet implemented; only p-values are returned."
   testfct = functools.partial(ttest_ind_wrapper, ignoreNaN=ignoreNaN, equal_var=equal_var)
   pvar = apply_stat_test_2samp(sample1, sample2, fct=testfct, laax=False, 
@@ -157,7 +166,8 @@ ttest = ttest_ind # alias
 def ttest_ind_wrapper(data, size1=None, axis=None, ignoreNaN=True, equal_var=True):
   ''' Apply the Stundent's T-test for two independent samples, to test whether the samples 
       are drawn from the same underlying (continuous) distribution. This is a wrapper for the SciPy function that 
-      removes NaN's and only returns the p-value (t-test is already vectorized). '''
+      removes NaN's and only returns the p-value; if an axis is specified, the vectorized (NaN-aware)
+      implementation is used (with ignoreNaN=False, points with NaN's in either sample are NaN). '''
   if axis is None and ignoreNaN:
     data1 = data[:size1]; data2 = data[size1:]
     nonans1 = np.invert(np.isnan(data1)) # test for NaN's
@@ -168,13 +178,16 @@ def ttest_ind_wrapper(data, size1=None, axis=None, ignoreNaN=True, equal_var=Tru
     data1 = data[:size1]; data2 = data[size1:]
   else:
     data1, data2 = np.split(data, [size1], axis=axis)
+    D, pval = myss.ttest_ind(data1, data2, axis=axis, equal_var=equal_var); del D
+    if not ignoreNaN: pval = np.where(np.isnan(data).any(axis=axis), np.NaN, pval) # propagate NaN's
+    return pval
   # apply test
-  D, pval = ss.ttest_ind(data1, data2, axis=axis, equal_var=equal_var); del D
+  D, pval = ss.ttest_ind(data1, data2, equal_var=equal_var); del D
   return pval  
 
 # Mann-Whitney Rank Test on 2 samples
 def mannwhitneyu(sample1, sample2, ignoreNaN=True, lonesided=False, lstatistic=False, 
-                 use_continuity=True, **kwargs):
+                 use_continuity=True, lvectorize=True, **kwargs):
   ''' Apply the Mann-Whitney Rank Test, to test whether two samples are drawn from the same
       underlying (continuous) distribution; a high p-value means, the two samples are likely
       drawn from the same distribution.
@@ -182,11 +195,12 @@ def mannwhitneyu(sample1, sample2, ignoreNaN=True, lonesided=False, lstatistic=F
       reliable as the T-test for normal distributions. It is more sophisticated than the 
       Wilcoxon Ranksum Test and also handles ties between ranks. 
       One-sided p-values test the hypothesis that one distribution is larger than the other;
-      the two-sided test just tests, if the distributions are different. '''
+      the two-sided test just tests, if the distributions are different. 
+      If lvectorize=True, a vectorized Numpy implementation is used. '''
   if lstatistic: raise NotImplementedError, "Return of test statistic is not yet implemented; only p-values are returned."
   testfct = functools.partial(mannwhitneyu_wrapper, ignoreNaN=ignoreNaN, 
                               use_continuity=use_continuity)
-  pvar = apply_stat_test_2samp(sample1, sample2, fct=testfct, laax=True, 
+  pvar = apply_stat_test_2samp(sample1, sample2, fct=testfct, laax=not lvectorize, 
                                lpval=True, lrho=False, **kwargs)
   if not lonesided: # transform to twosided (multiply p-value by 2)
     if isinstance(pvar,Variable): pvar.data_array *= 2.
@@ -198,11 +212,16 @@ def mannwhitneyu(sample1, sample2, ignoreNaN=True, lonesided=False, lstatistic=F
 mwtest = mannwhitneyu # alias
 
 # apply-along-axis wrapper for the Mann-Whitney Rank Test on 2 samples
-def mannwhitneyu_wrapper(data, size1=None, ignoreNaN=True, use_continuity=True, loneside=False):
+def mannwhitneyu_wrapper(data, size1=None, axis=None, ignoreNaN=True, use_continuity=True, loneside=False):
   ''' Apply the Mann-Whitney Rank Test, to test whether two samples are drawn from the same
       underlying (continuous) distribution. This is a wrapper for the SciPy function that 
-      removes NaN's, allows application over a field, and only returns the p-value. '''
-  if ignoreNaN:
+      removes NaN's, allows application over a field, and only returns the p-value; if an axis
+      is specified, the vectorized implementation is used (NaN's are always removed). '''
+  if axis is not None:
+    data1, data2 = np.split(data, [size1], axis=axis)
+    D, pval = myss.mannwhitneyu(data1, data2, axis=axis, use_continuity=use_continuity); del D
+    return pval
+  elif ignoreNaN:
     data1 = data[:size1]; data2 = data[size1:]
     nonans1 = np.invert(np.isnan(data1)) # test for NaN's
     nonans2 = np.invert(np.isnan(data2))
@@ -216,26 +235,32 @@ def mannwhitneyu_wrapper(data, size1=None, ignoreNaN=True, use_continuity=True,
 
 
 # Wilcoxon Ranksum Test on 2 samples
-def ranksums(sample1, sample2, lstatistic=False, ignoreNaN=True, **kwargs):
+def ranksums(sample1, sample2, lstatistic=False, ignoreNaN=True, lvectorize=True, **kwargs):
   ''' Apply the Wilcoxon Ranksum Test, to test whether two samples are drawn from the same
       underlying (continuous) distribution; a high p-value means, the two samples are likely
       drawn from the same distribution. 
       The Ranksum Test has higher efficiency for non-normal distributions and is almost as
       reliable as the T-test for normal distributions. It is less sophisticated than the 
-      Mann-Whitney Test and does not handle ties between ranks. '''
+      Mann-Whitney Test and does not handle ties between ranks. 
+      If lvectorize=True, a vectorized Numpy implementation is used. '''
   if lstatistic: raise NotImplementedError, "Return of test statistic is not yet implemented; only p-values are returned."
   testfct = functools.partial(ranksums_wrapper, ignoreNaN=ignoreNaN)
-  pvar = apply_stat_test_2samp(sample1, sample2, fct=testfct, laax=True, 
+  pvar = apply_stat_test_2samp(sample1, sample2, fct=testfct, laax=not lvectorize, 
                                lpval=True, lrho=False, **kwargs)
   return pvar
 wrstest = ranksums # alias
 
 # apply-along-axis wrapper for the Wilcoxon Ranksum Test on 2 samples
-def ranksums_wrapper(data, size1=None, ignoreNaN=True):
+def ranksums_wrapper(data, size1=None, axis=None, ignoreNaN=True):
   ''' Apply the Wilcoxon Ranksum Test, to test whether two samples are drawn from the same
       underlying (continuous) distribution. This is a wrapper for the SciPy function that 
-      removes NaN's, allows application over a field, and only returns the p-value. '''
-  if ignoreNaN:
+      removes NaN's, allows application over a field, and only returns the p-value; if an axis
+      is specified, the vectorized implementation is used (NaN's are always removed). '''
+  if axis is not None:
+    data1, data2 = np.split(data, [size1], axis=axis)
+    D, pval = myss.ranksums(data1, data2, axis=axis); del D
+    return pval
+  elif ignoreNaN:
     data1 = data[:size1]; data2 = data[size1:]
     nonans1 = np.invert(np.isnan(data1)) # test for NaN's
     nonans2 = np.invert(np.isnan(data2))
@@ -258,23 +283,33 @@ def pearsonr(sample1, sample2, lpval=False, lrho=True, ignoreNaN=True, lstandard
       Pearson's Correlation Coefficient measures the linear relationship between
       the two sample variables (this is the ordinary correlation coefficient);
       the p-values assume that the samples are normally distributed. 
-      Standardization and smoothing is also supported; detrending is not implemented yet. '''
+      Standardization and smoothing is also supported; detrending is not implemented yet. 
+      Without smoothing or detrending the computation is vectorized. '''
   testfct = functools.partial(pearsonr_wrapper, lpval=lpval, lrho=lrho, ignoreNaN=ignoreNaN,
                               lstandardize=lstandardize, ldetrend=ldetrend, dof=dof,
                               lsmooth=lsmooth, window_len=window_len, window=window)
+  laax = lsmooth or ldetrend # true, if any of these, false otherwise
   rvar = apply_stat_test_2samp(sample1, sample2, fct=testfct, 
-                               lpval=lpval, lrho=lrho, laax=True, **kwargs)
+                               lpval=lpval, lrho=lrho, laax=laax, **kwargs)
   return rvar
 corrcoef = pearsonr
 
 # apply-along-axis wrapper for the Pearson's Correlation Coefficient on 2 samples
-def pearsonr_wrapper(data, size1=None, lpval=False, lrho=True, ignoreNaN=True, lstandardize=False, 
+def pearsonr_wrapper(data, size1=None, axis=None, lpval=False, lrho=True, ignoreNaN=True, lstandardize=False, 
                      lsmooth=False, window_len=11, window='hanning', ldetrend=False, dof=None):
   ''' Compute the Pearson's Correlation Coefficient of two samples. This is a wrapper 
       for the SciPy function allows application over a field, and returns 
-      the correlation coefficient and/or the p-value. '''
-  # N.B.: the Numpy corrcoef function also only operates on flat arrays 
-  if ignoreNaN:
+      the correlation coefficient and/or the p-value; if an axis is specified, the 
+      vectorized implementation is used (with ignoreNaN=False, points with NaN's in either 
+      sample are NaN). '''
+  if axis is not None:
+    if lsmooth or ldetrend: raise NotImplementedError, "Smoothing and detrending are not vectorized."
+    # N.B.: standardization does not affect the correlation coefficient or p-value
+    data1, data2 = np.split(data, [size1], axis=axis)
+    rho, pval = myss.pearsonr(data1, data2, dof=dof, axis=axis)
+    if not ignoreNaN: rho, pval = _propagateNaN(data, axis, rho, pval) # points with NaN's are NaN
+    return _select_corr_output(rho, pval, lrho=lrho, lpval=lpval)
+  elif ignoreNaN:
     data1 = data[:size1]; data2 = data[size1:] # find NaN's
     nans1 = np.isnan(data1); nans2 = np.isnan(data2) # remove in both arrays
     nonans = np.invert(np.logical_or(nans1,nans2))
@@ -302,6 +337,21 @@ def pearsonr_wrapper(data, size1=None, lpval=False, lrho=True, ignoreNaN=True, l
   elif lpval: return pval
   else: raise ArgumentError  
 
+# helper function to propagate NaN's in vectorized correlation output
+def _propagateNaN(data, axis, *results):
+  ''' set results to NaN, where any value along axis is NaN (data contains both samples) '''
+  lnan = np.isnan(data).any(axis=axis)
+  return tuple(np.where(lnan, np.NaN, res) for res in results)
+
+# helper function to merge vectorized correlation output
+def _select_corr_output(rho, pval, lrho=True, lpval=False):
+  ''' select correlation coefficient and/or p-value; both are concatenated along a new last axis '''
+  if lrho and lpval: 
+    return np.concatenate((rho.reshape(rho.shape+(1,)),pval.reshape(pval.shape+(1,))), axis=pval.ndim)
+  elif lrho: return rho
+  elif lpval: return pval
+  else: raise ArgumentError  
+
 
 # Spearman's Rank-order Correlation Coefficient between two samples
 def spearmanr(sample1, sample2, lpval=False, lrho=True, ignoreNaN=True, lstandardize=False,
@@ -328,9 +378,16 @@ def spearmanr_wrapper(data, size1=None, axis=None, lpval=False, lrho=True, ignor
   ''' Compute the Spearman's Rank-order Correlation Coefficient of two samples. This is a wrapper 
       for the SciPy function allows application over a field, and returns 
       the correlation coefficient and/or the p-value. 
-      The SciPy implementation works along multiple axes (using Numpy's
-      apply_along_axis), but it is not truly vectorized. '''
-  if axis is None and ignoreNaN:
+      If an axis is specified, a vectorized ranking and correlation is used
+      (with ignoreNaN=False, points with NaN's in either sample are NaN). '''
+  if axis is not None:
+    if lsmooth or ldetrend: raise NotImplementedError, "Smoothing and detrending are not vectorized."
+    # N.B.: standardization does not affect the correlation coefficient or p-value
+    data1, data2 = np.split(data, [size1], axis=axis)
+    rho, pval = myss.spearmanr(data1, data2, axis=axis, dof=dof, lpaired=True)
+    if not ignoreNaN: rho, pval = _propagateNaN(data, axis, rho, pval) # points with NaN's are NaN
+    return _select_corr_output(rho, pval, lrho=lrho, lpval=lpval)
+  elif ignoreNaN:
     data1 = data[:size1]; data2 = data[size1:] # find NaN's
     nans1 = np.isnan(data1); nans2 = np.isnan(data2) # remove in both arrays
     nonans = np.invert(np.logical_or(nans1,nans2))
@@ -338,14 +395,12 @@ def spearmanr_wrapper(data, size1=None, axis=None, lpval=False, lrho=True, ignor
       if lrho and lpval: return np.zeros(2)+np.NaN
       else: return np.NaN # need to conform to output size
     data1 = data1[nonans]; data2 = data2[nonans] # remove NaN's
-  elif axis is None:
-    data1 = data[:size1]; data2 = data[size1:]
   else:
-    data1, data2 = np.split(data, [size1], axis=axis)
+    data1 = data[:size1]; data2 = data[size1:]
   # pre-process data
   if lstandardize: 
-    data1 = standardize(data1, axis=axis, lcopy=False) # apply_stat_test_2samp alread
-    data2 = standardize(data2, axis=axis, lcopy=False) #   makes a copy, no need here
+    data1 = standardize(data1, axis=None, lcopy=False) # apply_stat_test_2samp alread
+    data2 = standardize(data2, axis=None, lcopy=False) #   makes a copy, no need here
   if lsmooth:
     window_len = min(data1.size,window_len) # automatically shring window
     data1 = smooth(data1, window_len=window_len, window=window)
@@ -353,13 +408,9 @@ def spearmanr_wrapper(data, size1=None, axis=None, lpval=False, lrho=True, ignor
   if ldetrend:
     data1 = detrend(data1); data2 = detrend(data2)
   # apply test
-  rho, pval = myss.spearmanr(data1, data2, axis=axis, dof=dof)
+  rho, pval = myss.spearmanr(data1, data2, axis=None, dof=dof)
   # select output
-  if lrho and lpval: 
-    return np.concatenate((rho.reshape(rho.shape+(1,)),pval.reshape(pval.shape+(1,))), axis=pval.ndim)
-  elif lrho: return rho
-  elif lpval: return pval
-  else: raise ArgumentError  
+  return _select_corr_output(np.asarray(rho), np.asarray(pval), lrho=lrho, lpval=lpval)
 
 
 # generic applicator function for 2 sample statistical tests
@@ -546,6 +597,65 @@ def apply_stat_test_2samp(sample1, sample2, fct=None, axis=None, axis_idx=None,
   elif lrho: return rvar
   else: ArgumentError
 
+## bootstrap resampling engine
+
+# named statistics for bootstrapping (all ignore NaN's and reduce the last axis)
+bootstrap_statistics = dict(mean=np.nanmean, median=np.nanmedian, std=np.nanstd, var=np.nanvar, 
+                            min=np.nanmin, max=np.nanmax, sum=np.nansum, percentile=np.nanpercentile)
+
+# draw bootstrap indices
+def bootstrap_indices(sz, nbs=1000, nsamples=None, shape=None, lfirst=True, seed=None):
+  ''' draw random resampling indices (with replacement) for a sample of size sz; if shape is None, the 
+      same indices are used for all points (shape: nbs x nsamples), otherwise independent indices are 
+      drawn for each point (shape: nbs x shape x nsamples); if lfirst=True, the first draw is the 
+      original sample (or a random subset without replacement, if nsamples < sz) '''
+  if nsamples is None: nsamples = sz
+  if nsamples > sz: raise ValueError, sz
+  rng = np.random.RandomState(seed) # use private state for reproducibility
+  pshape = () if shape is None else tuple(shape)
+  idx_dtype = np.int16 if sz < 32767 else (np.int32 if sz < 2147483647 else np.int64) # save some memory
+  idx = rng.randint(sz, size=(nbs,)+pshape+(nsamples,)).astype(idx_dtype)
+  if lfirst:
+    if nsamples < sz: # random subset without replacement
+      idx[0,:] = np.argsort(rng.random_sample(pshape+(sz,)), axis=-1)[...,:nsamples]
+    else: idx[0,:] = np.arange(sz, dtype=idx_dtype)
+  return idx
+
+# helper function to evaluate a block of bootstrap samples (for worker processes)
+def _bootstrap_block(samples, idx, statistic=None, ljoint=True, **kwargs):
+  ''' resample and evaluate the statistic for a block of bootstrap indices '''
+  results = []
+  for i in xrange(len(idx)): # one resample at a time to limit memory usage
+    if ljoint: resample = samples.take(idx[i], axis=-1)
+    else: resample = np.take_along_axis(samples, idx[i], axis=-1)
+    results.append(statistic(resample, axis=-1, **kwargs))
+  return np.stack(results, axis=0)
+
+# bootstrap a statistic over all points
+def bootstrap(samples, statistic='mean', nbs=1000, nsamples=None, ljoint=True, lfirst=True, seed=None, 
+              NP=None, nblk=None, ldebug=False, **kwargs):
+  ''' Evaluate a statistic for nbs bootstrap resamples along the last axis of the sample array and 
+      return the results with the bootstrap dimension as the first axis. The statistic has to be a 
+      vectorized function that takes an 'axis' keyword argument and reduces that axis, or a key 
+      in bootstrap_statistics (kwargs are passed on to the statistic, e.g. 'q' for percentiles).
+      Resampling indices are drawn once from a seeded generator (the same for all points, if 
+      ljoint=True), so that results are reproducible and independent of the number of worker 
+      processes (NP); resamples are evaluated in nblk blocks (default: NP). '''
+  if isinstance(statistic,basestring): statistic = bootstrap_statistics[statistic]
+  if not callable(statistic): raise TypeError, statistic
+  samples = np.asarray(samples)
+  idx = bootstrap_indices(samples.shape[-1], nbs=nbs, nsamples=nsamples, lfirst=lfirst, seed=seed,
+                          shape=None if ljoint else samples.shape[:-1])
+  # split resamples into blocks and evaluate (in parallel)
+  if NP is None: NP = 1
+  if nblk is None: nblk = NP
+  nblk = max(1,min(nblk,nbs))
+  tasks = [(_bootstrap_block, (samples, blkidx), dict(statistic=statistic, ljoint=ljoint, **kwargs)) 
+           for blkidx in np.array_split(idx, nblk, axis=0)]
+  results = apply_in_processes(tasks, NP=NP, ldebug=ldebug)
+  return np.concatenate(results, axis=0)
+
+
 ## distribution variable classes 
 
 # dictionary with distribution definitions for common variables  
@@ -647,7 +757,7 @@ class DistVar(Variable):
 
   def __init__(self, name=None, units=None, axes=None, samples=None, nsamples=None, params=None, axis=None, 
                dtype=None, lflatten=False, masked=None, mask=None, fillValue=None, atts=None, ldebug=False, 
-               lbootstrap=False, nbs=1000, bootstrap_axis='bootstrap', 
+               lbootstrap=False, nbs=1000, bootstrap_axis='bootstrap', bs_seed=None,
                lcrossval=False, ncv=0.2, crossval_mode='random', **kwargs):
     '''
       This method creates a new DisVar instance from data and parameters. If data is provided, a sample
@@ -716,17 +826,11 @@ class DistVar(Variable):
         bsatts = dict(name=bootstrap_axis,units='',long_name='Bootstrap Samples')
         bsax = Axis(coord=np.arange(nbs), atts=bsatts)
         axes = (bsax,) + axes # add this axis as outer-most
-        shape = (nbs,) + samples.shape
-        # resample the samples (nbs times)
-        bootstrap = np.zeros(shape, dtype=samples.dtype) # allocate memory
-        if lns: # select a random subset (without replacement)
-          bootstrap[0,:] = np.apply_along_axis(np.random.choice, -1, samples, size=nsamples, replace=False)
-        else: bootstrap[0,:] = samples # first element is the real sample data
-        for i in xrange(1,nbs): # take random draws with replacement
-          bootstrap[i,:] = np.apply_along_axis(np.random.choice, -1, samples, size=nsamples, replace=True)
-          #idx = np.random.randint(sz, size=nsamples) # select random indices
-          #bootstrap[i,:] = samples.take(idx, axis=-1) # write random sample into array
-        samples = bootstrap
+        # resample the samples (nbs times), using independent draws at each point
+        # N.B.: the first element is the real sample data (or a random subset without replacement)
+        idx = bootstrap_indices(sz, nbs=nbs, nsamples=nsamples, shape=samples.shape[:-1], lfirst=True, seed=bs_seed)
+        samples = np.take_along_axis(samples[np.newaxis,:], idx, axis=-1)
+        del idx
         # N.B.: from here one everything should proceed normally, with the extra bootstrap axis in the 
         #       resulting DistVar object; obtain confidence intervalls as percentiles along this axis
         # N.B.: In order to save memory, this could be inplemented more efficiently within the fit-       
@@ -1112,6 +1216,82 @@ def kde_estimate(sample, ldebug=False, **kwargs):
       res = ss.kde.gaussian_kde(sample, **kwargs)
   return (res,) # need to return an iterable
 
+# binned KDE representation (compatible with scipy.stats.gaussian_kde)
+class BinnedKDE(object):
+  ''' A Gaussian KDE that is stored as a density on a bounded regular grid; it implements the 
+      evaluate, integrate_box_1d and resample methods of scipy.stats.gaussian_kde (1D only), 
+      but evaluation is done by linear interpolation and does not depend on the sample size. '''
+  d = 1 # number of dimensions (for compatibility)
+  
+  def __init__(self, grid, density, bandwidth, n):
+    ''' initialize from a regular grid, density values and bandwidth; n is the sample size '''
+    self.grid = np.asarray(grid, dtype=np.float)
+    self.density = np.asarray(density, dtype=np.float)
+    self.bandwidth = bandwidth; self.n = n
+    # cumulative distribution (normalized by the integral over the grid)
+    cdf = np.concatenate(([0.],np.cumsum(0.5*(self.density[1:]+self.density[:-1])*np.diff(self.grid))))
+    self.cdf = cdf/cdf[-1] if cdf[-1] > 0 else cdf
+    
+  def evaluate(self, points):
+    ''' evaluate the density at given points (zero outside of the grid) '''
+    points = np.asarray(points, dtype=np.float).ravel()
+    return np.interp(points, self.grid, self.density, left=0., right=0.)
+  __call__ = evaluate
+  
+  def integrate_box_1d(self, low, high):
+    ''' integrate the density between low and high (arrays are supported) '''
+    return ( np.interp(high, self.grid, self.cdf, left=0., right=1.) - 
+             np.interp(low, self.grid, self.cdf, left=0., right=1.) )
+    
+  def resample(self, size=None):
+    ''' draw random samples from the gridded density '''
+    if size is None: size = self.n
+    dx = self.grid[1] - self.grid[0]
+    idx = np.random.choice(len(self.grid), size=size, p=self.density/self.density.sum())
+    return ( self.grid[idx] + dx*(np.random.random_sample(size)-0.5) ).reshape((1,size))
+
+# estimate binned KDE's for many sample vectors at once
+def kde_estimate_binned(samples, axis=None, bw_method=None, ngrid=512, cut=3., ldebug=False):
+  ''' estimate Gaussian KDE's for every point of a 2D sample array: samples are linearly binned onto 
+      a regular grid that is bounded by the data range plus 'cut' times the bandwidth, and convolved 
+      with the kernel using FFT's; the bandwidth is computed like in scipy.stats.gaussian_kde '''
+  if axis is not None and axis != samples.ndim-1: raise AxisError, axis
+  samples = samples.reshape((-1,samples.shape[-1])); nrows = len(samples)
+  valid = np.invert(np.isnan(samples))
+  n = valid.sum(axis=-1).astype(np.float)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    mean = np.nansum(samples, axis=-1)/n
+    std = np.sqrt(np.nansum((samples-mean[:,np.newaxis])**2, axis=-1)/(n-1.))
+    # bandwidth factor (same as gaussian_kde)
+    if bw_method is None or bw_method == 'scott': factor = n**(-1./5)
+    elif bw_method == 'silverman': factor = (n*3./4.)**(-1./5)
+    elif np.isscalar(bw_method): factor = float(bw_method)
+    else: raise NotImplementedError, bw_method
+    h = factor*std
+    lfit = np.logical_and(n >= 3, h > 0)
+    if ldebug and not np.all(lfit): print('{:d} invalid samples'.format(int(np.sum(np.invert(lfit)))))
+    h = np.where(lfit, h, 1.)
+    lo = np.where(lfit, np.nanmin(samples, axis=-1) - cut*h, 0.)
+    dx = np.where(lfit, np.nanmax(samples, axis=-1) + cut*h - lo, 1.)/(ngrid-1)
+  # linear binning
+  valid = np.logical_and(valid, lfit[:,np.newaxis])
+  pos = (samples[valid] - lo.repeat(valid.sum(axis=-1)))/dx.repeat(valid.sum(axis=-1))
+  rows = np.arange(nrows).repeat(valid.sum(axis=-1))
+  i0 = np.clip(np.floor(pos).astype(np.int), 0, ngrid-2); frac = pos - i0
+  counts = np.zeros((nrows,ngrid))
+  np.add.at(counts, (rows,i0), 1.-frac); np.add.at(counts, (rows,i0+1), frac)
+  # convolve with Gaussian kernel (zero-padded, so that there is no wrap-around)
+  m = 2*ngrid; off = np.arange(m); off = np.where(off < ngrid, off, off-m)
+  kernel = np.exp(-0.5*(off[np.newaxis,:]*dx[:,np.newaxis]/h[:,np.newaxis])**2) / (np.sqrt(2.*np.pi)*h[:,np.newaxis])
+  density = np.fft.irfft(np.fft.rfft(counts, n=m, axis=-1)*np.fft.rfft(kernel, n=m, axis=-1), n=m, axis=-1)[:,:ngrid]
+  with np.errstate(divide='ignore', invalid='ignore'):
+    density = np.maximum(density/n[:,np.newaxis], 0.) # remove negative round-off
+  # create KDE objects
+  kernels = np.empty((nrows,), dtype=np.object)
+  for i in np.flatnonzero(lfit):
+    kernels[i] = BinnedKDE(lo[i]+dx[i]*np.arange(ngrid), density[i,:], h[i], int(n[i]))
+  return kernels
+
 # evaluate KDE over a given support
 def kde_eval(kde, support=None, n=0, fillValue=np.NaN):
   if kde[0] is None: res = np.zeros(n)+fillValue 
@@ -1127,6 +1307,8 @@ def kde_resample(kde, support=None, n=0, fillValue=np.NaN, dtype=np.float):
 # integrate KDE over a given support (from -inf)
 def kde_cdf(kde, support=None, n=0, fillValue=np.NaN):
     if kde[0] is None: res = np.zeros(n)+fillValue
+    elif isinstance(kde[0], BinnedKDE): # vectorized
+      res = kde[0].integrate_box_1d(-1*np.inf, np.asarray(support))
     else: 
       fct = lambda s: kde[0].integrate_box_1d(-1*np.inf,s)
       res = np.asarray([fct(s) for s in support])
@@ -1138,10 +1320,16 @@ class VarKDE(DistVar):
   dist_type = 'kde'
   
   # distribution-specific method; should be overloaded by subclass
-  def _estimate_distribution(self, samples, ic_shape=None, ic_args=None, ic_loc=None, ic_scale=None, ldebug=False, **kwargs):
-    ''' esimtate/fit distribution from sample array for each grid point and return parameters as ndarray  '''
-    fct = functools.partial(kde_estimate, ldebug=ldebug, **kwargs)
-    kernels = apply_along_axis(fct, samples.ndim-1, samples, chunksize=100//len(samples)).squeeze()
+  def _estimate_distribution(self, samples, ic_shape=None, ic_args=None, ic_loc=None, ic_scale=None, 
+                             lbinned=False, ngrid=512, cut=3., ldebug=False, **kwargs):
+    ''' esimtate/fit distribution from sample array for each grid point and return parameters as ndarray;
+        if lbinned=True, binned FFT KDE's on a bounded grid are used instead of gaussian_kde '''
+    if lbinned:
+      fct = functools.partial(kde_estimate_binned, ngrid=ngrid, cut=cut, ldebug=ldebug, **kwargs)
+      kernels = apply_along_axis(fct, samples.ndim-1, samples, chunksize=1000, laax=False)
+    else:
+      fct = functools.partial(kde_estimate, ldebug=ldebug, **kwargs)
+      kernels = apply_along_axis(fct, samples.ndim-1, samples, chunksize=100//len(samples)).squeeze()
     assert samples.shape[:-1] == kernels.shape
     # return an array of kernels
     return kernels
@@ -1294,6 +1482,134 @@ def rv_stats_test(data_array, nparams=0, dist_type=None, stats_test=None, ignore
     else: raise ArgumentError, stats_test
   return pval
 
+## batched distribution fitting and evaluation 
+# N.B.: these functions operate on 2D arrays with points along the first and samples/parameters
+#       along the second axis; they are applied with apply_along_axis(..., laax=False)
+
+# vectorized sample L-moments
+def sample_lmoments(samples):
+  ''' compute the first three sample L-moments along the last axis (NaN's are ignored) '''
+  srt = np.sort(samples, axis=-1) # NaN's are sorted to the end
+  n = np.sum(np.invert(np.isnan(srt)), axis=-1).astype(np.float)
+  i = np.arange(srt.shape[-1], dtype=np.float) # zero-based rank
+  x = np.where(i < n[...,np.newaxis], srt, 0.)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    b0 = x.sum(axis=-1)/n
+    b1 = (x*i).sum(axis=-1)/(n*(n-1.))
+    b2 = (x*i*(i-1.)).sum(axis=-1)/(n*(n-1.)*(n-2.))
+  return b0, 2.*b1 - b0, 6.*b2 - 6.*b1 + b0
+
+# vectorized initial guesses for distribution parameters
+def rv_guess(samples, dist_type=None, plen=None):
+  ''' compute initial parameter guesses for all points at once, using L-moments (GEV, Gumbel and 
+      Pareto) or the method of moments (all others); returns None, if no guess is available '''
+  n = np.sum(np.invert(np.isnan(samples)), axis=-1).astype(np.float)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    mean = np.nansum(samples, axis=-1)/n
+    anom = samples - mean[...,np.newaxis]
+    std = np.sqrt(np.nansum(anom**2, axis=-1)/n)
+    if dist_type in ('genextreme','genpareto','gumbel_r','gumbel_l'):
+      l1, l2, l3 = sample_lmoments(samples); t3 = l3/l2
+    if dist_type == 'genextreme': # Hosking et al. (1985)
+      z = 2./(3.+t3) - np.log(2.)/np.log(3.)
+      c = 7.8590*z + 2.9554*z**2
+      c = np.where(np.abs(c) < 1e-4, 1e-4, c) # avoid singularity (Gumbel limit)
+      scale = l2*c / ( (1.-2.**(-c)) * gamma_fct(1.+c) )
+      params = (c, l1 - scale*(1.-gamma_fct(1.+c))/c, scale)
+    elif dist_type == 'genpareto': # N.B.: SciPy shape has opposite sign of Hosking's k
+      k = (1.-3.*t3)/(1.+t3); scale = (1.+k)*(2.+k)*l2
+      params = (-k, l1 - (2.+k)*l2, scale)
+    elif dist_type in ('gumbel_r','gumbel_l'):
+      scale = l2/np.log(2.); sign = 1. if dist_type == 'gumbel_r' else -1.
+      params = (l1 - sign*np.euler_gamma*scale, scale)
+    elif dist_type == 'gamma':
+      skew = np.nansum(anom**3, axis=-1)/n/std**3
+      skew = np.clip(skew, 0.1, None) # only positively skewed shapes make sense
+      a = 4./skew**2; scale = std*skew/2.
+      params = (a, mean - a*scale, scale)
+    elif plen == 2: params = (mean, std)
+    elif plen == 3: params = (-1. * mean / std, mean, std) # loc + scale / shape == 0 for GEV family
+    else: return None
+  return np.stack(params, axis=-1)
+
+# optimizer with adjustable convergence criteria for warm-started fits
+def fmin_warm(func, x0, args=(), disp=0, xtol=1e-4, ftol=1e-4, maxiter=None):
+  ''' wrapper for scipy.optimize.fmin that can be passed to rv_continuous.fit '''
+  return fmin(func, x0, args=args, disp=disp, xtol=xtol, ftol=ftol, maxiter=maxiter)
+
+# estimate RV from many sample vectors
+def rv_fit_batch(samples, axis=None, dist_type=None, plen=None, ic_shape=None, ic_args=None, ic_loc=None, 
+                 ic_scale=None, lguess=True, lpersist=False, xtol=1e-4, ftol=1e-4, maxiter=None, 
+                 ldebug=False, **kwargs):
+  ''' fit a distribution to every point of a 2D sample array; initial guesses are computed in a 
+      vectorized fashion (or taken from the previous point, if lpersist=True), points with too few 
+      or degenerate samples are skipped, and optimizer tolerances can be relaxed '''
+  if axis is not None and axis != samples.ndim-1: raise AxisError, axis
+  samples = samples.reshape((-1,samples.shape[-1]))
+  params = np.zeros((len(samples),plen)) + np.NaN
+  n = np.sum(np.invert(np.isnan(samples)), axis=-1)
+  with np.errstate(invalid='ignore'):
+    lfit = np.logical_and(n >= plen, np.nanmax(samples, axis=-1) > np.nanmin(samples, axis=-1))
+  if not np.any(lfit): return params # early exit
+  guess = rv_guess(samples, dist_type=dist_type, plen=plen) if lguess and plen <= 3 else None
+  fitargs = kwargs.copy()
+  fitargs['optimizer'] = functools.partial(fmin_warm, xtol=xtol, ftol=ftol, maxiter=maxiter)
+  last = None # last successful fit
+  for i in np.flatnonzero(lfit):
+    ics = dict(ic_shape=ic_shape, ic_args=ic_args, ic_loc=ic_loc, ic_scale=ic_scale)
+    if lpersist and last is not None: ic0 = last # reuse parameters from neighbouring point
+    elif guess is not None and np.all(np.isfinite(guess[i])): ic0 = guess[i]
+    else: ic0 = None
+    if ic0 is not None:
+      if plen == 3 and ic_shape is None: ics['ic_shape'] = ic0[0]
+      if plen > 3 and ic_args is None: ics['ic_args'] = tuple(ic0[:-2])
+      if ic_loc is None: ics['ic_loc'] = ic0[-2]
+      if ic_scale is None: ics['ic_scale'] = ic0[-1]
+    ics.update(fitargs)
+    res = rv_fit(samples[i], dist_type=dist_type, plen=plen, lpersist=False, ldebug=ldebug, **ics)
+    params[i,:] = res
+    if np.all(np.isfinite(res)): last = params[i,:]
+  return params
+
+# evaluate a RV distribution type over a given support for many parameter sets
+def rv_eval_batch(params, axis=None, dist_type=None, fct_type=None, support=None, n=None, fillValue=np.NaN):
+  ''' vectorized version of rv_eval for a 2D parameter array (SciPy broadcasts parameters) '''
+  params = params.reshape((-1,params.shape[-1]))
+  args = [params[:,i:i+1] for i in xrange(params.shape[-1]-2)]
+  with np.errstate(invalid='ignore'):
+    res = getattr(getattr(ss,dist_type), fct_type)(np.asarray(support)[np.newaxis,:], *args, 
+                                                   loc=params[:,-2:-1], scale=params[:,-1:])
+  res[np.any(np.isnan(params), axis=-1),:] = fillValue
+  return res
+
+# vectorized Kolmogorov-Smirnov goodness-of-fit test
+def rv_kstest_batch(data_array, axis=None, nparams=0, dist_type=None, alternative='two-sided', mode='approx', 
+                    ignoreNaN=True, **kwargs):
+  ''' vectorized version of rv_stats_test for the K-S test; parameters and samples are concatenated 
+      along the last axis (like in rv_stats_test) '''
+  data_array = data_array.reshape((-1,data_array.shape[-1]))
+  params = data_array[:,:nparams]; srt = np.sort(data_array[:,nparams:], axis=-1)
+  n = np.sum(np.invert(np.isnan(srt)), axis=-1).astype(np.float)
+  args = [params[:,i:i+1] for i in xrange(nparams-2)]
+  i = np.arange(srt.shape[-1], dtype=np.float); valid = i < n[:,np.newaxis]
+  with np.errstate(divide='ignore', invalid='ignore'):
+    cdf = getattr(ss,dist_type).cdf(srt, *args, loc=params[:,-2:-1], scale=params[:,-1:])
+    Dplus = np.where(valid, (i+1.)/n[:,np.newaxis] - cdf, -np.inf).max(axis=-1)
+    Dmin = np.where(valid, cdf - i/n[:,np.newaxis], -np.inf).max(axis=-1)
+    if alternative == 'greater': pval = ss.ksone.sf(Dplus, n)
+    elif alternative == 'less': pval = ss.ksone.sf(Dmin, n)
+    elif alternative in ('two-sided','two_sided'):
+      D = np.maximum(Dplus, Dmin)
+      pval = ss.kstwobign.sf(D*np.sqrt(n))
+      if mode == 'approx': # same criterion as scipy.stats.kstest
+        lexact = np.logical_and(n <= 2666, pval <= 0.80 - n*0.3/1000.)
+        if np.any(lexact): pval[lexact] = 2. * ss.ksone.sf(D[lexact], n[lexact])
+      elif mode != 'asymp': raise ArgumentError, mode
+    else: raise ArgumentError, alternative
+  invalid = np.logical_or(np.any(np.isnan(params), axis=-1), n < 3 if ignoreNaN else n < srt.shape[-1])
+  pval[invalid] = np.NaN
+  return pval
+
 # Subclass of DistVar implementing various random variable distributions
 class VarRV(DistVar):
   ''' A subclass of DistVar implementing Random Variable distributions (scipy.stats.rv_continuous) '''
@@ -1350,17 +1666,26 @@ class VarRV(DistVar):
     return attr
   
   # distribution-specific method; should be overloaded by subclass
-  def _estimate_distribution(self, samples, ic_shape=None, ic_args=None, ic_loc=None, ic_scale=None, lpersist=False, ldebug=False, **kwargs):
-    ''' esimtate/fit distribution from sample array for each grid point and return parameters as ndarray  '''
+  def _estimate_distribution(self, samples, ic_shape=None, ic_args=None, ic_loc=None, ic_scale=None, lpersist=False, 
+                             lbatch=True, lguess=True, xtol=1e-4, ftol=1e-4, maxiter=None, ldebug=False, **kwargs):
+    ''' esimtate/fit distribution from sample array for each grid point and return parameters as ndarray; 
+        if lbatch=True, the batched fitting engine with vectorized initial guesses is used '''
+    global global_loc, global_scale, global_shape, global_args
     if lpersist: # reset global parameters
       global_loc   = None # location parameter ("mean")
       global_scale = None # scale parameter ("standard deviation")
       global_shape = None # single shape parameter
       global_args  = None # multiple shape parameters
     plen = self.dist_class.numargs + 2 # infer number of parameters
-    fct = functools.partial(rv_fit, ic_shape=ic_shape, ic_args=ic_args, ic_loc=ic_loc, ic_scale=ic_scale, plen=plen, 
-                            dist_type=self.dist_type, lpersist=lpersist, ldebug=ldebug, **kwargs)
-    params = apply_along_axis(fct, samples.ndim-1, samples, chunksize=100//plen//len(samples))
+    if lbatch:
+      fct = functools.partial(rv_fit_batch, ic_shape=ic_shape, ic_args=ic_args, ic_loc=ic_loc, ic_scale=ic_scale, 
+                              plen=plen, dist_type=self.dist_type, lguess=lguess, lpersist=lpersist, 
+                              xtol=xtol, ftol=ftol, maxiter=maxiter, ldebug=ldebug, **kwargs)
+      params = apply_along_axis(fct, samples.ndim-1, samples, chunksize=1000, laax=False)
+    else:
+      fct = functools.partial(rv_fit, ic_shape=ic_shape, ic_args=ic_args, ic_loc=ic_loc, ic_scale=ic_scale, plen=plen, 
+                              dist_type=self.dist_type, lpersist=lpersist, ldebug=ldebug, **kwargs)
+      params = apply_along_axis(fct, samples.ndim-1, samples, chunksize=100//plen//len(samples))
     if lpersist: # reset global parameters 
       global_loc   = None # location parameter ("mean")
       global_scale = None # scale parameter ("standard deviation")
@@ -1390,9 +1715,9 @@ class VarRV(DistVar):
       support = args[0]
       assert isinstance(support, np.ndarray)
       n = len(support); fillValue = self.fillValue or np.NaN
-      fct = functools.partial(rv_eval, dist_type=self.dist_type, fct_type=rv_fct, 
+      fct = functools.partial(rv_eval_batch, dist_type=self.dist_type, fct_type=rv_fct, 
                               support=support, n=n, fillValue=fillValue, **kwargs)
-      dist = apply_along_axis(fct, self.ndim-1, self.data_array, chunksize=1000//n)
+      dist = apply_along_axis(fct, self.ndim-1, self.data_array, chunksize=max(1,100000//n), laax=False)
       assert dist.shape == self.shape[:-1] + (len(support),)
     else: raise ArgumentError
     return dist
@@ -1537,8 +1862,9 @@ class VarRV(DistVar):
   # statistical test for goodness-of-fit
   def fittest(self, samples, nsamples=None, name=None, axis_idx=None, lstatistic=False, lcrossval=False,
               fillValue=None, ignoreNaN=True, N=1000, alternative='two-sided', mode='approx', reta=False,
-              stats_test=None, asVar=True, lcheckVar=True, lcheckAxis=True, pvaratts=None, **kwargs):
-    ''' apply a Kolmogorov-Smirnov Test to the sample data, based on this distribution '''
+              stats_test=None, lbatch=True, asVar=True, lcheckVar=True, lcheckAxis=True, pvaratts=None, **kwargs):
+    ''' apply a Kolmogorov-Smirnov Test to the sample data, based on this distribution; the K-S test
+        is vectorized over all points, unless lbatch=False '''
     # check input
     if self.dtype.kind in ('S',): 
       if lcheckVar: raise VariableError, "Statistical tests does not work with string Variables!"
@@ -1576,10 +1902,17 @@ class VarRV(DistVar):
       sample_data = np.apply_along_axis(np.random.choice, -1, sample_data, size=nsamples, replace=False)
     # apply test function (parallel)
     #print sample_data.shape, sample_data.mean()
-    fct = functools.partial(rv_stats_test, nparams=len(self.paramAxis), dist_type=self.dist_type, reta=reta,
-                            stats_test=stats_test, ignoreNaN=ignoreNaN, N=N, alternative=alternative, mode=mode)
+    if stats_test is None: stats_test = 'sw' if self.dist_type == 'norm' else 'ks'
+    if lbatch and stats_test.lower() in ('ks','kstest'):
+      fct = functools.partial(rv_kstest_batch, nparams=len(self.paramAxis), dist_type=self.dist_type, 
+                              ignoreNaN=ignoreNaN, alternative=alternative, mode=mode)
+      laax = False
+    else:
+      fct = functools.partial(rv_stats_test, nparams=len(self.paramAxis), dist_type=self.dist_type, reta=reta,
+                              stats_test=stats_test, ignoreNaN=ignoreNaN, N=N, alternative=alternative, mode=mode)
+      laax = True
     data_array = np.concatenate((self.data_array, sample_data), axis=sax) # merge params and sample arrays (only one argument array per point along axis) 
-    pval = apply_along_axis(fct, sax, data_array, chunksize=100000//len(data_array)) # apply test in parallel, distributing the data
+    pval = apply_along_axis(fct, sax, data_array, chunksize=100000//len(data_array), laax=laax) # apply test in parallel, distributing the data
     assert pval.ndim == sax
     assert pval.shape == self.shape[:-1]
     #print pval.shape,pval.mean()
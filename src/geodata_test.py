@@ -6,7 +6,7 @@ Unittest for the GeoPy main package geodata.
 @author: Andre R. Erler, GPL v3
 '''
 
-import unittest, os, gc, shutil
+import unittest, os, gc, shutil, pickle
 from copy import deepcopy
 import netCDF4 as nc
 import numpy as np
@@ -17,7 +17,7 @@ import scipy.stats as ss
 # import modules to be tested
 import utils.nanfunctions as nf
 from utils.nctools import writeNetCDF
-from geodata.misc import isZero, isOne, isEqual, isNumber
+from geodata.misc import isZero, isOne, isEqual, isNumber, AxisError
 from geodata.base import Variable, Axis, Dataset, Ensemble, concatVars, concatDatasets
 from geodata.stats import VarKDE, VarRV, asDistVar
 from geodata.stats import kstest, ttest, mwtest, wrstest, pearsonr, spearmanr
@@ -211,6 +211,12 @@ class BaseVarTest(unittest.TestCase):
     tax = var.axisIndex('ensemble')
     shape = (2,)+var.shape
     assert concat_var.shape == tuple(shape)
+    # irregular axes are rejected, even if first interval and total length match
+    irregular = Variable(name='irregular', units='', data=np.zeros(5), 
+                         axes=(Axis(name='time', units='month', coord=np.asarray([0,1,3,3.5,4])),))
+    regular = Variable(name='regular', units='', data=np.zeros(5), 
+                       axes=(Axis(name='time', units='month', coord=np.arange(5.)),))
+    self.assertRaises(AxisError, concatVars, [regular,irregular], axis='time')
         
   def testCopy(self):
     ''' test copy and deepcopy of variables (and axes) '''
@@ -284,6 +290,11 @@ class BaseVarTest(unittest.TestCase):
         assert tmp1.units  == tmp2.units
         assert tmp1.dtype  == tmp2.dtype
         isEqual(tmp1[:],tmp2[:])
+        # binned FFT KDE should closely approximate gaussian_kde
+        tmp3 = var.kde(axis=None, lflatten=True, lbinned=True, ldebug=False)
+        support = np.linspace(np.nanmin(var.data_array), np.nanmax(var.data_array), 50)
+        pdf1 = tmp1.pdf(support=support, asVar=False); pdf3 = tmp3.pdf(support=support, asVar=False)
+        assert np.allclose(pdf1, pdf3, atol=0.01*pdf1.max()), np.abs(pdf1-pdf3).max()
       print "\n   ***   computed {:s} distribution   ***".format(dist.upper())
       # some VarRV-specific stuff
       if dist != 'kde':
@@ -397,6 +408,15 @@ class BaseVarTest(unittest.TestCase):
     # test call
     tes = ens(time=slice(0,3,2))
     assert all(len(tax)==2 for tax in tes.time)      
+    # test threaded dispatch to members
+    pens = Ensemble(var, copy, name='ensemble', title='Test Ensemble', NP=2)
+    pmeans = pens.mean(axis='time')
+    assert isinstance(pmeans, Ensemble) and pmeans.NP == 2
+    assert all(isEqual(pm.data_array, m.mean(axis='time').data_array) for pm,m in zip(pmeans,pens))
+    # test stacking of members along an ensemble axis
+    stack = pens.stackMembers(axis='ensemble')
+    assert stack.hasAxis('ensemble') and stack.shape == (len(pens),)+var.shape
+    assert isEqual(stack.mean(axis='ensemble').data_array, (var.data_array+copy.data_array)/2.)
       
   def testGridData(self):
     ''' test interpolation of point data to regular grid'''
@@ -542,6 +562,21 @@ class BaseVarTest(unittest.TestCase):
     #print ma.array(self.data,mask=(rav.data_array>0)), var.getArray(unmask=False)
     assert isEqual(ma.array(self.data,mask=(rav.data_array>6)), var.getArray(unmask=False)) 
     
+  def testPCA(self):
+    ''' test randomized and incremental EOF's against the eigen-decomposition '''
+    from utils.misc import PCA
+    # random data with three dominant modes (samples x features)
+    rng = np.random.RandomState(42)
+    modes = rng.randn(3,40); amps = rng.randn(500,3)*np.asarray([10.,5.,2.])
+    data = np.dot(amps, modes) + rng.randn(500,40)*0.1
+    pca, eig, eof = PCA(data, degree=3, lEOF=True)
+    for method in ('randomized','incremental'):
+      mpca, meig, meof = PCA(data, degree=3, lEOF=True, method=method, blksize=100, seed=1)
+      sign = np.sign(np.sum(eof*meof, axis=0)) # signs of 'eigh' EOF's are arbitrary
+      assert isEqual(eig, meig, eps=1e-6)
+      assert isEqual(eof*sign, meof, eps=1e-6)
+      assert isEqual(pca*sign, mpca, eps=1e-4)
+    
   def testPrint(self):
     ''' just print the string representation '''
     lsimple = self.__class__ is BaseVarTest
@@ -648,6 +683,14 @@ class BaseVarTest(unittest.TestCase):
       bins = binedgs[1:] - ( np.diff(binedgs) / 2. )
     hvar = var.histogram(bins=bins, binedgs=binedgs, ldensity=False, asVar=True, axis=t.name)
     assert hvar.shape == (len(bins),)+var.shape[1:]
+    # streaming histogram (accumulated in blocks) should be identical
+    svar = var.histogram(bins=bins, binedgs=binedgs, ldensity=False, asVar=True, axis=t.name, blksize=5)
+    assert isEqual(hvar.data_array, svar.data_array)
+    # streaming percentiles are exact at the extremes and within one bin width otherwise
+    svar = var.percentile((0.,0.50,1.00), axis=t.name, binedgs=binedgs, blksize=5)
+    assert isEqual(svar(percentile=0).data_array, qvar_min.data_array, masked_equal=True)
+    assert isEqual(svar(percentile=1).data_array, qvar_max.data_array, masked_equal=True)
+    assert np.nanmax(np.abs(svar(percentile=0.5).data_array - qvar_median.data_array)) <= np.diff(binedgs).max()
     if lsimple:
       assert self.data.min() == 1 and self.data.max() == 12 and self.data.shape[0] == 48
       assert hvar.limits() == (4,4)
@@ -666,6 +709,18 @@ class BaseVarTest(unittest.TestCase):
     cvar = var.CDF(bins=bins, binedgs=binedgs, lnormalize=True, asVar=True, axis=t.name)
     assert isEqual(cdf, cvar.data_array, masked_equal=True)
     assert cvar.units == ''
+    # test moving-window statistics
+    mvar = var.movingStat(window=3, stat='mean', axis=t.name)
+    assert mvar.shape == var.shape and mvar.units == var.units
+    assert isEqual(var.movingStat(window=1, stat='max', axis=t.name).data_array, var.data_array, masked_equal=True)
+    if lsimple: # seasonal cycle from 1 to 12
+      assert np.all(mvar.data_array[0,:] == 1.5) and np.all(mvar.data_array[1,:] == 2)
+      assert np.all(var.movingStat(window=12, stat='min', axis=t.name).data_array[6:-6,:] == 1)
+    # small local variance in a long, high-variance series is retained
+    from utils.misc import movingWindow
+    x = np.random.randn(20000)*1000. + 5000.; x[10000:10050] = 5. + np.random.randn(50)*1e-3
+    std = movingWindow(x, 30, stat='std')[10014:10035]
+    assert isEqual(std, np.asarray([x[i-14:i+16].std() for i in xrange(10014,10035)]), eps=1e-8)
     
   def testSeasonalReduction(self):
     ''' test functions that reduce monthly data to yearly data '''
@@ -748,6 +803,22 @@ class BaseVarTest(unittest.TestCase):
     assert var.ndim == ndim - sdim
     assert all([dim > 1 for dim in var.shape]) 
     
+  def testBootstrap(self):
+    ''' test bootstrap resampling engine '''
+    # get test objects
+    var = self.var.copy() if self.__class__ is BaseVarTest else self.var(time=slice(0,25))
+    t = var.getAxis('time'); shape = var.shape[:var.axisIndex('time')] + var.shape[var.axisIndex('time')+1:]
+    # bootstrap mean with reproducible seed
+    bsvar = var.bootstrap('mean', axis=t.name, nbs=50, seed=1)
+    assert bsvar.shape == (50,)+shape
+    assert bsvar.axes[0].name == 'bootstrap'
+    assert isEqual(bsvar.data_array[0,:], var.mean(axis=t.name).data_array) # first is original sample
+    bsvar2 = var.bootstrap('mean', axis=t.name, nbs=50, seed=1, NP=2)
+    assert isEqual(bsvar.data_array, bsvar2.data_array) # independent of worker processes
+    # percentiles with independent resampling at each point
+    qvar = var.bootstrap('percentile', q=90, axis=t.name, nbs=10, ljoint=False, seed=2)
+    assert qvar.shape == (10,)+shape
+    
   def testStatsTests(self):
     ''' test statistical test functions '''
     # get test objects
@@ -807,6 +878,8 @@ class BaseVarTest(unittest.TestCase):
     pvar = xvar.fittest(var) # should use K-S test
     assert pvar.shape == xvar.shape[:-1]
     assert np.all(pvar.data_array >= 0)
+    # batched K-S test should agree with point-wise test
+    assert np.allclose(pvar.data_array, xvar.fittest(var, lbatch=False).data_array, equal_nan=True)
     del xvar, pvar, nvar; gc.collect()
 
     rav = var.copy(deepcopy=True); sin = rav.sin(); cos = var.cos()
@@ -827,7 +900,17 @@ class BaseVarTest(unittest.TestCase):
     pvar = wrstest(sin, cos, axis='time')
     assert pvar.data_array.mean() < 0.5 # not all tests are that accurate...
     assert pvar.shape == var.shape[1:] # this will usually be close to zero, since none of these are normally distributed
-    del sin, cos, pvar; gc.collect() # free some memory - these can get large
+    # vectorized kernels should reproduce the point-wise SciPy tests
+    for testfct in (kstest, mwtest, wrstest):
+      vvar = testfct(sin, cos, axis='time', lvectorize=True)
+      svar = testfct(sin, cos, axis='time', lvectorize=False)
+      assert np.allclose(vvar.data_array, svar.data_array, equal_nan=True)
+    del sin, cos, pvar, vvar, svar; gc.collect() # free some memory - these can get large
+    # vectorized T-test propagates NaN's, unless they are ignored
+    from geodata.stats import ttest_ind_wrapper
+    data = np.random.randn(3,40); data[0,5] = np.NaN
+    assert np.all(np.isfinite(ttest_ind_wrapper(data, size1=20, axis=1, ignoreNaN=True)))
+    assert np.isnan(ttest_ind_wrapper(data, size1=20, axis=1, ignoreNaN=False)).tolist() == [True,False,False]
     
     ## correlation coefficients
     rnd = var.copy(); rnd.data_array = np.random.randn(var.data_array.size).reshape(var.shape)
@@ -852,6 +935,20 @@ class BaseVarTest(unittest.TestCase):
     assert rvar.data_array.mean() < 0.25 # not all tests are that accurate...
     assert pvar.data_array.mean() > 0.25 # not all tests are that accurate...
     assert rvar.shape == var.shape[1:] # this will usually be close to zero, since none of these are normally distributed
+    # vectorized correlation maps should agree with the point-wise computation
+    rho,pval = pearsonr(var.data_array[:,0,0], rnd.data_array[:,0,0], lpval=True, lrho=True, lflatten=True, dof=5)
+    rvar,pvar = pearsonr(var, rnd, lpval=True, lrho=True, axis='time', dof=5)
+    assert np.isclose(rvar.data_array[0,0], rho) and np.isclose(pvar.data_array[0,0], pval)
+    rho,pval = spearmanr(var.data_array[:,0,0], rnd.data_array[:,0,0], lpval=True, lrho=True, lflatten=True)
+    rvar,pvar = spearmanr(var, rnd, lpval=True, lrho=True, axis='time')
+    assert np.isclose(rvar.data_array[0,0], rho) and np.isclose(pvar.data_array[0,0], pval)
+    # vectorized correlations propagate NaN's, unless they are ignored
+    from geodata.stats import pearsonr_wrapper, spearmanr_wrapper
+    data = np.random.randn(3,40); data[0,5] = np.NaN
+    for wrapper in (pearsonr_wrapper, spearmanr_wrapper):
+      assert np.isnan(wrapper(data, size1=20, axis=1, ignoreNaN=False)).tolist() == [True,False,False]
+      rho, pval = np.rollaxis(wrapper(data, size1=20, axis=1, lrho=True, lpval=True, ignoreNaN=False), -1)
+      assert np.isnan(pval).tolist() == [True,False,False]
     
   def testUnaryArithmetic(self):
     ''' test in-place and unary arithmetic functions and ufuncs'''
@@ -1247,6 +1344,9 @@ class BaseDatasetTest(unittest.TestCase):
     # test list indexing
     sne = ens[range(len(ens)-1,-1,-1)]
     assert sne[-1] == ens[0] and sne[0] == ens[-1]
+    # NetCDF access is not thread-safe: only in-memory members are dispatched to threads
+    pens = Ensemble(dataset, copy, basetype='Dataset', NP=2)
+    assert pens._lthreads() == (not isinstance(dataset,DatasetNetCDF))
 
   def testIndexing(self):
     ''' test collective slicing and coordinate/point extraction  '''
@@ -1367,6 +1467,19 @@ class BaseDatasetTest(unittest.TestCase):
           assert avar.shape == var.shape
     else: raise AssertionError, dataset
 
+  def testPickle(self):
+    ''' test pickling of in-memory datasets (e.g. to return them from worker processes) '''
+    dataset = self.dataset
+    dataset.load()
+    if isinstance(dataset,DatasetNetCDF): dataset = dataset.copy(asNC=False) # open files can't be pickled
+    copy = pickle.loads(pickle.dumps(dataset, protocol=2))
+    assert isinstance(copy,Dataset) and copy.name == dataset.name
+    for varname,var in dataset.variables.iteritems():
+      assert copy.hasVariable(varname) and copy[varname].shape == var.shape
+      if np.issubdtype(var.dtype, np.number): assert isEqual(copy[varname][:], var[:])
+    if dataset.__dict__.get('gdal',False): 
+      assert copy.gdal and copy.mapSize == dataset.mapSize # GDAL functionality is restored
+
   def testPrint(self):
     ''' just print the string representation '''
     assert self.dataset.__str__()
@@ -1609,6 +1722,26 @@ class DatasetNetCDFTest(BaseDatasetTest):
     print(dataset)
     dataset.close()
 
+  def testConcatSink(self):
+    ''' test streaming concatenation of datasets into a NetCDF file '''
+    filename = self.folder + 'test_concat.nc'
+    if os.path.exists(filename): os.remove(filename)
+    ds = self.dataset; cp = self.dataset.copy()
+    varname = self.var.name; catax = self.axes[0].name
+    lckax = self.dataset_name not in ('GPCC','NARR') # will fail with GPCC and NARR, due to sub-monthly time units
+    # reference in memory
+    concat_data = concatVars([ds[varname],cp[varname]], axis=catax, asVar=False, lcheckAxis=lckax)
+    # stream into new NetCDF file
+    sink = DatasetNetCDF(filelist=[filename],mode='w')
+    ccds = concatDatasets([ds, cp], axis=catax, offset=0, lcheckAxis=lckax, sink=sink)
+    assert ccds is sink and isinstance(sink[varname],VarNC)
+    assert not sink[varname].data # data was written directly to disk
+    sink.close()
+    ccds = DatasetNetCDF(filelist=[filename],mode='r')
+    assert ccds[varname].shape == concat_data.shape
+    assert isEqual(ccds[varname][:], concat_data)
+    ccds.close()
+
   def testStringVar(self):
     ''' test behavior of string variables in a netcdf dataset '''
     filename = self.folder + 'test.nc'
@@ -1799,6 +1932,22 @@ class GDALVarTest(NetCDFVarTest):
     assert np.all(data.mask[2,:] == data2D.mask), data.mask[2,:]
     assert np.all(data.mask[3,:] == True), data.mask[3,:]
     
+  def testRegrid(self):
+    ''' test regridding with GDAL datasets: a round trip onto the same grid reproduces the data '''
+    from osgeo import gdal
+    var = self.var.load() # NCVar object
+    # source datasets wrap the data (read-only), but allocated target datasets have to be writable
+    srcdata = var.getGDAL(load=True)
+    newvar = var.copy(data=None)
+    tgtdata = newvar.getGDAL(load=False, allocate=True, fillValue=var.fillValue)
+    assert tgtdata.ReadAsArray().shape == srcdata.ReadAsArray().shape
+    err = gdal.ReprojectImage(srcdata, tgtdata, var.projection.ExportToWkt(), newvar.projection.ExportToWkt(), 
+                              gdal.GRA_NearestNeighbour)
+    assert err == 0, err
+    newvar.loadGDAL(tgtdata, mask=True, fillValue=var.fillValue)
+    assert newvar.shape == var.shape, newvar.shape
+    assert isEqual(newvar.data_array, var.data_array, masked_equal=True)
+    
   def testWriteASCII(self):
     ''' test function to write Arc/Info ASCII Grid / ASCII raster files '''
     # get test objects
@@ -1817,6 +1966,13 @@ class GDALVarTest(NetCDFVarTest):
     filelist = var.ASCII_raster(folder=folder, lcoord=True, formatter=formatter,
                                 prefix=var.atts.long_name, ext='')
     for filepath in filelist: assert os.path.exists(filepath), filepath
+    # compressed files, written in parallel
+    filelist = var.ASCII_raster(folder=folder, prefix='gzip', lcompress=True, NP=2)
+    for filepath in filelist: 
+      assert filepath.endswith('.asc.gz') and os.path.exists(filepath), filepath
+    # binary format with bands (single file)
+    filepath = var.ASCII_raster(folder=folder, driver='GTiff', lbands=True, lcompress=True)
+    assert filepath.endswith('.tif') and os.path.exists(filepath), filepath
 
 
 class DatasetGDALTest(DatasetNetCDFTest):  
@@ -1974,6 +2130,7 @@ if __name__ == "__main__":
 #     specific_tests += ['LoadSlice']
 #     specific_tests += ['WriteASCII']
 #     specific_tests += ['ReadASCII']
+#     specific_tests += ['Regrid']
 #     specific_tests += ['ReductionArithmetic']
 #     specific_tests += ['Mask']
 #     specific_tests += ['Ensemble']
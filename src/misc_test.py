@@ -78,6 +78,35 @@ class MultiProcessTest(unittest.TestCase):
     assert ec == 4
     ec = asyncPoolEC(test_func_ec, args, kwargs, NP=NP, ldebug=ldebug, ltrialnerror=False)
     assert ec == 0
+
+  def testApplyInThreads(self):
+    ''' test thread pool wrapper that preserves the order of results '''    
+    from processing.multiprocess import apply_in_threads
+    def func(n, wait=0): 
+      sleep(wait)
+      return n
+    tasks = [(func, (n,), dict(wait=0.1*(5-n))) for n in xrange(5)]
+    res = apply_in_threads(tasks, NP=NP, ldebug=ldebug)
+    assert res == range(5)
+    assert apply_in_threads(tasks, NP=1) == res
+    # worker processes require picklable tasks
+    from processing.multiprocess import apply_in_processes
+    tasks = [(np.add, (n,1), dict()) for n in xrange(5)]
+    assert apply_in_processes(tasks, NP=NP, ldebug=ldebug) == range(1,6)
+
+  def testTaskQueue(self):
+    ''' test bounded process pool queue that preserves the order of results '''    
+    from processing.multiprocess import TaskQueue
+    for nproc in (1,NP):
+      queue = TaskQueue(NP=nproc, nqueue=2, ldebug=ldebug)
+      for n in xrange(7): 
+        queue.append( (np.add, (n,1), dict()) )
+        assert len(queue.pending) <= 2 and len(queue) == n+1
+      assert queue.join() == range(1,8)
+    # failed tasks raise in the calling process
+    queue = TaskQueue(NP=NP)
+    queue.append( (np.add, (1,'a'), dict()) )
+    self.assertRaises(TypeError, queue.join)
     
 
   
@@ -158,6 +187,28 @@ class DatasetsTest(unittest.TestCase):
         n += 1
     assert n == len(arg_list)
     
+  def testApplyOverArguments(self):
+    ''' test parallel and cached evaluation over expanded argument lists '''    
+    from utils.misc import apply_over_arguments
+    import tempfile, shutil
+    calls = []
+    def func(arg1=None, arg2=None, arg3=None):
+      calls.append(arg1); sleep(0.01*arg1)
+      return '{:d}{:s}{:s}'.format(arg1, arg2, arg3)
+    kwargs = dict(outer_list=['arg1','arg2'], arg1=[2,1,0], arg2=['a','b'], arg3='c')
+    cache_folder = tempfile.mkdtemp()
+    try:
+      res = apply_over_arguments(func, NP=NP, cache_folder=cache_folder, ldebug=ldebug, **kwargs)
+      assert res == ['2ac','2bc','1ac','1bc','0ac','0bc'] # order is preserved
+      assert len(calls) == 6 and len(os.listdir(cache_folder)) == 6
+      # second evaluation is loaded from cache
+      assert apply_over_arguments(func, NP=NP, cache_folder=cache_folder, **kwargs) == res
+      assert len(calls) == 6
+      # argument lists from expandArgumentList can also be passed directly
+      from utils.misc import expandArgumentList
+      assert apply_over_arguments(func, expandArgumentList(**kwargs), NP=1) == res
+    finally: shutil.rmtree(cache_folder)
+    
   def testLoadDataset(self):
     ''' test universal dataset loading function '''
     from datasets.common import loadDataset, loadClim, loadStnTS 
@@ -224,6 +275,12 @@ class DatasetsTest(unittest.TestCase):
     assert len(shpens[names[0]].time) == 72 # time-series
     assert len(shpens[names[-1]].time) == 720 # ensemble
     assert all('ARB' == ds.atts.shape_name for ds in shpens)
+    # test concurrent loading (order has to be preserved)
+    parens = loadEnsembleTS(names=names, season=None, shape='shpavg', aggregation=aggregation, 
+                            slices=slices, varlist=varlist, filetypes=['hydro'], obsslices=obsslices, 
+                            NP=NP, NIO=1)
+    assert [ds.name for ds in parens] == [ds.name for ds in shpens]
+    assert all(isEqual(pds.precip[:], ds.precip[:]) for pds,ds in zip(parens,shpens))
 
   def testAdvancedLoadEnsembleTS(self):
     ''' test station data load functions (ensemble and list) '''
@@ -313,6 +370,166 @@ class DatasetsTest(unittest.TestCase):
     # But diff first, to check for actual updates!
     # P/S at the moment I'm importing the custom nanfunctions directly
     
+
+## tests for bias correction methods
+class BiasCorrectionTest(unittest.TestCase):  
+   
+  def setUp(self):
+    ''' create synthetic model and observation datasets and write model data to a NetCDF file '''
+    import tempfile
+    self.folder = tempfile.mkdtemp()
+    np.random.seed(1)
+    nt = 12*10; shape = (nt,4,5)
+    time = Axis(name='time', units='month', coord=np.arange(nt), atts=dict(long_name='Month since 1979-01'))
+    lat = Axis(name='lat', units='deg N', coord=np.linspace(40,43,4))
+    lon = Axis(name='lon', units='deg E', coord=np.linspace(-80,-76,5))
+    cycle = np.cos(np.pi*time.coord/6.).reshape((nt,1,1)) # seasonal cycle
+    def dataset(name, scale, offset):
+      pr = Variable(name='pr', units='kg/m^2/s', axes=(time,lat,lon), 
+                    data=np.random.gamma(2., scale, size=shape)*(1.5+cycle))
+      T2 = Variable(name='T2', units='K', axes=(time,lat,lon), data=np.random.randn(*shape)*2.+offset+10.*cycle)
+      zs = Variable(name='zs', units='m', axes=(lat,lon), data=np.ones(shape[1:])*100.)
+      return Dataset(name=name, title=name, varlist=[pr,T2,zs])
+    self.obs = dataset('obs', 1e-5, 280.)
+    self.filepath = '{:s}/model.nc'.format(self.folder)
+    writeNetCDF(dataset('model', 1.5e-5, 283.), self.filepath, close=True)
+      
+  def tearDown(self):
+    ''' clean up '''
+    import shutil
+    shutil.rmtree(self.folder)
+    gc.collect()
+
+  def testMonthIndex(self):
+    ''' test inference of the month of the year from different time axes '''
+    from processing.bc_methods import getMonthIndex
+    from geodata.misc import AxisError
+    from geodata.netcdf import DatasetNetCDF
+    def var(units, coord, long_name=None):
+      time = Axis(name='time', units=units, coord=np.asarray(coord), atts=dict(long_name=long_name) if long_name else None)
+      return Variable(name='var', units='', axes=(time,), data=np.zeros(len(coord)))
+    # monthly time-series and climatologies
+    assert np.all( getMonthIndex(var('month', np.arange(1,13), 'Month since 1979-01')) == np.arange(1,13)%12 )
+    assert np.all( getMonthIndex(var('month', np.arange(12), 'Month since 1979-07')) == (np.arange(12)+6)%12 )
+    assert np.all( getMonthIndex(var('month', np.arange(1,13), 'Month of the Year')) == np.arange(12) )
+    assert np.all( getMonthIndex(var('month', np.arange(4,7), 'Month of the Year')) == np.arange(3,6) )
+    # daily time-series
+    assert np.all( getMonthIndex(var('days', [0,30,31,59,365], 'days since 1979-01-01')) == [0,0,1,2,0] )
+    assert np.all( getMonthIndex(var('days since 2000-03-15', [0,17,400])) == [2,3,3] )
+    # 365-day calendar (e.g. WRF and CESM): no leap days
+    coord = np.arange(0,365*8,10); leap = var('days since 1979-01-01', coord)
+    noleap = var('days since 1979-01-01', coord); noleap.time.atts['calendar'] = 'noleap'
+    dates = np.datetime64('1979-01-01') + np.mod(coord,365).astype('timedelta64[D]') # 1979 has 365 days
+    assert np.all( getMonthIndex(noleap) == dates.astype('datetime64[M]').astype(np.int64)%12 )
+    assert np.all( getMonthIndex(leap, noleap=True) == getMonthIndex(noleap) )
+    assert not np.all( getMonthIndex(leap) == getMonthIndex(noleap) ) # leap days shift later years
+    assert np.all( getMonthIndex(var('days since 1979-03-15', [0,16,17,365,365+293]), noleap=True) == [2,2,3,2,0] )
+    # the month can not be inferred without a reference date
+    self.assertRaises(AxisError, getMonthIndex, var('days', [0,1]))
+    # reference date from NetCDF attributes
+    dataset = DatasetNetCDF(filelist=[self.filepath], mode='r')
+    assert np.all( getMonthIndex(dataset['pr']) == np.arange(len(dataset.time))%12 )
+    dataset.close()
+
+  def testQuantileMapping(self):
+    ''' test quantile mapping of 1D time-series and incomplete years '''
+    from processing.bc_methods import getBCmethods
+    from geodata.misc import DataError
+    # 1D time-series (e.g. station data)
+    series = lambda ds: Dataset(name=ds.name, varlist=[ds['T2'](lat=0, lon=0, lidx=True)])
+    T2 = series(self.obs)['T2']; assert T2.ndim == 1
+    model = Dataset(name='model', varlist=[T2.copy(data=T2.data_array + 3.)])
+    BC = getBCmethods('QM', varlist=['T2'])
+    BC.train(model, series(self.obs))
+    assert BC._correction['T2'].shape == (2,12,len(BC.quantiles))
+    bcdata = BC.correct(model)['T2'].data_array
+    assert isEqual(bcdata, T2.data_array, eps=1e-4)
+    # months without data can not be trained
+    BC = getBCmethods('QM', varlist=['T2'])
+    self.assertRaises(DataError, BC.train, model(time=(0,5), lidx=True), series(self.obs)(time=(0,5), lidx=True))
+
+  def testLazyCorrection(self):
+    ''' test lazy and block-wise bias correction of NetCDF datasets against eager correction '''
+    from processing.bc_methods import getBCmethods
+    from geodata.netcdf import DatasetNetCDF
+    varlist = ['pr','T2']
+    for slices in (None, dict(time=(12,30))):
+      def source(): # a fresh (and possibly sliced) dataset, since VarNC slices are reset upon loading
+        dataset = DatasetNetCDF(filelist=[self.filepath], mode='r')
+        return dataset if slices is None else dataset(lidx=True, **slices)
+      for method in ('QM','Delta','AABC'):
+        BC = getBCmethods(method, varlist=varlist, blksize=7)
+        # N.B.: Delta corrections have the shape of the training data
+        if method == 'Delta' and slices: BC.train(source(), self.obs(lidx=True, **slices))
+        else: BC.train(DatasetNetCDF(filelist=[self.filepath], mode='r'), self.obs)
+        eager = BC.correct(source())
+        lazy = BC.correct(source(), llazy=True)
+        filename = '{:s}/{:s}_{:s}.nc'.format(self.folder, method, 'slice' if slices else 'full')
+        bcfile = BC.correct(source(), filename=filename)
+        for varname in varlist:
+          data = eager[varname].data_array
+          assert np.all(np.isfinite(data)) and not isEqual(data, source()[varname].load().data_array)
+          assert isEqual(lazy[varname].load().data_array, data)
+          assert isEqual(bcfile[varname].load().data_array, data)
+        bcfile.close()
+
+  def testSaveLoad(self):
+    ''' test saving bias corrections to NetCDF files and loading them again (also only some variables) '''
+    from processing.bc_methods import getBCmethods, loadBiasCorrection
+    from geodata.netcdf import DatasetNetCDF
+    dataset = DatasetNetCDF(filelist=[self.filepath], mode='r')
+    for method in ('QM','Delta','AABC'):
+      BC = getBCmethods(method, varlist=['pr','T2','zs'])
+      BC.train(dataset, self.obs)
+      assert BC._correction['zs'] is None # identical variables are not corrected
+      filepath = BC.save('{:s}/bias_{:s}.nc'.format(self.folder,method))
+      newBC = loadBiasCorrection(filepath)
+      assert type(newBC) is type(BC) and newBC.varlist == BC.varlist
+      bcds = BC.correct(dataset); newds = newBC.correct(dataset)
+      for varname in BC.varlist: 
+        assert isEqual(newds[varname].data_array, bcds[varname].data_array)
+      # only load parameters for some variables
+      newBC = loadBiasCorrection(filepath, varlist=['T2'])
+      assert newBC.varlist == ['T2'] and newBC._correction.keys() == ['T2']
+      assert isEqual(newBC.correct(dataset)['T2'].data_array, bcds['T2'].data_array)
+    dataset.close()
+
+  def testExportBiasCorrection(self):
+    ''' test export of a bias-corrected dataset using a bias correction saved as NetCDF file '''
+    import processing.export as export
+    from processing.bc_methods import getBCmethods, getPickleFileName
+    from processing.misc import getTargetFile
+    from geodata.netcdf import DatasetNetCDF
+    from geodata.gdal import addGDALtoDataset
+    from utils.misc import namedTuple
+    from datetime import datetime
+    def loadfct(): return addGDALtoDataset(DatasetNetCDF(filelist=[self.filepath], mode='r'))
+    # train bias correction and save it in the dataset folder, where the export expects it
+    BC = getBCmethods('QM', varlist=['pr','T2'])
+    BC.train(loadfct(), self.obs)
+    BC.save('{:s}/{:s}'.format(self.folder, getPickleFileName(method='QM', obs_name='obs', gridstr='test', lpickle=False)))
+    # substitute meta data for the synthetic dataset
+    dataargs = namedTuple(dataset_name='model', period=None, periodstr='', avgfolder=self.folder, filetypes=[None], 
+                          filetype=None, domain=None, obs_res='model', varlist=None, grid='test', gridstr='test', 
+                          resolution=None)
+    srcage = datetime.fromtimestamp(os.path.getmtime(self.filepath))
+    def getMetaData(dataset, mode, args, lone=True): 
+      return dataargs, loadfct, srcage, "Processing Dataset 'model'"
+    getMetaData_orig = export.getMetaData; export.getMetaData = getMetaData
+    try:
+      expargs = dict(format='NetCDF', filetype='qm', lm3=False, exp_list=['pr','T2'])
+      bcargs = dict(method='QM', obs_dataset='obs', lpickle=None) # auto-detect NetCDF file
+      ec = export.performExport('TEST', 'time-series', dict(), expargs, bcargs, loverwrite=True, ldebug=ldebug)
+      assert ec == 0
+    finally: export.getMetaData = getMetaData_orig
+    # compare exported data to bias-corrected data
+    bcds = BC.correct(loadfct())
+    filepath = '{:s}/{:s}'.format(self.folder, getTargetFile(dataset='TEST', mode='time-series', dataargs=dataargs))
+    expds = DatasetNetCDF(filelist=[filepath], mode='r')
+    for varname in ('pr','T2'):
+      assert isEqual(expds[varname].load().data_array, bcds[varname].data_array)
+    expds.close()
+    
     
 if __name__ == "__main__":
 
@@ -320,11 +537,19 @@ if __name__ == "__main__":
     specific_tests = []
 #     specific_tests += ['ApplyAlongAxis']
 #     specific_tests += ['AsyncPool']    
+#     specific_tests += ['ApplyInThreads']
+#     specific_tests += ['TaskQueue']
 #     specific_tests += ['ExpArgList']
+#     specific_tests += ['ApplyOverArguments']
 #     specific_tests += ['LoadDataset']
 #     specific_tests += ['BasicLoadEnsembleTS']
 #     specific_tests += ['AdvancedLoadEnsembleTS']
 #     specific_tests += ['LoadStandardDeviation']
+#     specific_tests += ['MonthIndex']
+#     specific_tests += ['QuantileMapping']
+#     specific_tests += ['LazyCorrection']
+#     specific_tests += ['SaveLoad']
+#     specific_tests += ['ExportBiasCorrection']
 
 
     # list of tests to be performed
@@ -332,6 +557,7 @@ if __name__ == "__main__":
     # list of variable tests
     tests += ['MultiProcess']
 #     tests += ['Datasets'] 
+#     tests += ['BiasCorrection'] 
     
 
     # construct dictionary of test classes defined above
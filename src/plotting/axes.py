@@ -16,13 +16,14 @@ from matplotlib.projections import PolarAxes
 from types import NoneType
 from warnings import warn
 # internal imports
-from geodata.base import Variable, Ensemble
+from geodata.base import Variable, Axis, Ensemble
 from geodata.misc import ListError, ArgumentError, isEqual, AxisError
 from plotting.misc import smooth, checkVarlist, getPlotValues, errorPercentile, checkSample
-from plotting.misc import checkPseudoAxis, expandAxes
+from plotting.misc import checkPseudoAxis, expandAxes, decimateField
 from collections import OrderedDict
 from utils.misc import binedges, expandArgumentList, containerDepth, tabulate
 from geodata.stats import pearsonr
+from utils.stats import taylor_stats
 
 # list of plot arguments that apply only to lines
 line_args = ('lineformats','linestyles','markers','lineformat','linestyle','marker')
@@ -78,8 +79,10 @@ class MyAxes(Axes):
                   lprint=False, lfracdiff=False, hline=None, vline=None, 
                   lsmooth=False, lperi=False, lignore=False, aspect=None, norm=None,
                   lcontour=False, lfilled=True, shading='gouraud', centroids=False,
+                  decimate=None, decimation='mean',
                   expand_list=None, lproduct='inner', plotatts=None, **plotargs):
-    ''' create contour or pcolor plot of a single variable '''
+    ''' create contour or pcolor plot of a single variable; high-resolution fields can be reduced to 
+        the pixel density of the axes (decimate=True) or a given shape (decimate=(ny,nx)) '''
     # some options that will be implemented later
     if lsmooth: raise NotImplementedError
     if lparasiteMeans: raise NotImplementedError
@@ -155,6 +158,12 @@ class MyAxes(Axes):
     if norm is None:
         norm = LogNorm(vmin=clim[0],vmax=clim[1]) if clog else Normalize(vmin=clim[0],vmax=clim[1])
         # linear norm is mainly used to set color limits...
+    # reduce field to output resolution (after limits have been determined from the full field)
+    if decimate:
+        if decimate is True: 
+            bbox = self.get_window_extent() # size of axes in display pixels
+            decimate = (int(np.ceil(bbox.height)),int(np.ceil(bbox.width)))
+        vardata,xx,yy = decimateField(vardata, xx, yy, shape=decimate, method=decimation)
     if lcontour:
         if lfilled:
             plt = self.contourf(xx,yy,vardata, clevs, cmap=cmap, norm=norm, **plotargs)
@@ -1386,6 +1395,19 @@ class TaylorAxes(MyAxes):
         # return foinspection, if desired
         return self.reference
         
+    def taylorStatistics(self, varlist, reference=None, dof=None, minlen=3):
+        ''' compute correlations, p-values, standard deviations, centred RMS differences and means of all 
+            Variables in varlist w.r.t. the reference in one vectorized pass over the stacked arrays '''
+        if reference is None: reference = self.reference
+        if reference is None: raise ArgumentError('No reference datset specified.')
+        ref = reference.getArray(unmask=True, fillValue=np.NaN, dtype=np.float64)
+        for var in varlist:
+            if var.shape != ref.shape: 
+                raise AxisError("Variable '{}' is not compatible with reference '{}': {} != {}".format(var.name,reference.name,var.shape,ref.shape))
+        samples = np.stack([var.getArray(unmask=True, fillValue=np.NaN, dtype=np.float64) for var in varlist])
+        # N.B.: the reference is broadcast, so the statistics of all samples can be computed at once
+        return taylor_stats(samples.reshape((len(varlist),-1)), ref.ravel(), axis=-1, dof=dof, minlen=minlen)
+        
     def showRefLines(self, rmse=6, lnormalize=True, color='#959595', linestyle='--', linewidth=1, markersize=4,):
         ''' Add reference lines for reference standard deviation and RMSE cirles '''
         if self.reference is None: raise ArgumentError
@@ -1448,50 +1470,53 @@ class TaylorAxes(MyAxes):
         # arguments for computation of correlation
         cargs = dict(ignoreNaN=True, lstandardize=False)
         if corr_args: cargs.update(corr_args)
-        # compute std and rho/corr
+        # compute statistics for all variables at once
+        stats = self.taylorStatistics(varlist, dof=cargs.get('dof',None))
+        if cargs.get('lsmooth',False) or cargs.get('ldetrend',False):
+            # smoothing and detrending are not vectorized, so correlations have to be computed one by one
+            for i,var in enumerate(varlist):
+                stats['corr'][i], stats['pval'][i] = pearsonr(var, self.reference, lflatten=True, lpval=True, lrho=True, **cargs)
+        # helper to cast statistics as Variables (for scatterPlot)
+        def statVar(var, value, name, units):
+            axes = [Axis(coord=[np.NaN], atts=ax.atts) for ax in var.axes]
+            svar = Variable(data=np.asarray(value).reshape((1,)*var.ndim), axes=axes, atts=dict(name=name, units=units))
+            svar.plot = None # don't rescale or anythinof that sort!
+            return svar
+        # convert to Taylor diagram coordinates
         if plotatts is None: plotatts = dict()
         stdlist = []; corrlist = []; meanlist = []
-        for label,var in zip(labels,varlist):
-            # correlation
-            if pval is None:
-                corr = pearsonr(var, self.reference, asVar=True, axes=var.axes, keepdims=True, lpval=False, lrho=True, **cargs)
-            else:
-                corr, pvar = pearsonr(var, self.reference, asVar=True, axes=var.axes, keepdims=True, lpval=True, lrho=True, **cargs)
+        for i,label,var in zip(xrange(len(varlist)),labels,varlist):
+            corr = stats['corr'][i]; pvar = stats['pval'][i]
+            std = stats['std'][i]; mean = stats['mean'][i]
             # skip datasets with insignificant correlations
-            if linsig and pval is not None and pvar.mean() >= pval: 
+            if linsig and pval is not None and pvar >= pval: 
                 # skip this dataset and move to next one
-                if lprint: print('Skipping {:s}: p={:3.2f} (cc={:3.2f})'.format(label,pvar.mean(),corr.mean(),))
+                if lprint: print('Skipping {:s}: p={:3.2f} (cc={:3.2f})'.format(label,pvar,corr,))
                 corrlist.append(None); stdlist.append(None); meanlist.append(None) # None is a placeholder
             else:
                 # invert negative correlations
-                if corr.mean() < 0:
+                if corr < 0:
                     if labs: 
                         corr *= -1
                         warn("Inverting negative correlation ('{}').".format(label))
                     else: warn("Negative correlation encountered ('{}'); use labs=True to invert.".format(label))
-                corr.data_array = np.arccos(corr.data_array)
-                corr.plot = None # don't rescale or anythinof that sort!
-                corrlist.append(corr) 
+                corrlist.append(statVar(var, np.arccos(corr), '{:s}_{:s}_rho'.format(var.name,self.reference.name), '')) 
                 # assign significance via edge color (black means significant)
                 if pval is not None:
                     if label not in plotatts: plotatts[label] = dict() 
-                    plotatts[label]['edgecolors'] = 'k' if pval and pvar.mean() < pval else 'none'
+                    plotatts[label]['edgecolors'] = 'k' if pval and pvar < pval else 'none'
                 # std
-                std = var.std(asVar=True, axes=var.axes, keepdims=True)
                 if lnormalize: std /= self.ref_std
-                std.plot = None # don't rescale or anythinof that sort!
-                stdlist.append(std)
+                stdlist.append(statVar(var, std, var.name, var.units))
                 # means/biases
                 if lparasiteMeans or lprint:
-                    mean = var.mean(asVar=True, axes=var.axes, keepdims=True)
                     if lnormalize: mean /= self.ref_mean
-                    mean.plot = None # don't rescale or anythinof that sort!
-                    meanlist.append(mean)
+                    meanlist.append(statVar(var, mean, var.name, var.units))
                 else: meanlist.append(None)
                 # print feedback
                 if lprint: 
                     s = '{:s}: cc={:3.2f} (p={:3.2f}), std={:3.2f}, mean={:3.2f}'
-                    print(s.format(label,np.cos(corr.mean()),pvar.mean(),std.mean(),mean.mean()))
+                    print(s.format(label,corr,pvar,std,mean))
         ## add data points to plot
         # add elements of Taylor diagram 
         plts = self.scatterPlot(xvars=corrlist, yvars=stdlist, legend=legend, llabel=llabel, labels=labels, title=title,  
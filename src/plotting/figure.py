@@ -9,6 +9,7 @@ A custom Figure class that provides some specialized functions and uses a custom
 # external imports
 from warnings import warn
 from types import NoneType
+import multiprocessing
 from matplotlib.figure import Figure, SubplotBase, subplot_class_factory
 from mpl_toolkits.axes_grid.axes_divider import LocatableAxes
 import numpy as np
@@ -16,6 +17,7 @@ import numpy as np
 from geodata.misc import isInt , ArgumentError
 from plotting.axes import MyAxes, MyLocatableAxes, Axes, MyPolarAxes, TaylorAxes
 from plotting.misc import loadStyleSheet, toGGcolors
+from processing.multiprocess import apply_in_processes
 import matplotlib as mpl
 # just for convenience
 from matplotlib.pyplot import show, figure
@@ -36,6 +38,7 @@ class MyFigure(Figure):
   legend_axes     = None
   shared_colorbar = None
   colorbar_axes   = None
+  saved_files     = None # list of files written by save
   
   def __init__(self, *args, **kwargs):
     ''' constructor that accepts custom axes_class as keyword argument '''
@@ -57,6 +60,7 @@ class MyFigure(Figure):
     self.axes_class = axes_class   
     self.axes_args = axes_args 
     self.axes_list = [] # list of actual subplots
+    self.saved_files = [] # files written by save
     # print options
     self.print_settings = dict(dpi=300, transparent=False) # defaults
     if print_settings: self.print_settings.update(print_settings)
@@ -321,6 +325,7 @@ class MyFigure(Figure):
     lreplaceSpace = kwargs.pop('lreplaceSpace', True) and kwargs.pop('lreplaceSpace', True)
     filetype = kwargs.pop('filetype', 'pdf')
     lword = kwargs.pop('lword', True) # also produce M$ Word compatible filetype (mainly EPS version of PDFs) 
+    lclose = kwargs.pop('lclose', False) # close figure after saving to free memory (batch mode)
     # construct filename
     basename = ''
     for arg in args: 
@@ -344,6 +349,7 @@ class MyFigure(Figure):
       filename = '{:s}/{:s}'.format(folder,filename)
       if lfeedback: print("('{:s}')".format(folder))
     self.savefig(filename, **sf) # save figure to pdf
+    self.saved_files.append(filename)
     # save M$ Word compatible file version
     if lword:
         # determine alternative filetype
@@ -355,6 +361,13 @@ class MyFigure(Figure):
             if lfeedback: print("(Saving alternate format as '{:s}')".format(altname))
             if folder: altname = '{:s}/{:s}'.format(folder,altname)
             self.savefig(altname, **sf) # save figure to pdf
+            self.saved_files.append(altname)
+    # release figure (and pyplot reference), once it is written to disk
+    if lclose:
+        from matplotlib.pyplot import close
+        close(self)
+    # return name of (primary) file
+    return filename
 
 
 ## convenience function to return a figure and an array of ImageGrid axes
@@ -550,5 +563,58 @@ def getFigAx(subplot, name=None, title=None, title_font='x-large', title_height=
   #if AxesGrid: fig = grid # return ImageGrid instead of figure
   return fig, axes
 
+
+## render independent figures in parallel
+
+# objects that are shared with worker processes (inherited by forking, rather than pickled for every task)
+_shared_objects = dict()
+
+def _renderFigure(plot_fct, args, kwargs, backend='Agg', lclose=True):
+  ''' helper function that renders a figure in a worker process, using a non-interactive backend '''
+  if backend and multiprocessing.current_process().name != 'MainProcess':
+    import matplotlib.pyplot as pyplot
+    if mpl.get_backend().lower() != backend.lower(): pyplot.switch_backend(backend)
+  # add shared objects (e.g. MapSetup instances)
+  kwargs = kwargs.copy()
+  for key,value in _shared_objects.items(): kwargs.setdefault(key,value)
+  result = plot_fct(*args, **kwargs)
+  # figures can't be passed back from a worker; return the names of the saved files instead
+  if isinstance(result,(list,tuple)) and len(result) > 0 and isinstance(result[0],Figure): result = result[0]
+  if isinstance(result,Figure):
+    fig = result; result = getattr(fig,'saved_files',None)
+    if lclose:
+      from matplotlib.pyplot import close
+      close(fig)
+  return result
+
+def renderFigures(plot_fct, arglist, kwargs=None, shared=None, NP=None, backend='Agg', lclose=True, ldebug=False):
+  ''' render and save independent figures (or panels/variables) in parallel; plot_fct is called once 
+      for every element of arglist (args tuples or kwargs dicts) and should create, save and return 
+      the figure (or any picklable result); figures are closed and replaced by the list of saved files. 
+      Objects in 'shared' (e.g. MapSetup instances) are passed as keyword arguments, but are only 
+      transferred to the workers once (by forking). The order of results is preserved. '''
+  if not callable(plot_fct): raise TypeError(plot_fct)
+  if kwargs is None: kwargs = dict()
+  elif not isinstance(kwargs,dict): raise TypeError(kwargs)
+  if shared is not None and not isinstance(shared,dict): raise TypeError(shared)
+  # assemble tasks
+  tasks = []
+  for args in arglist:
+    if isinstance(args,dict): 
+      tmpargs = kwargs.copy(); tmpargs.update(args); args = ()
+    else:
+      tmpargs = kwargs
+      if not isinstance(args,(list,tuple)): args = (args,)
+    tasks.append((_renderFigure, (plot_fct, tuple(args), tmpargs), dict(backend=backend, lclose=lclose)))
+  # execute tasks (shared objects have to be registered before the pool is created)
+  if shared: _shared_objects.update(shared)
+  try:
+    results = apply_in_processes(tasks, NP=NP, ldebug=ldebug)
+  finally:
+    if shared: 
+      for key in shared.keys(): _shared_objects.pop(key, None)
+  # return results in original order
+  return results
+
 if __name__ == '__main__':
     pass
\ No newline at end of file
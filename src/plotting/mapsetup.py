@@ -7,17 +7,31 @@ The class is intended for use the with plotting functions in this package.
 @author: Andre R. Erler, GPL v3
 '''
 
-import pickle, os
+import pickle, os, hashlib, tempfile
+import numpy as np
 from mpl_toolkits.basemap import Basemap
+from plotting.misc import decimateField
 
 rsphere = (6378137.00, 6356752.3142)
 
+# attributes that hold boundary data in Basemap instances (loaded on demand by Basemap)
+boundary_attributes = dict(countries='cntrysegs', states='statesegs', rivers='riversegs')
+
+def getProjectionKey(**kwargs):
+  ''' hash of all MapSetup parameters (projection, resolution, grid, annotation etc.), used to identify 
+      cached map setups; dicts are sorted, so that the key does not depend on their order '''
+  def canonical(value):
+    if isinstance(value,dict): return tuple(sorted((str(key),canonical(val)) for key,val in value.items()))
+    elif isinstance(value,(list,tuple)): return tuple(canonical(val) for val in value)
+    else: return repr(value)
+  return hashlib.md5(repr(canonical(kwargs))).hexdigest()[:16]
+
 class MapSetup(object):
   ''' The MapSetup class that carries parameters concerning map setup and annotation and contains methods 
       to annotate map or axes objects with these data. '''
   
   def __init__(self, name=None, projection=None, resolution=None, grid=None, scale=None, point_markers=None, 
-               lat_full=None, lat_half=None, lon_full=None, lon_half=None):
+               lat_full=None, lat_half=None, lon_full=None, lon_half=None, cache_folder=None):
     ''' Construct a MapSetup instance from input parameters. '''
     self.name = name or 'N/A'
     # projection parameters
@@ -39,6 +53,21 @@ class MapSetup(object):
     self.scale = scale
     # more annotation
     self.point_markers = point_markers
+    # cache for projected coordinates (also on disk, if cache_folder is set)
+    self._xy_cache = dict()
+    self.cache_folder = cache_folder
+    
+  # exclude projected coordinates from pickles (they can be large and are cheap to recompute once)
+  def __getstate__(self):
+    ''' return instance dict without coordinate cache '''
+    state = self.__dict__.copy()
+    state.pop('_xy_cache', None)
+    return state
+  def __setstate__(self, state):
+    ''' restore instance dict and reinitialize coordinate cache '''
+    self.__dict__.update(state)
+    self._xy_cache = dict()
+    self.__dict__.setdefault('cache_folder', None) # older pickles
      
   # get projection
   def getProjectionSettings(self):
@@ -46,6 +75,60 @@ class MapSetup(object):
     # return values
     return self.projection, self.grid, self.resolution
 
+  # project coordinates (cached)
+  def transform(self, lon, lat, basemap=None, key=None):
+    ''' project lon/lat coordinates using basemap (default: template); results are cached per grid 
+        (key or hash of coordinates) and projection, since transforms of large grids are expensive '''
+    if basemap is None: basemap = self.basemap
+    lon = np.asanyarray(lon); lat = np.asanyarray(lat)
+    if key is None: # identify grid by its coordinates
+      key = (lon.shape,) + tuple(hashlib.md5(np.ascontiguousarray(coord)).hexdigest() for coord in (lon,lat))
+    key = (key, basemap.proj4string, basemap.llcrnrx, basemap.llcrnry) # add projection
+    if key not in self._xy_cache: 
+      # look for coordinates cached on disk
+      cachefile = None
+      if self.cache_folder:
+        cachefile = '{:s}/{:s}_xy_{:s}.npz'.format(self.cache_folder,self.name,hashlib.md5(repr(key)).hexdigest())
+      if cachefile and os.path.exists(cachefile):
+        with np.load(cachefile) as npz: xy = (npz['x'],npz['y'])
+      else:
+        xy = basemap(lon, lat)
+        if cachefile: # write to temporary file first, so that concurrent workers never read incomplete files
+          fd, tmpfile = tempfile.mkstemp(dir=self.cache_folder, suffix='.tmp')
+          with os.fdopen(fd, 'wb') as f: np.savez(f, x=xy[0], y=xy[1])
+          os.rename(tmpfile, cachefile)
+      self._xy_cache[key] = xy
+    # N.B.: cached arrays are returned directly and should not be modified in-place
+    return self._xy_cache[key]
+  
+  # reduce field to output resolution and project coordinates
+  def prepareField(self, data, lon, lat, ax=None, basemap=None, shape=None, method='mean', key=None):
+    ''' decimate/aggregate a 2D field to the pixel density of the axes (or the given shape) and return 
+        data and projected coordinates (x,y) for plotting; lon/lat can be 1D or 2D '''
+    lon = np.asanyarray(lon); lat = np.asanyarray(lat)
+    if lon.ndim == 1 and lat.ndim == 1: lon,lat = np.meshgrid(lon,lat)
+    if shape is None and ax is not None:
+      bbox = ax.get_window_extent() # size of axes in display pixels
+      shape = (int(np.ceil(bbox.height)),int(np.ceil(bbox.width)))
+    if shape is not None:
+      oldshape = data.shape
+      data,lon,lat = decimateField(data, lon, lat, shape=shape, method=method)
+      if key is not None and data.shape != oldshape: key = (key, data.shape, method)
+    # project coordinates
+    x,y = self.transform(lon, lat, basemap=basemap, key=key)
+    return data, x, y
+
+  # preload boundary data
+  def loadBoundaries(self, boundaries=('countries',)):
+    ''' load boundary data (borders etc.) into the basemap template, so that they are cached with it; 
+        coastlines are already loaded during initialization (if resolution is not None) '''
+    for boundary in boundaries:
+      if boundary not in boundary_attributes: raise ValueError(boundary)
+      attr = boundary_attributes[boundary]
+      if not hasattr(self.basemap, attr):
+        segs, types = self.basemap._readboundarydata(boundary) # same as Basemap.drawcountries etc.
+        setattr(self.basemap, attr, segs)
+
   # draw lat/lon grid
   def drawGrid(self, basemap, left=True, bottom=True, minor=True):
     ''' add meridians and parallels; 'left' and 'bottom' indicate whether parallel and meridians are labeled '''
@@ -94,24 +177,33 @@ class MapSetup(object):
 
 
 ## function that serves a MapSetup instance with complementary pickles
-def getMapSetup(lpickle=False, folder=None, name=None, lrm=False, **kwargs):
-  ''' function that serves a MapSetup instance with complementary pickles '''
+def getMapSetup(lpickle=False, folder=None, name=None, lrm=False, lcache=False, boundaries=('countries',), **kwargs):
+  ''' function that serves a MapSetup instance with complementary pickles; with lcache, the pickle is 
+      keyed by all MapSetup parameters, boundary data are preloaded, and projected 
+      coordinates are also cached in folder '''
   # handle pickling
-  if lpickle:
+  if lpickle or lcache:
     if not isinstance(folder,basestring): raise TypeError 
     if not os.path.exists(folder): raise IOError, folder
-    filename = '{0:s}/{1:s}.pickle'.format(folder,name)
+    if lcache:
+      key = getProjectionKey(boundaries=boundaries, **kwargs) # all parameters that affect the MapSetup
+      filename = '{0:s}/{1:s}_{2:s}.pickle'.format(folder,name,key)
+      kwargs['cache_folder'] = folder
+    else:
+      filename = '{0:s}/{1:s}.pickle'.format(folder,name)
     if os.path.exists(filename) and not lrm:
       # open existing MapSetup from pickle
-      filehandle = open(filename, 'r')
+      filehandle = open(filename, 'rb')
       mapSetup = pickle.load(filehandle)
       filehandle.close()
+      if lcache: mapSetup.cache_folder = folder # folder may have moved
     else:
       if lrm and os.path.exists(filename): os.remove(filename) 
       # create new MapSetup and also pickle it
       mapSetup = MapSetup(name=name, **kwargs)
-      filehandle = open(filename, 'w')
-      pickle.dump(mapSetup, filehandle)
+      if lcache and boundaries: mapSetup.loadBoundaries(boundaries)
+      filehandle = open(filename, 'wb')
+      pickle.dump(mapSetup, filehandle, pickle.HIGHEST_PROTOCOL if lcache else 0)
       filehandle.close()
   else:
     # instantiate object
@@ -10,10 +10,11 @@ utility functions, mostly for plotting, that are not called directly
 import scipy
 import numpy as np
 import matplotlib as mpl
+import warnings
 from types import NoneType
 # internal imports
 from geodata.base import Variable, Dataset, Ensemble
-from geodata.misc import VariableError, AxisError
+from geodata.misc import VariableError, AxisError, ArgumentError
 from utils.misc import evalDistVars
 from utils.signalsmooth import smooth # commonly used in conjunction with plotting...
 
@@ -139,6 +140,35 @@ def expandAxes(xax, yax, shape, ltranspose=False):
     # return 2D coordinate arrays, like meshgrid
     return xax,yax
 
+# helper function to reduce a 2D field to the pixel density of the output
+def decimateField(data, xx, yy, shape, method='mean'):
+    ''' reduce a 2D field and its 2D coordinate arrays to (at most) the given shape (e.g. the pixel 
+        size of the axes), using integer block factors; method 'mean' computes NaN-aware block 
+        averages (data and coordinates), 'subsample' selects the central point of each block '''
+    if data.ndim != 2 or xx.shape != data.shape or yy.shape != data.shape: 
+        raise AxisError("Data and coordinate arrays have to be 2D and of identical shape: {}, {}, {}".format(data.shape,xx.shape,yy.shape))
+    ye,xe = data.shape
+    fy = max(1,int(np.ceil(float(ye)/shape[0]))); fx = max(1,int(np.ceil(float(xe)/shape[1])))
+    if fy == 1 and fx == 1: return data, xx, yy # nothing to do
+    if method.lower() == 'subsample':
+        slc = (slice(fy//2,None,fy),slice(fx//2,None,fx))
+        return data[slc], xx[slc], yy[slc]
+    elif method.lower() != 'mean': raise ArgumentError(method)
+    # pad arrays with NaN to a multiple of the block size and average over blocks
+    ny = int(np.ceil(float(ye)/fy)); nx = int(np.ceil(float(xe)/fx))
+    lmask = isinstance(data,np.ma.MaskedArray)
+    def blockMean(array):
+        tmp = np.full((ny*fy,nx*fx), np.NaN, dtype=np.float64)
+        if isinstance(array,np.ma.MaskedArray): tmp[:ye,:xe] = array.filled(np.NaN)
+        else: tmp[:ye,:xe] = array
+        with warnings.catch_warnings(): # all-NaN blocks are expected (and remain NaN)
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            return np.nanmean(tmp.reshape((ny,fy,nx,fx)), axis=(1,3))
+    data = blockMean(data)
+    if lmask: data = np.ma.masked_invalid(data, copy=False)
+    # return reduced data and coordinates
+    return data, blockMean(xx), blockMean(yy)
+
 
 # function to check and prepare sample variables (including handling of bootstrapping)
 def checkSample(varlist, varname=None, bins=None, support=None, method='pdf', lignore=False, 
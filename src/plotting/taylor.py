@@ -10,6 +10,7 @@ http://www-pcmdi.llnl.gov/about/staff/Taylor/CV/Taylor_diagram_primer.htm
 """
 
 import numpy as NP
+from utils.stats import taylor_stats
 
 class TaylorDiagram(object):
     """Taylor diagram: plot model standard deviation and correlation
@@ -86,13 +87,14 @@ class TaylorDiagram(object):
 
     def get_coords(self, sample):
         """Computes theta=arccos(correlation),rad=stddev of sample
-        wrt. reference sample."""
+        wrt. reference sample. sample can also be a stack of samples
+        (sample axis last), which are processed in one vectorized pass."""
 
-        std = NP.std(sample)
-        corr = NP.corrcoef(self.ref, sample) # [[1,rho],[rho,1]]
-        theta = NP.arccos(corr[0,1])
+        stats = taylor_stats(sample, self.ref, axis=-1)
+        std = stats['std']; corr = stats['corr']
+        theta = NP.arccos(corr)
 
-        print "Sample std,rho:",std,corr[0,1]
+        print "Sample std,rho:",std,corr
 
         return theta,std
 
@@ -22,7 +22,7 @@ from geodata.misc import isZero, isOne, isEqual
 from geodata.base import Variable, Axis, Dataset
 from datasets.common import data_root
 # import modules to be tested
-from plotting.figure import getFigAx
+from plotting.figure import getFigAx, renderFigures
 # use common MPL instance
 # from plotting.misc import loadMPL
 # mpl,pyl = loadMPL(linewidth=1.)
@@ -38,6 +38,14 @@ if not os.path.isdir(workdir): raise IOError, workdir
 # stylesheet = None
 figargs = dict(stylesheet='myggplot', lpresentation=True, lpublication=False)
 
+# module-level plot function for parallel rendering (has to be picklable)
+def plotSurface(var, name=None, folder=None, scale=1.):
+  ''' plot and save a single surface plot '''
+  fig,ax = getFigAx(1, name=name, **figargs)
+  ax.surfacePlot(var*scale, lprint=False)
+  fig.save(name, folder=folder, filetype='png', lword=False)
+  return fig
+
 
 class SurfacePlotTest(unittest.TestCase):  
   
@@ -114,6 +122,29 @@ class SurfacePlotTest(unittest.TestCase):
     # add label
     ax.addLabel(label=0, loc=4, lstroke=False, lalphabet=True, size=None, prop=None)
 
+  def testDecimatedSurfacePlot(self):
+    ''' test a color/surface plot and a contour plot with reduced resolution '''    
+    fig,axes = getFigAx(2, name=sys._getframe().f_code.co_name[4:], **figargs) # use test method name as title
+    var0 = self.var0
+    # reduce to a fixed shape and to the pixel density of the axes (no effect here)
+    plt = axes[0].surfacePlot(var0, clim=var0.limits(), decimate=(6,5), decimation='mean')
+    assert plt
+    assert plt.get_array().size == 6*5, plt.get_array().shape
+    plt = axes[1].surfacePlot(var0, lcontour=True, clevs=5, decimate=True, decimation='subsample')
+    assert plt
+
+  def testParallelRendering(self):
+    ''' test rendering of independent figures in worker processes '''
+    name = sys._getframe().f_code.co_name[4:]
+    arglist = [dict(name='{:s}_{:d}'.format(name,i), scale=float(i+1)) for i in range(4)]
+    results = renderFigures(plotSurface, arglist, kwargs=dict(folder=workdir), 
+                            shared=dict(var=self.var0), NP=2)
+    # results are lists of saved files, in the original order
+    assert len(results) == len(arglist)
+    for args,files in zip(arglist,results):
+      assert files == ['{:s}/{:s}.png'.format(workdir,args['name'])], files
+      assert os.path.exists(files[0])
+
   def testSharedColorbar(self):
     ''' test a simple shared colorbar between to surface plots '''
     name = sys._getframe().f_code.co_name[4:]    
@@ -607,6 +638,12 @@ class TaylorPlotTest(PolarPlotTest):
     # add some dots...
     plts, = ax.taylorPlot([var1, var2], reference=var0, rmse_lines=6)
     assert len(plts) == 2
+    # check vectorized statistics
+    stats = ax.taylorStatistics([var1, var2])
+    for i,data in enumerate([self.data1, self.data2]):
+      assert isEqual(stats['corr'][i], np.corrcoef(data, self.data0)[0,1])
+      assert isEqual(stats['std'][i], data.std())
+      assert isEqual(stats['crmsd'][i]**2, data.std()**2 + self.data0.std()**2 - 2*data.std()*self.data0.std()*stats['corr'][i])
     plts, = ax.taylorPlot([var1*1.5, var2/2., var0], reference='Reference', loverride=True)
     assert len(plts) == 2
     # add a negative correlation
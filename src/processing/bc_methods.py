@@ -10,9 +10,13 @@ definition in a separate module, so it can be pickled and imported in other modu
 # external imports
 import collections as col
 import numpy as np
+import netCDF4 as nc
+import json, re
 # internal imports
-from geodata.misc import isEqual, DataError
+from geodata.misc import isEqual, DataError, AxisError, VariableError, days_per_month_365
 from geodata.netcdf import DatasetNetCDF, VarNC
+from geodata.base import monthlyUnitsList
+from utils.nctools import writeNetCDF
 
 
 # some helper stuff for validation
@@ -33,12 +37,15 @@ def getBCmethods(method, **bcargs):
         return SMBC(**bcargs)
     elif method.upper() == 'AABC':
         return AABC(**bcargs)
+    elif method.upper() in ('QM','QMAP'):
+        return QuantileMapping(**bcargs)
     else:
         raise NotImplementedError(method)
   
-def getPickleFileName(method=None, obs_name=None, mode=None, periodstr=None, gridstr=None, domain=None, tag=None, pattern=None):
-    ''' generate a name for a bias-correction pickle file, based on parameters '''
-    if pattern is None: pattern = 'bias_{:s}.pickle'
+def getPickleFileName(method=None, obs_name=None, mode=None, periodstr=None, gridstr=None, domain=None, tag=None, pattern=None, 
+                      lpickle=True):
+    ''' generate a name for a bias-correction pickle file (or NetCDF file, if lpickle=False), based on parameters '''
+    if pattern is None: pattern = 'bias_{:s}.pickle' if lpickle else 'bias_{:s}.nc'
     # abbreviation for data mode
     if mode is None: pass
     elif mode == 'climatology': aggregation = 'clim'
@@ -56,6 +63,148 @@ def getPickleFileName(method=None, obs_name=None, mode=None, periodstr=None, gri
     picklefile = pattern.format(name) # insert name into fixed pattern
     return picklefile
 
+def getReferenceDate(axis):
+    ''' helper function that parses the reference date of a time axis from the units or the long_name 
+        attribute (e.g. 'days since 1979-01-01' or 'Month since 1979-01'); returns None if there is none '''
+    for string in (axis.units, axis.atts.get('long_name',None)):
+        match = re.search(r'since\s+(\d{4})-(\d{1,2})(?:-(\d{1,2}))?', string or '')
+        if match: 
+            year, month, day = match.groups()
+            return np.datetime64('{:s}-{:02d}-{:02d}'.format(year, int(month), int(day or 1)))
+    return None
+
+def getMonthIndex(var, taxis='time', noleap=None):
+    ''' helper function that returns the month of the year (0-11) for each time step of a variable; 
+        climatologies ('Month of the Year', coordinates 1-12), as well as monthly and daily time axes 
+        with a reference date (e.g. 'Month since 1979-01' or 'days since 1979-01-01') are supported; 
+        daily axes use the Gregorian calendar, unless noleap=True or the calendar attribute of the 
+        time axis is 'noleap'/'365_day' (e.g. WRF and CESM) '''
+    time = var.getAxis(taxis); tcoord = np.asarray(np.floor(time.coord), dtype=np.int64)
+    if noleap is None:
+        calendar = time.atts.get('calendar','standard').lower()
+        if calendar in ('360_day','all_leap','366_day'): 
+            raise NotImplementedError("Calendar '{:s}' is not supported.".format(calendar))
+        noleap = calendar in ('noleap','no_leap','365_day')
+    units = time.units.lower().split(' since')[0] # strip reference date
+    long_name = time.atts.get('long_name','').lower()
+    if units in monthlyUnitsList and ( units == 'month of the year' or 'month of the year' in long_name ): 
+        if np.any(tcoord < 1) or np.any(tcoord > 12): 
+            raise AxisError("Invalid coordinate values for monthly climatology: {}".format(tcoord))
+        return tcoord - 1 # climatology (possibly sliced)
+    refdate = getReferenceDate(time)
+    if refdate is None:
+        raise AxisError("Unable to determine reference date of time axis: {}".format(time))
+    if units in monthlyUnitsList:
+        return ( refdate.astype('datetime64[M]').astype(np.int64) + tcoord )%12
+    elif units in ('day','days') and noleap:
+        # 365-day calendar: day of the year of each time step, counting from the reference date
+        days = days_per_month_365.astype(np.int64); monthend = np.cumsum(days)
+        refmonth = refdate.astype('datetime64[M]'); imonth = refmonth.astype(np.int64)%12
+        refday = monthend[imonth] - days[imonth] + ( refdate - refmonth.astype('datetime64[D]') ).astype(np.int64)
+        return np.searchsorted(monthend, ( refday + tcoord )%365, side='right')
+    elif units in ('day','days'):
+        dates = refdate.astype('datetime64[D]') + tcoord.astype('timedelta64[D]')
+        return dates.astype('datetime64[M]').astype(np.int64)%12
+    else:
+        raise AxisError("Unable to infer month of the year from time axis: {}".format(time))
+
+def takeIndex(data, idx, offset=0):
+    ''' helper function to apply a tuple of slices or index arrays (one for each axis, starting at offset) 
+        to an array; singleton axes are not indexed, so that they can be broadcast '''
+    for i,ii in enumerate(idx):
+        iax = i + offset
+        if data.shape[iax] == 1 or ( isinstance(ii,slice) and ii == slice(None) ): continue
+        if isinstance(ii,slice): data = data[(slice(None),)*iax+(ii,)]
+        else: data = data.take(ii, axis=iax)
+    return data
+
+def translateIndex(idx, slc, n):
+    ''' helper function to translate a slice or index array relative to a NetCDF dimension of length n 
+        into an index array relative to a Variable that was sliced along that dimension using slc '''
+    if slc is None or ( isinstance(slc,slice) and slc == slice(None) ): return idx
+    fidx = np.arange(n)[idx] if isinstance(idx,slice) else np.asarray(idx)
+    if isinstance(slc,slice):
+        start, stop, step = slc.indices(n)
+        vidx = ( fidx - start ) // step
+        lvalid = ( ( fidx - start ) % step == 0 ) & ( vidx >= 0 ) & ( vidx < len(xrange(start,stop,step)) )
+    elif np.ndim(slc) == 1:
+        lut = np.zeros(n, dtype=np.int64) - 1 # lookup table for positions in the sliced Variable
+        lut[np.asarray(slc)] = np.arange(len(slc))
+        vidx = lut[fidx]; lvalid = vidx >= 0
+    else: raise NotImplementedError("Unable to translate indices for slice '{}'.".format(slc))
+    if not lvalid.all(): 
+        raise IndexError("NetCDF indices {} are not part of the sliced Variable.".format(fidx[~lvalid]))
+    return vidx
+
+
+class BCTransform(object):
+    ''' A callable that can be used as a VarNC transform to apply a bias correction lazily, whenever data 
+        are read from file; indices are relative to the NetCDF variable and are translated to indices 
+        relative to the (possibly sliced) reference Variable. '''
+    
+    def __init__(self, bc, varname, var, transform=None):
+        ''' save BiasCorrection instance, variable name and reference Variable (and an existing transform) '''
+        self.bc = bc; self.varname = varname; self.var = var; self.transform = transform
+        # N.B.: VarNC slices are reset after the first read, so we need to keep a copy
+        self.slices = None if getattr(var,'slices',None) is None else list(var.slices)
+    
+    def __call__(self, data=None, var=None, slc=None):
+        ''' reconstruct the index tuple from the NetCDF slices and apply bias correction to data '''
+        if self.transform is not None: data = self.transform(data=data, var=var, slc=slc)
+        ncshape = var.ncvar.shape
+        if not isinstance(slc,(list,tuple)): slc = [slc]*len(ncshape)
+        idx = []; shape = []; dims = []
+        for n,s in zip(ncshape,slc):
+            if var.squeezed and n == 1: continue # not a Variable axis
+            if isinstance(s,slice): 
+                idx.append(s); shape.append(len(xrange(*s.indices(n))))
+            elif np.ndim(s) == 0: 
+                idx.append([int(s)]); shape.append(1) # restore dimension
+            else: 
+                idx.append(np.asarray(s)); shape.append(len(idx[-1]))
+            dims.append(n)
+        # translate NetCDF indices to indices relative to the sliced reference Variable
+        if self.slices:
+            if len(self.slices) != len(idx): 
+                raise NotImplementedError("Unable to match slices {} to NetCDF indices {}.".format(self.slices,idx))
+            idx = [translateIndex(ii, s, n) for ii,s,n in zip(idx,self.slices,dims)]
+        oshape = data.shape
+        data = self.bc._correctBlock(data.reshape(shape), self.var, self.varname, tuple(idx))
+        return data.reshape(oshape)
+
+def loadBiasCorrection(filepath, varlist=None):
+    ''' load a BiasCorrection object from a NetCDF file (see BiasCorrection.save); if a varlist is 
+        given, only the correction parameters for these variables are read from file '''
+    ncfile = nc.Dataset(filepath, mode='r')
+    try:
+        cls = globals().get(str(ncfile.getncattr('bc_class')))
+        if not ( isinstance(cls,type) and issubclass(cls,BiasCorrection) ): 
+            raise TypeError(ncfile.getncattr('bc_class'))
+        def asStr(value): # JSON strings are unicode
+            if isinstance(value,unicode): return str(value)
+            elif isinstance(value,list): return [asStr(val) for val in value]
+            else: return value
+        params = {str(key):asStr(value) for key,value in json.loads(ncfile.getncattr('bc_params')).iteritems()}
+        for key in json.loads(ncfile.getncattr('bc_arrays')): params[key] = np.asarray(params[key])
+        identity = asStr(json.loads(ncfile.getncattr('bc_identity')))
+        # create instance without calling the constructor
+        BC = cls.__new__(cls)
+        BC.__dict__.update(params)
+        if varlist is None: varlist = BC.varlist
+        BC._correction = dict()
+        for varname in varlist:
+            if varname in identity: 
+                BC._correction[varname] = None
+            elif varname in ncfile.variables: 
+                correction = ncfile.variables[varname][...] # only read requested variables
+                if np.ma.isMaskedArray(correction) and not np.ma.is_masked(correction): correction = correction.data
+                BC._correction[varname] = correction[()] if correction.ndim == 0 else correction
+            else: 
+                raise VariableError("No correction for variable '{:s}' in file '{:s}'.".format(varname,filepath))
+        BC.varlist = [varname for varname in BC.varlist if varname in BC._correction]
+    finally: ncfile.close()
+    return BC
+
 ## classes that implement bias correction 
 
 class BiasCorrection(object):
@@ -65,10 +214,13 @@ class BiasCorrection(object):
     long_name = 'Generic Bias-Correction' # name for printing
     varlist = None # variables that a being corrected
     _picklefile = None # name of the pickle file where the object will be stored
+    blksize = None # number of time steps that are corrected at once (None: all)
+    taxis = 'time' # name of the time axis (for blocking)
     
-    def __init__(self, varlist=None, **bcargs):
+    def __init__(self, varlist=None, blksize=None, taxis='time', **bcargs):
         ''' take arguments that have been passed from caller and initialize parameters '''
         self.varlist = varlist
+        self.blksize = blksize; self.taxis = taxis
     
     def train(self, dataset, observations, **kwargs):
         ''' loop over variables that need to be corrected and call method-specific training function '''
@@ -80,7 +232,8 @@ class BiasCorrection(object):
         for varname in self.varlist:
             # get variable object
             var = dataset[varname]
-            if not var.data: var.load() # assume it is a VarNC, if there is no data
+            lload = not var.data
+            if lload: var.load() # assume it is a VarNC, if there is no data
             obsvar = observations[varname] # should be loaded
             if not obsvar.data: obsvar.load() # assume it is a VarNC, if there is no data
             assert var.data and obsvar.data, obsvar.data      
@@ -91,21 +244,17 @@ class BiasCorrection(object):
                 correction = self._trainVar(var, obsvar, **kwargs)
             # save correction parameters
             self._correction[varname] = correction
+            if lload: var.unload() # only keep one variable in memory at a time
   
     def _trainVar(self, var, obsvar, **kwargs):
         ''' optimize parameters for best fit of dataset to observations and save parameters;
             this method should be implemented for each method '''
         return None # do nothing
   
-    def correct(self, dataset, asNC=False, varlist=None, varmap=None, **kwargs):
-        ''' loop over variables and apply correction function based on specific method using stored parameters '''
-        # NetCDF datasets get special handling, so we only replace the variables we need to replace
-        if isinstance(dataset,DatasetNetCDF):
-            if not asNC: dataset.load() # otherwise we loose data
-            bcds = dataset.copy(axesdeep=True, varsdeep=False, asNC=asNC) # make a copy, but don't duplicate data
-        else: 
-            asNC=False
-            bcds = dataset.copy(axesdeep=True, varsdeep=False) # make a copy, but don't duplicate data
+    def correct(self, dataset, asNC=False, varlist=None, varmap=None, llazy=False, filename=None, **kwargs):
+        ''' loop over variables and apply correction function based on specific method using stored parameters;
+            NetCDF datasets can also be corrected lazily, whenever data are read (llazy=True), or block by 
+            block into a new NetCDF file (filename), so that variables never have to be fully loaded '''
         # prepare variable map, so we can iterate easily
         itermap = dict() # the map we are going to iterate over
         varlist = self.varlist if varlist is None else varlist
@@ -117,16 +266,39 @@ class BiasCorrection(object):
                 else: raise TypeError(maplist)
             else:
                 itermap[varname] = (varname,)
+        # write bias-corrected variables into a new NetCDF file, one time block at a time
+        if filename is not None:
+            if not isinstance(dataset,DatasetNetCDF): raise TypeError(dataset)
+            ncfile = writeNetCDF(dataset, filename, skipUnloaded=True, close=False) # only coordinates are written
+            bcds = DatasetNetCDF(dataset=ncfile, mode='rw', atts=dataset.atts.copy())
+            srcmap = {tgtvar:srcvar for srcvar,maplist in itermap.items() for tgtvar in maplist}
+            for varname,var in dataset.variables.iteritems():
+                self._writeVar(var, bcds[varname], srcmap.get(varname,None))
+            bcds.sync()
+            return bcds
+        # NetCDF datasets get special handling, so we only replace the variables we need to replace
+        if isinstance(dataset,DatasetNetCDF):
+            if not ( asNC or llazy ): dataset.load() # otherwise we loose data
+            bcds = dataset.copy(axesdeep=True, varsdeep=False, asNC=asNC or llazy) # make a copy, but don't duplicate data
+        else: 
+            asNC = False; llazy = False
+            bcds = dataset.copy(axesdeep=True, varsdeep=False) # make a copy, but don't duplicate data
         # loop over variables that will be corrected
         for srcvar,maplist in itermap.items():
             for tgtvar in maplist:
                 if tgtvar in dataset:
+                    assert srcvar in self._correction, self._correction
                     # get variable object
-                    oldvar = dataset[tgtvar].load()
-                    newvar = bcds[tgtvar] # should be loaded
+                    oldvar = dataset[tgtvar]
+                    newvar = bcds[tgtvar]
+                    if llazy and isinstance(newvar,VarNC) and not oldvar.data:
+                        # apply bias-correction on the fly, whenever data are read
+                        if self._correction[srcvar] is not None:
+                            newvar.transform = BCTransform(self, srcvar, var=oldvar, transform=newvar.transform)
+                        continue
+                    oldvar.load()
                     if isinstance(newvar,VarNC): # the corrected variable needs to load data, hence can't be VarNC          
                         newvar = newvar.copy(axesdeep=False, varsdeep=False, asNC=False) 
-                    assert varname in self._correction, self._correction
                     # bias-correct data and load in new variable 
                     if self._correction[srcvar] is not None:
                         newvar.load(self._correctVar(oldvar, srcvar))
@@ -135,11 +307,54 @@ class BiasCorrection(object):
         # return bias-corrected dataset
         return bcds
     
+    def _getBlocks(self, var):
+        ''' generate index tuples for blocks of blksize time steps (or the entire variable) '''
+        idx = [slice(None)]*var.ndim
+        if self.blksize and var.hasAxis(self.taxis):
+            itime = var.axisIndex(self.taxis); tlen = var.shape[itime]
+            for t0 in xrange(0,tlen,self.blksize):
+                idx[itime] = slice(t0,min(t0+self.blksize,tlen))
+                yield tuple(idx)
+        else: yield tuple(idx)
+    
+    def _readBlock(self, var, idx):
+        ''' return a block of data; VarNC data are read directly from file, if they are not loaded '''
+        if not var.data and not ( isinstance(var,VarNC) and not var.slices ): 
+            var.load() # N.B.: indices of a sliced VarNC are NetCDF-relative, so it has to be loaded
+        return var.data_array.__getitem__(idx) if var.data else var.__getitem__(idx)
+    
+    def _writeVar(self, var, ncvar, varname=None):
+        ''' copy a Variable block by block into a (new) NetCDF variable and apply bias correction, 
+            if a correction for varname is available '''
+        if var.strvar: # string variables are small and need special handling
+            ncvar.load(var.load().data_array); ncvar.sync(); return
+        lbc = varname is not None and self._correction.get(varname,None) is not None
+        for idx in self._getBlocks(var):
+            data = self._readBlock(var, idx)
+            if lbc: data = self._correctBlock(data, var, varname, idx)
+            ncvar.ncvar.__setitem__(idx, data) # masking is handled by the NetCDF module
+    
     def _correctVar(self, var, varname=None, **kwargs):
-        ''' apply bias correction to new variable and return bias-corrected data;
-            this method should be implemented for each method '''
+        ''' apply bias correction block by block and return bias-corrected data; the actual correction 
+            is implemented in _correctBlock, for each method '''
         if varname is None: varname = var.name # allow for variable mapping
-        return var.data_array # do nothing, just return input
+        blocks = list(self._getBlocks(var))
+        if len(blocks) == 1: 
+            return self._correctBlock(self._readBlock(var, blocks[0]), var, varname, blocks[0])
+        bcdata = None; nwritten = 0
+        for idx in blocks:
+            data = self._correctBlock(self._readBlock(var, idx), var, varname, idx)
+            if bcdata is None: 
+                bcdata = ( np.ma.empty if np.ma.isMaskedArray(data) else np.empty )(var.shape, dtype=data.dtype)
+            bcdata.__setitem__(idx, data); nwritten += data.size
+        if nwritten != bcdata.size: 
+            raise DataError("Only {:d} of {:d} elements were bias-corrected.".format(nwritten,bcdata.size))
+        return bcdata
+    
+    def _correctBlock(self, data, var, varname, idx):
+        ''' apply bias correction to a block of data and return bias-corrected data; idx is a tuple of 
+            slices or index arrays for each axis of var; this method should be implemented for each method '''
+        return data # do nothing, just return input
     
     def _getVarlist(self, dataset, observations):
         ''' find all valid candidate variables for bias correction present in both input datasets '''
@@ -182,13 +397,35 @@ class BiasCorrection(object):
         self._validation = validation # also store
         return validation
     
-    def picklefile(self, obs_name=None, mode=None, periodstr=None, gridstr=None, domain=None, tag=None):
-        ''' generate a standardized name for the pickle file, based on arguments '''
+    def picklefile(self, obs_name=None, mode=None, periodstr=None, gridstr=None, domain=None, tag=None, lpickle=True):
+        ''' generate a standardized name for the pickle (or NetCDF) file, based on arguments '''
         if self._picklefile is None:      
             self._picklefile = getPickleFileName(method=self.name, obs_name=obs_name, periodstr=periodstr, 
-                                                 gridstr=gridstr, domain=domain, tag=tag) 
+                                                 gridstr=gridstr, domain=domain, tag=tag, lpickle=lpickle) 
         return self._picklefile
     
+    def save(self, filepath, zlib=True):
+        ''' save parameters in a compact NetCDF file: the class name and parameters are stored as global 
+            attributes and correction parameters as separate variables, so they can be loaded individually '''
+        params = {key:value for key,value in self.__dict__.iteritems() if key[0] != '_'}
+        arrays = [key for key,value in params.iteritems() if isinstance(value,np.ndarray)]
+        identity = [varname for varname,correction in self._correction.iteritems() if correction is None]
+        ncfile = nc.Dataset(filepath, mode='w', format='NETCDF4')
+        try:
+            ncfile.setncattr('bc_class', self.__class__.__name__)
+            ncfile.setncattr('bc_params', json.dumps(params, default=lambda a: a.tolist()))
+            ncfile.setncattr('bc_arrays', json.dumps(arrays))
+            ncfile.setncattr('bc_identity', json.dumps(identity)) # variables without correction
+            for varname,correction in self._correction.iteritems():
+                if correction is None: continue
+                if not np.ma.isMaskedArray(correction): correction = np.asarray(correction)
+                dims = tuple('{:s}_{:d}'.format(varname,i) for i in xrange(correction.ndim))
+                for dim,n in zip(dims,correction.shape): ncfile.createDimension(dim, n)
+                ncvar = ncfile.createVariable(varname, correction.dtype, dims, zlib=zlib)
+                ncvar[...] = correction
+        finally: ncfile.close()
+        return filepath
+    
     def __str__(self):
         ''' a string representation of the method and parameters '''
         text = '{:s} Object'.format(self.long_name)
@@ -228,14 +465,15 @@ class Delta(BiasCorrection):
         # return correction parameters, i.e. delta
         return delta
           
-    def _correctVar(self, var, varname=None, **kwargs):
-        ''' use stored ratios to bias-correct the input dataset and return a new copy '''
-        if varname is None: varname = var.name # allow for variable mapping
+    def _correctBlock(self, data, var, varname, idx):
+        ''' use stored ratios to bias-correct a block of data and return a new copy '''
+        correction = self._correction[varname]
+        if np.ndim(correction) == data.ndim: correction = takeIndex(correction, idx) # select block
         # decide between difference or ratio based on variable type
         if var.units in self._ratio_units: # ratio for fluxes
-            data = var.data_array * self._correction[varname]
+            data = data * correction
         else: # default behavior is differences
-            data = var.data_array + self._correction[varname]    
+            data = data + correction    
         # return bias-corrected data (copy)
         return data
 
@@ -289,6 +527,100 @@ class AABC(Delta):
         return r
         
         
+class QuantileMapping(BiasCorrection):
+    ''' A class that implements empirical quantile mapping; quantile tables are computed for every grid point 
+        and month of the year (if lmonthly=True) and are stored as compact single-precision arrays. '''
+    name = 'QM' # name used in file names
+    long_name = 'Empirical Quantile Mapping' # name for printing
+    _ratio_units = Delta._ratio_units # variable units that indicate ratio (for extrapolation)
+    noleap = None # calendar of daily time axes (None: infer from calendar attribute)
+    
+    def __init__(self, varlist=None, nquantiles=51, lmonthly=True, noleap=None, taxis='time', blksize=1000, **bcargs):
+        ''' set number of quantiles, stratification by month (and calendar), and time block size for correction '''
+        super(QuantileMapping,self).__init__(varlist=varlist, blksize=blksize, taxis=taxis, **bcargs)
+        self.quantiles = np.linspace(0, 100, nquantiles) # percentiles for tables
+        self.lmonthly = lmonthly; self.noleap = noleap
+    
+    def _getGroups(self, var):
+        ''' return group (month) index for each time step and number of groups '''
+        if self.lmonthly: return getMonthIndex(var, taxis=self.taxis, noleap=self.noleap), 12
+        else: return np.zeros(len(var.getAxis(self.taxis)), dtype=np.int64), 1
+    
+    def _getTimeSeries(self, var):
+        ''' return data array with time axis first and masked values replaced by NaN '''
+        data = var.data_array
+        if np.ma.isMaskedArray(data): data = data.astype(np.float32).filled(np.NaN)
+        return np.rollaxis(data, var.axisIndex(self.taxis), 0)
+    
+    def _trainVar(self, var, obsvar, **kwargs):
+        ''' compute quantile tables of model and observations for each group (month) and grid point; 
+            returns a single-precision array with shape (2, groups, quantiles, ...) '''
+        if not var.hasAxis(self.taxis) or not obsvar.hasAxis(self.taxis): 
+            raise AxisError("Quantile mapping requires a '{:s}' axis.".format(self.taxis))
+        tables = []
+        for tsvar in (var,obsvar):
+            data = self._getTimeSeries(tsvar); groups, ngrp = self._getGroups(tsvar)
+            table = np.zeros((ngrp,len(self.quantiles))+data.shape[1:], dtype=np.float32)
+            for grp in range(ngrp):
+                grpdata = data[groups == grp] # also works with 1D time-series
+                if len(grpdata) == 0: 
+                    raise DataError("No data for group/month {:d} of Variable '{:s}'.".format(grp+1,tsvar.name))
+                table[grp,:] = np.nanpercentile(grpdata, self.quantiles, axis=0)
+            tables.append(table)
+        if tables[0].shape != tables[1].shape: raise DataError(tables[1].shape)
+        # return compact quantile tables
+        return np.stack(tables, axis=0)
+    
+    def _mapQuantiles(self, data, modq, obsq, lratio=False):
+        ''' map data onto observed quantiles using vectorized piece-wise linear interpolation; 
+            data has shape (time, points) and quantile tables (quantiles, points) '''
+        nq = len(modq); npts = data.shape[1]
+        # find the quantile interval for each value (tables are monotonic at each point)
+        idx = np.zeros(data.shape, dtype=np.int16 if nq < 32767 else np.int64)
+        for iq in range(1,nq-1):
+            idx += data >= modq[iq,:] # NaN's compare False
+        pts = np.arange(npts)
+        q0 = modq[idx,pts]; q1 = modq[idx+1,pts]; o0 = obsq[idx,pts]; o1 = obsq[idx+1,pts]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            w = np.where(q1 > q0, (data - q0)/(q1 - q0), 0.)
+        w = np.clip(w, 0., 1.)
+        bcdata = o0 + w*(o1 - o0)
+        # extrapolate outside the range of the table (constant correction)
+        below = data < modq[0,:]; above = data > modq[-1,:]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if lratio:
+                lo = data * np.where(modq[0,:] > 0, obsq[0,:]/modq[0,:], 1.)
+                hi = data * np.where(modq[-1,:] > 0, obsq[-1,:]/modq[-1,:], 1.)
+            else:
+                lo = data + (obsq[0,:] - modq[0,:]); hi = data + (obsq[-1,:] - modq[-1,:])
+        bcdata = np.where(below, lo, np.where(above, hi, bcdata))
+        if lratio: bcdata = np.maximum(bcdata, 0.) # no negative fluxes
+        return np.where(np.isnan(data), np.NaN, bcdata)
+    
+    def _correctBlock(self, data, var, varname, idx):
+        ''' apply quantile mapping to a block of data, using vectorized interpolation for each group '''
+        itime = var.axisIndex(self.taxis)
+        groups = self._getGroups(var)[0][idx[itime]]
+        tables = takeIndex(self._correction[varname], idx[:itime]+idx[itime+1:], offset=3)
+        lratio = var.units in self._ratio_units
+        lmask = np.ma.isMaskedArray(data)
+        dtype = np.result_type(data.dtype, np.float32)
+        if lmask: data = data.astype(dtype).filled(np.NaN)
+        # reshape to time and points
+        data = np.rollaxis(data, itime, 0); bshape = data.shape
+        data = data.reshape((bshape[0],-1)); npts = data.shape[1]
+        modtab = tables[0].reshape(tables.shape[1:3]+(npts,))
+        obstab = tables[1].reshape(tables.shape[1:3]+(npts,))
+        bcdata = np.empty(data.shape, dtype=dtype)
+        for grp in np.unique(groups):
+            tidx = np.flatnonzero(groups == grp)
+            bcdata[tidx,:] = self._mapQuantiles(data[tidx,:], modtab[grp], obstab[grp], lratio=lratio)
+        # restore axis order and mask
+        bcdata = np.rollaxis(bcdata.reshape(bshape), 0, itime+1)
+        if lmask: bcdata = np.ma.masked_invalid(bcdata, copy=False)
+        return bcdata
+        
+
 class MyBC(BiasCorrection):
     ''' A BiasCorrection class that implements snowmelt shift and utilizes different (unobserved) precipitation types '''
     
@@ -25,7 +25,7 @@ from processing.bc_methods import getBCmethods
 
 
 # worker function that is to be passed to asyncPool for parallel execution; use of TrialNError decorator is assumed
-def generateBiasCorrection(dataset, mode, dataargs, obs_dataset, bc_method, bc_args, loverwrite=False, lgzip=None, tag=None, 
+def generateBiasCorrection(dataset, mode, dataargs, obs_dataset, bc_method, bc_args, loverwrite=False, lgzip=None, lpickle=False, tag=None, 
                            ldebug=False, lparallel=False, pidstr='', logger=None):
   ''' worker function to generate a bias correction objects for a given dataset '''
   # input checking
@@ -51,7 +51,7 @@ def generateBiasCorrection(dataset, mode, dataargs, obs_dataset, bc_method, bc_a
   # initialize BiasCorrection class instance
   BC = getBCmethods(bc_method, **bc_args)
   # get folder for target dataset and do some checks
-  picklefile = BC.picklefile(obs_name=obs_dataset.name, gridstr=dataargs.grid, domain=dataargs.domain, tag=tag)
+  picklefile = BC.picklefile(obs_name=obs_dataset.name, gridstr=dataargs.grid, domain=dataargs.domain, tag=tag, lpickle=lpickle)
   if ldebug: picklefile = 'test_' + picklefile 
   picklepath = '{:s}/{:s}'.format(avgfolder,picklefile)
   
@@ -106,15 +106,19 @@ def generateBiasCorrection(dataset, mode, dataargs, obs_dataset, bc_method, bc_a
       BC.validate(dataset, obs_dataset, lprint=True)    
       print('')  
       
-    ## pickle bias-correction object with trained parameters
-    # open file and save pickle
+    ## save bias-correction object with trained parameters
     if os.path.exists(picklepath): os.remove(picklepath)
-    if lgzip:
-      op = gzip.open 
-      picklepath += '.gz'
-    else: op = open
-    with op(picklepath, 'wb') as filehandle:
-      pickle.dump(BC, filehandle, protocol=-1) # should be new binary protocol
+    if lpickle:
+      # open file and save pickle
+      if lgzip:
+        op = gzip.open 
+        picklepath += '.gz'
+      else: op = open
+      with op(picklepath, 'wb') as filehandle:
+        pickle.dump(BC, filehandle, protocol=-1) # should be new binary protocol
+    else:
+      # compact NetCDF file; variables can be loaded individually
+      BC.save(picklepath, zlib=lgzip is not False)
     if not os.path.exists(picklepath):
       raise IOError, "Error while saving Pickle to '{0:s}'".format(picklepath)
 
@@ -180,6 +184,7 @@ if __name__ == '__main__':
     # target data specs
     export_arguments = config['export_parameters'] # this is actually a larger data structure
     lm3 = export_arguments['lm3'] # convert water flux from kg/m^2/s to m^3/m^2/s    
+    lpickle = config.get('lpickle',False) # save as pickle, rather than NetCDF
   else:
     # settings for testing and debugging
     NP = 1 ; ldebug = False # for quick computations
@@ -224,7 +229,8 @@ if __name__ == '__main__':
 #     obs_args = dict(resolution='na12', varatts=dict(pet=dict(name='pet_wrf')), period=(1980,2010))
     # renaming NRCan pet to pet_wrf is necessary to bias-correct WRF PET
     ## remaining parameters
-    lgzip = True # compress pickles
+    lgzip = True # compress pickles (or NetCDF files)
+    lpickle = False # save as pickle, rather than NetCDF
     tag = None # an additional tag string for pickle name
     load_list = None # variables that need to be loaded
     varlist = None # variables that should be bias-corrected
@@ -329,7 +335,7 @@ if __name__ == '__main__':
                                           varlist=load_list, domain=domain, period=period)) )
       
   # static keyword arguments
-  kwargs = dict(obs_dataset=obs_dataset, bc_method=bc_method, bc_args=bc_args, loverwrite=loverwrite, lgzip=lgzip, tag=tag)
+  kwargs = dict(obs_dataset=obs_dataset, bc_method=bc_method, bc_args=bc_args, loverwrite=loverwrite, lgzip=lgzip, lpickle=lpickle, tag=tag)
   # N.B.: formats will be iterated over inside export function
   
   ## call parallel execution function
@@ -24,10 +24,13 @@ from processing.misc import getMetaData,  getExperimentList, loadYAML, getTarget
 from utils.nctools import writeNetCDF
 # new variable functions and bias-correction 
 import processing.newvars as newvars
-from processing.bc_methods import getPickleFileName
+from processing.bc_methods import getPickleFileName, loadBiasCorrection
 
 ## helper classes to handle different file formats
 
+# binary raster formats (and GDAL driver names) that are handled like ASCII rasters
+raster_formats = dict(GeoTIFF='GTiff', ENVI='ENVI')
+
 class FileFormat(object):
   ''' A parent class from which specific format classes will be derived; the purpose is to provide a 
       unified interface for several different file formats. '''
@@ -110,7 +113,7 @@ class NetCDF(object):
     if not os.path.exists(filepath): raise IOError, filepath
    
 class ASCII_raster(FileFormat):
-  ''' A class to handle exports to ASCII_raster format. '''
+  ''' A class to handle exports to ASCII_raster format (or binary raster formats, using the GDAL driver argument). '''
   
   def __init__(self, project=None, folder=None, prefix=None, bc_method=None, **expargs):
     ''' take arguments that have been passed from caller and initialize parameters '''
@@ -209,6 +212,8 @@ def getFileFormat(fileformat, bc_method=None, **expargs):
   # decide based on expformat; instantiate object
   if fileformat == 'ASCII_raster':
     return ASCII_raster(bc_method=bc_method, **expargs)
+  elif fileformat in raster_formats:
+    return ASCII_raster(bc_method=bc_method, driver=raster_formats[fileformat], **expargs)
   elif fileformat.lower() in ('netcdf','netcdf4'):
     return NetCDF(bc_method=bc_method, **expargs)
   else:
@@ -257,21 +262,29 @@ def performExport(dataset, mode, dataargs, expargs, bcargs, loverwrite=False,
         bc_tag = bcargs.pop('tag',None) # an optional name extension/tag
         bc_pattern = bcargs.pop('file_pattern',None) # usually default in getPickleFile
         lgzip = bcargs.pop('lgzip',None) # if pickle is gzipped (None: auto-detect based on file name extension)
+        lpickle = bcargs.pop('lpickle',None) # legacy pickle or NetCDF file (None: auto-detect, NetCDF first)
         # get name of pickle file (and folder)
         picklefolder = dataargs.avgfolder.replace(dataset_name,bc_reference)
-        picklefile = getPickleFileName(method=bc_method, obs_name=bc_obs, gridstr=bc_grid, domain=bc_domain, 
-                                       tag=bc_tag, pattern=bc_pattern)
-        picklepath = '{:s}/{:s}'.format(picklefolder,picklefile)
-        if lgzip:
-            picklepath += '.gz' # add extension
-            if not os.path.exists(picklepath): raise IOError(picklepath)
-        elif lgzip is None:
-            lgzip = False
-            if not os.path.exists(picklepath):
-                lgzip = True # assume gzipped file
-                picklepath += '.gz' # try with extension...
+        if not lpickle:
+            picklefile = getPickleFileName(method=bc_method, obs_name=bc_obs, gridstr=bc_grid, domain=bc_domain, 
+                                           tag=bc_tag, pattern=bc_pattern, lpickle=False)
+            picklepath = '{:s}/{:s}'.format(picklefolder,picklefile)
+            if lpickle is None: lpickle = not os.path.exists(picklepath)
+            elif not os.path.exists(picklepath): raise IOError(picklepath)
+        if lpickle: # legacy pickle file
+            picklefile = getPickleFileName(method=bc_method, obs_name=bc_obs, gridstr=bc_grid, domain=bc_domain, 
+                                           tag=bc_tag, pattern=bc_pattern)
+            picklepath = '{:s}/{:s}'.format(picklefolder,picklefile)
+            if lgzip:
+                picklepath += '.gz' # add extension
                 if not os.path.exists(picklepath): raise IOError(picklepath)
-        elif not os.path.exists(picklepath): raise IOError(picklepath)
+            elif lgzip is None:
+                lgzip = False
+                if not os.path.exists(picklepath):
+                    lgzip = True # assume gzipped file
+                    picklepath += '.gz' # try with extension...
+                    if not os.path.exists(picklepath): raise IOError(picklepath)
+            elif not os.path.exists(picklepath): raise IOError(picklepath)
         pickleage = datetime.fromtimestamp(os.path.getmtime(picklepath))
         # determine age of pickle file and compare against source age
     else:
@@ -308,11 +321,14 @@ def performExport(dataset, mode, dataargs, expargs, bcargs, loverwrite=False,
           raise DateError, "Specifed period is inconsistent with netcdf records: '{:s}' != '{:s}'".format(periodstr,source.atts.period)
       
       # load BiasCorrection object from pickle
-      if bc_method:      
+      if bc_method and not lpickle:
+          BC = loadBiasCorrection(picklepath, varlist=bc_varlist) # only load required variables
+      elif bc_method:      
           op = gzip.open if lgzip else open
           with op(picklepath, 'r') as filehandle:
               BC = pickle.load(filehandle) 
-          # assemble logger entry
+      # assemble logger entry
+      if bc_method:
           bcmsgstr = "(performing bias-correction using {:s} from {:s} towards {:s})".format(BC.long_name,bc_reference,bc_obs)
       
       # print message
@@ -334,7 +350,9 @@ def performExport(dataset, mode, dataargs, expargs, bcargs, loverwrite=False,
       
       # apply bias-correction
       if bc_method:
-          source = BC.correct(source, asNC=False, varlist=bc_varlist, varmap=bc_varmap) # load bias-corrected variables into memory
+          source = BC.correct(source, asNC=False, llazy=True, varlist=bc_varlist, varmap=bc_varmap)
+          # N.B.: the bias-correction is applied lazily, whenever data are read from file, so that
+          #       corrected variables do not have to be held in memory all at once
         
       # N.B.: for variables that are not bias-corrected, data are not loaded immediately but on demand; this way 
       #       I/O and computing can be further disentangled and not all variables are always needed
@@ -628,7 +646,7 @@ if __name__ == '__main__':
     print('Export Variable List: {:s}'.format(printList(export_arguments['exp_list'])))
     if export_arguments['lm3']: '\n Converting kg/m^2/s (mm/s) into m^3/m^2/s (m/s)'
     # check formats (will be iterated over in export function, hence not part of task list)
-    if export_arguments['format'] == 'ASCII_raster':
+    if export_arguments['format'] == 'ASCII_raster' or export_arguments['format'] in raster_formats:
       print('Export Folder: {:s}'.format(export_arguments['folder']))
       print('File Prefix: {:s}'.format(export_arguments['prefix']))
     elif export_arguments['format'].lower() in ('netcdf','netcdf4'):
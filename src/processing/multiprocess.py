@@ -8,6 +8,7 @@ A simple script to test the usage of pool and how to return values...
 '''
 
 import multiprocessing
+from multiprocessing.pool import ThreadPool
 import logging
 import sys
 import gc # garbage collection
@@ -320,6 +321,110 @@ def apply_along_axis(fct, axis, data, NP=0, chunksize=200, ldebug=False, laax=Tr
   # return results
   return results
 
+def _call_task(task):
+  ''' helper function to execute a (func, args, kwargs) tuple in a pool worker '''
+  func, args, kwargs = task
+  return func(*args, **kwargs)
+
+def apply_in_threads(tasks, NP=None, ldebug=False):
+  ''' execute a list of tasks concurrently in a pool of NP threads and return the results in the
+      original order; tasks are (func, args, kwargs) tuples; threads are used instead of processes,
+      so that bound methods and objects with open file handles (e.g. NetCDF Variables) can be used
+      and results do not have to be pickled; Numpy and NetCDF release the GIL for most of the heavy
+      lifting, so this still scales reasonably for I/O and array reductions.
+      NP=None defaults to OMP_NUM_THREADS and exceptions are re-raised in the calling thread. '''
+  if not isinstance(tasks,(list,tuple)): raise TypeError
+  if NP is None: NP = int(os.environ.get('OMP_NUM_THREADS',1))
+  if not isinstance(NP,(int,np.integer)): raise TypeError
+  NP = int(min(NP,len(tasks)))
+  if NP <= 1:
+    # no need to fire up a pool
+    if ldebug: print('\n   ***   Running in Serial Mode   ***')
+    results = [_call_task(task) for task in tasks]
+  else:
+    if ldebug: print('\n   ***   firing up thread pool ({:d} threads, {:d} tasks)   ***'.format(NP,len(tasks)))
+    pool = ThreadPool(processes=NP)
+    try:
+      results = pool.map(_call_task, tasks, chunksize=1) # map preserves order
+    finally:
+      pool.close()
+      pool.join()
+  # return list of results
+  return results
+
+def apply_in_processes(tasks, NP=None, ldebug=False):
+  ''' execute a list of tasks in a pool of NP worker processes and return the results in the 
+      original order; tasks are (func, args, kwargs) tuples, which have to be picklable (i.e. 
+      module-level functions or functools.partial objects thereof); use this for CPU-bound 
+      Python code that does not release the GIL. NP=None defaults to OMP_NUM_THREADS. '''
+  if not isinstance(tasks,(list,tuple)): raise TypeError
+  if NP is None: NP = int(os.environ.get('OMP_NUM_THREADS',1))
+  if not isinstance(NP,(int,np.integer)): raise TypeError
+  NP = int(min(NP,len(tasks)))
+  if multiprocessing.current_process().daemon: NP = 1 # pool workers can't have child processes
+  if NP <= 1:
+    # no need to fire up a pool
+    if ldebug: print('\n   ***   Running in Serial Mode   ***')
+    results = [_call_task(task) for task in tasks]
+  else:
+    if ldebug: print('\n   ***   firing up process pool ({:d} processes, {:d} tasks)   ***'.format(NP,len(tasks)))
+    pool = multiprocessing.Pool(processes=NP)
+    try:
+      results = pool.map(_call_task, tasks, chunksize=1) # map preserves order
+    finally:
+      pool.close()
+      pool.join()
+  # return list of results
+  return results
+
+class TaskQueue(object):
+  ''' a queue that executes tasks in a pool of NP worker processes as they are appended, but holds at 
+      most nqueue pending tasks (default: 2*NP), so that task arguments (e.g. data arrays) are never 
+      all held in memory at once; tasks are (func, args, kwargs) tuples (see apply_in_processes) and 
+      join() returns the results in the original order. NP=None defaults to OMP_NUM_THREADS. '''
+  
+  def __init__(self, NP=None, nqueue=None, ldebug=False):
+    ''' fire up a process pool, unless NP is 1 or we are already in a pool worker '''
+    if NP is None: NP = int(os.environ.get('OMP_NUM_THREADS',1))
+    if not isinstance(NP,(int,np.integer)): raise TypeError
+    if multiprocessing.current_process().daemon: NP = 1 # pool workers can't have child processes
+    self.NP = int(NP); self.nqueue = nqueue or 2*self.NP
+    self.results = []; self.pending = [] # results of finished and pending tasks
+    if self.NP <= 1:
+      if ldebug: print('\n   ***   Running in Serial Mode   ***')
+      self.pool = None
+    else:
+      if ldebug: print('\n   ***   firing up process pool ({:d} processes, {:d} queued tasks)   ***'.format(self.NP,self.nqueue))
+      self.pool = multiprocessing.Pool(processes=self.NP)
+  
+  def __len__(self):
+    ''' number of tasks that have been appended '''
+    return len(self.results) + len(self.pending)
+  
+  def append(self, task):
+    ''' execute a task (asynchronously), but wait for the oldest pending task if the queue is full '''
+    if self.pool is None: self.results.append(_call_task(task)) # run immediately
+    else:
+      if len(self.pending) >= self.nqueue: self.results.append(self.pending.pop(0).get())
+      self.pending.append(self.pool.apply_async(_call_task, (task,)))
+  
+  def join(self):
+    ''' wait for all pending tasks, shut down the pool, and return all results in the original order '''
+    try:
+      while self.pending: self.results.append(self.pending.pop(0).get())
+    finally: self.close()
+    return self.results
+  
+  def close(self):
+    ''' shut down the pool (pending tasks are abandoned) '''
+    if getattr(self,'pool',None) is not None:
+      self.pool.terminate() if self.pending else self.pool.close()
+      self.pool.join(); self.pool = None
+  
+  def __del__(self):
+    ''' make sure worker processes don't linger, if a task failed '''
+    self.close()
+
 if __name__ == '__main__':
 
   NP = 4
@@ -15,7 +15,7 @@ import os, gc
 from geodata.base import Variable, Axis, Dataset
 from geodata.gdal import addGDALtoDataset, addGDALtoVar, getAxes
 from geodata.misc import AxisError, ArgumentError
-from utils.misc import flip, expandArgumentList
+from utils.misc import flip, expandArgumentList, apply_over_arguments
 
 # the environment variable RAMDISK contains the path to the RAM disk
 ramdisk = os.getenv('RAMDISK', None)
@@ -179,8 +179,10 @@ def rasterVariable(name=None, units=None, axes=None, atts=None, plot=None, dtype
 ## functions to load ASCII raster data
 
 def readRasterArray(file_pattern, lgzip=None, lgdal=True, dtype=np.float32, lmask=True, fillValue=None, lfeedback=False,
-                    lgeotransform=True, axes=None, lna=False, lskipMissing=False, path_params=None, **kwargs):
-    ''' function to load a multi-dimensional numpy array from several structured ASCII raster files '''
+                    lgeotransform=True, axes=None, lna=False, lskipMissing=False, path_params=None, NP=1, 
+                    cache_folder=None, **kwargs):
+    ''' function to load a multi-dimensional numpy array from several structured ASCII raster files; 
+        rasters can be read concurrently in NP threads and cached (as pickles) in cache_folder '''
     
     if axes is None: raise NotImplementedError
     #TODO: implement automatic detection of axes arguments and axes order
@@ -242,16 +244,28 @@ def readRasterArray(file_pattern, lgzip=None, lgdal=True, dtype=np.float32, lmas
       data[:i0,:,:] = ma.masked if lmask else fillValue # mask all invalid rasters up to first valid raster
     data[i0,:,:] = data2D # add first (valid) raster
     
-    # loop over remaining 2D raster files
-    for i,file_kwargs in enumerate(file_kwargs_list[i0:]):
-        
+    # construct remaining file names
+    filepaths = []
+    for file_kwargs in file_kwargs_list[i0+1:]:
         path_params.update(file_kwargs) # update axes parameters
         filepath = file_pattern.format(**path_params) # construct file name
-        if os.path.exists(filepath):
+        if not lskipMissing and not os.path.exists(filepath): raise IOError(filepath)
+        filepaths.append(filepath)
+    # read remaining 2D raster files (concurrently, if NP > 1); results are in order
+    # N.B.: the modification time is only used to invalidate cached rasters
+    read_kwargs = dict(lgzip=lgzip, lgdal=lgdal, dtype=dtype, lna=False, lmask=lmask, fillValue=fillValue, 
+                       lgeotransform=lgeotransform, **kwargs)
+    read_list = [dict(read_kwargs, filepath=filepath, 
+                      mtime=os.path.getmtime(filepath) if os.path.exists(filepath) else None) for filepath in filepaths]
+    rasters = apply_over_arguments(_readRasterFile, read_list, NP=NP, cache_folder=cache_folder)
+    assert len(rasters) == data.shape[0]-i0-1
+    geotransform = geotransform0 if lgeotransform else None
+    
+    # loop over remaining 2D rasters
+    for i,data2D in enumerate(rasters):
+        
+        if data2D is not None:
             if lfeedback: print '.', # indicate data with bar/pipe
-            # read 2D raster file
-            data2D = readASCIIraster(filepath, lgzip=lgzip, lgdal=lgdal, dtype=dtype, lna=False,
-                                     lmask=lmask, fillValue=fillValue, lgeotransform=lgeotransform, **kwargs)
             # check geotransform
             if lgeotransform: 
                 data2D, geotransform = data2D
@@ -262,19 +276,16 @@ def readRasterArray(file_pattern, lgzip=None, lgdal=True, dtype=np.float32, lmas
             if not shape2D == data2D.shape:
                 raise AxisError(data2D.shape) # to make sure all geotransforms are identical!            
             # insert 2D raster into 3D array
-            data[i+i0,:,:] = data2D # raster shape has to match
-        elif lskipMissing:
-            # fill with masked values
-            data[i+i0,:,:] = ma.masked # mask missing raster
-            if lfeedback: print ' ', # indicate missing with dot
+            data[i+i0+1,:,:] = data2D # raster shape has to match
         else:
-          raise IOError(filepath)
+            # fill with masked values (only if lskipMissing)
+            data[i+i0+1,:,:] = ma.masked # mask missing raster
+            if lfeedback: print ' ', # indicate missing with dot
 
     # complete feedback with linebreak
     if lfeedback: print ''
     
     # reshape and check dimensions
-    assert i+i0 == data.shape[0]-1, (i,i0)
     data = data.reshape(shape+shape2D) # now we have the full shape
     gc.collect() # remove duplicate data
     
@@ -288,6 +299,13 @@ def readRasterArray(file_pattern, lgzip=None, lgdal=True, dtype=np.float32, lmas
     return return_data
 
 
+# helper function to read individual rasters in readRasterArray (module level, for caching)
+def _readRasterFile(filepath=None, mtime=None, **kwargs):
+    ''' read a 2D raster file, if it exists (otherwise return None) '''
+    if not os.path.exists(filepath): return None
+    return readASCIIraster(filepath, **kwargs)
+
+
 def readASCIIraster(filepath, lgzip=None, lgdal=True, dtype=np.float32, lmask=True, fillValue=None, 
                     lgeotransform=True, lna=False, **kwargs):
     ''' load a 2D field from an ASCII raster file (can be compressed); return (masked) numpy array and geotransform '''
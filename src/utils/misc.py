@@ -11,6 +11,9 @@ import numpy as np
 import scipy.linalg as la
 from utils.signalsmooth import smooth
 import collections as col
+import os, hashlib, functools, tempfile
+try: import cPickle as pickle
+except: import pickle
 # internal imports
 from geodata.misc import ArgumentError, isEqual, AxisError
 
@@ -358,6 +361,54 @@ def expandArgumentList(inner_list=None, outer_list=None, expand_list=None, lprod
   # return list of arguments
   return arg_dicts
 
+# deterministic hash of a function call (used as cache key)
+def argumentHash(fct, kwargs):
+  ''' generate an md5 hash from the name of a function and its (keyword) arguments, which is 
+      reproducible across sessions (as long as the arguments can be pickled or have a stable repr) '''
+  args = ()
+  if isinstance(fct, functools.partial): # unwrap partial
+    args = fct.args; kwargs = dict(fct.keywords or {}, **kwargs); fct = fct.func
+  key = (getattr(fct,'__module__',None), getattr(fct,'__name__',None), args, sorted(kwargs.items()))
+  try: key = pickle.dumps(key, protocol=2)
+  except (pickle.PicklingError, TypeError): key = repr(key)
+  return hashlib.md5(key).hexdigest()
+
+# helper function for cached evaluation (module level, so that it can be pickled)
+def _cachedCall(fct, cache_file, kwargs):
+  ''' load results from cache file, or evaluate function and save results in cache file '''
+  if cache_file is not None and os.path.exists(cache_file):
+    with open(cache_file, 'rb') as f: return pickle.load(f)
+  result = fct(**kwargs)
+  if cache_file is not None:
+    # write to temporary file first and rename, so that concurrent calls never read incomplete files
+    fd, tmpfile = tempfile.mkstemp(dir=os.path.dirname(cache_file), suffix='.tmp')
+    try:
+      with os.fdopen(fd, 'wb') as f: pickle.dump(result, f, protocol=2)
+      os.rename(tmpfile, cache_file)
+    except (pickle.PicklingError, TypeError):
+      os.remove(tmpfile) # results that can't be pickled are just not cached
+  return result
+
+# companion to expandArgumentList: evaluate a function over an argument list
+def apply_over_arguments(fct, kwargs_list=None, NP=1, lprocesses=False, cache_folder=None, ldebug=False, **kwargs):
+  ''' evaluate fct for every argument dict in kwargs_list (or in the list generated by expandArgumentList 
+      from the remaining kwargs) in NP threads (or processes) and return results in the same order; if 
+      cache_folder is given, results are pickled and reused, keyed by a hash of function and arguments '''
+  from processing.multiprocess import apply_in_threads, apply_in_processes # avoid circular import
+  if kwargs_list is None: kwargs_list = expandArgumentList(**kwargs)
+  elif kwargs: raise ArgumentError("Can not mix argument lists and expansion arguments!")
+  if cache_folder is not None and not os.path.exists(cache_folder): os.makedirs(cache_folder)
+  # assemble tasks
+  name = getattr(getattr(fct,'func',fct),'__name__','fct') # for cache file names
+  tasks = []
+  for fct_kwargs in kwargs_list:
+    if cache_folder is None: cache_file = None
+    else: cache_file = os.path.join(cache_folder, '{:s}_{:s}.pickle'.format(name, argumentHash(fct, fct_kwargs)))
+    tasks.append((_cachedCall, (fct, cache_file, fct_kwargs), dict()))
+  # evaluate (order is preserved)
+  if lprocesses: return apply_in_processes(tasks, NP=NP, ldebug=ldebug)
+  else: return apply_in_threads(tasks, NP=NP, ldebug=ldebug)
+
 
 # convenience function to evaluate a list of DistVar's
 def evalDistVars(varlist, bins=None, support=None, method='pdf', ldatasetLink=True, bootstrap_axis='bootstrap'):
@@ -423,24 +474,120 @@ def binedges(bins=None, binedgs=None, limits=None, lcheckVar=True):
   return bins, binedgs
 
 
+# helper function to read PCA input in blocks along the sample axis
+def _pcaBlocks(data, sample_axis='time', blksize=None):
+  ''' return the number of samples, the feature shape and a generator function that yields 2D blocks 
+      (samples x features) with NaN's for masked values; data can be a 2D array (samples first) or a 
+      Variable, and VarNC's that are not loaded are read directly from file '''
+  if hasattr(data,'axisIndex'): # a Variable
+    var = data
+    iax = var.axisIndex(sample_axis) if isinstance(sample_axis,basestring) else sample_axis
+    nt = var.shape[iax]; fshape = var.shape[:iax]+var.shape[iax+1:]
+    def readBlock(slc):
+      idx = [slice(None)]*var.ndim; idx[iax] = slc
+      if var.data: block = var.data_array.__getitem__(tuple(idx))
+      elif hasattr(var,'ncvar'): block = var.__getitem__(tuple(idx)) # read from file
+      else: block = var.load().data_array.__getitem__(tuple(idx))
+      return np.moveaxis(block, iax, 0)
+  else:
+    array = data if isinstance(data,np.ndarray) else np.asarray(data)
+    if not array.ndim == 2: raise ArgumentError(array.ndim)
+    nt = array.shape[0]; fshape = array.shape[1:]
+    def readBlock(slc): return array[slc,:]
+  if blksize is None: blksize = nt
+  def blocks():
+    for t0 in xrange(0,nt,blksize):
+      block = readBlock(slice(t0,min(t0+blksize,nt)))
+      if isinstance(block,np.ma.MaskedArray): block = block.astype(np.float_).filled(np.NaN)
+      else: block = np.asarray(block, dtype=np.float_)
+      yield block.reshape((len(block),-1))
+  return nt, fshape, blocks
+
+# randomized SVD (Halko et al. 2011)
+def randomizedSVD(data, k, oversample=10, n_iter=4, seed=None):
+  ''' compute the leading k singular values and vectors of a 2D array, using a randomized range 
+      finder with power iterations; returns U, s, Vt like numpy.linalg.svd (truncated) '''
+  rnd = np.random.RandomState(seed)
+  l = min(k+oversample, min(data.shape))
+  Q = np.dot(data, rnd.standard_normal((data.shape[1],l)))
+  Q = la.qr(Q, mode='economic')[0]
+  for i in xrange(n_iter): # power iterations (re-orthogonalized)
+    Q = la.qr(np.dot(data.T, Q), mode='economic')[0]
+    Q = la.qr(np.dot(data, Q), mode='economic')[0]
+  U, s, Vt = la.svd(np.dot(Q.T, data), full_matrices=False)
+  return np.dot(Q, U[:,:k]), s[:k], Vt[:k,:]
+
 # function to perform PCA
-def PCA(data, degree=None, lprewhiten=False, lpostwhiten=False, lEOF=False, lfeedback=False):
-  ''' A function to perform principal component analysis and return the time-series of the leading EOF's. '''
-  data = np.asarray(data)
-  if not data.ndim == 2: raise ArgumentError(data.ndim)
-  # pre-whiten features
+def PCA(data, degree=None, lprewhiten=False, lpostwhiten=False, lEOF=False, lfeedback=False, method='eigh', 
+        sample_axis='time', weights=None, blksize=None, oversample=10, n_iter=4, seed=None):
+  ''' A function to perform principal component analysis and return the time-series of the leading EOF's. 
+      data can be a 2D array (samples x features) or a Variable (samples along sample_axis). Methods are 
+      'eigh' (eigen-decomposition of the full covariance matrix), 'randomized' (randomized SVD of the 
+      leading EOF's) and 'incremental' (block-wise SVD over blksize samples; a VarNC is read from file 
+      block by block; the leading EOF's are approximate, unless the spectrum is well separated). 
+      Features are weighted with sqrt(weights) (e.g. grid cell area) and features with NaN's/masked 
+      values are excluded (their EOF loadings are NaN). For the 'randomized' and 'incremental' methods 
+      EOF signs are chosen, so that the largest loading is positive ('eigh' signs are arbitrary). '''
+  if method not in ('eigh','randomized','incremental'): raise ArgumentError(method)
+  if method != 'incremental': blksize = None # read everything at once
+  nt, fshape, blocks = _pcaBlocks(data, sample_axis=sample_axis, blksize=blksize)
+  nf = int(np.prod(fshape))
+  # first pass: feature statistics and invalid points (non-incremental methods load all data at once)
+  s1 = np.zeros(nf); s2 = np.zeros(nf); lnan = np.zeros(nf, dtype=np.bool_)
+  X = None if method == 'incremental' else next(blocks())
+  for block in blocks() if X is None else [X]:
+    lnan |= np.isnan(block).any(axis=0)
+    if lprewhiten: s1 += np.nansum(block, axis=0); s2 += np.nansum(block**2, axis=0)
+  # feature scaling: pre-whitening, area weights and invalid points (zero weight)
+  scale = np.ones(nf)
   if lprewhiten:
-    data -= data.mean(axis=0, keepdims=True)
-    data /= data.std(axis=0, keepdims=True)
+    mean = s1/nt
+    with np.errstate(divide='ignore', invalid='ignore'): scale /= np.sqrt(s2/nt - mean**2)
+  else: mean = None
+  if weights is not None: scale *= np.sqrt(np.broadcast_to(np.asarray(weights, dtype=np.float_), fshape).ravel())
+  scale[lnan] = 0.; scale[~np.isfinite(scale)] = 0.
+  lscale = lprewhiten or weights is not None or lnan.any()
+  def prepare(block):
+    ''' apply pre-whitening and weights and remove invalid points '''
+    if mean is not None: block = block - mean
+    if lscale: block = np.where(scale > 0, block*scale, 0.)
+    return block
   # compute PCA
-  R = np.cov(data.transpose()) # covariance matrix
-  eig, eof = la.eigh(R) # eigenvalues, eigenvectors (of symmetric matrix)
-  ieig = np.argsort(eig,)[::-1] # sort in descending order
-  eig = eig[ieig]; eof = eof[:,ieig]
-  eig /= eig.sum() # normalize by total variance
+  k = degree or min(nt,nf)
+  if method == 'incremental':
+    # incremental SVD, following Ross et al. (2008) and scikit-learn's IncrementalPCA
+    n = 0; cmean = np.zeros(nf); ss = 0.; S = None; Vt = None
+    kk = min(k+oversample,nf) # retain a few extra components to reduce truncation errors
+    for block in blocks():
+      block = prepare(block); nb = len(block)
+      bmean = block.mean(axis=0); block = block - bmean
+      if n == 0: M = block
+      else: # combine previous components, new block and mean correction
+        corr = np.sqrt(float(n*nb)/(n+nb)) * (cmean - bmean)
+        M = np.concatenate((S[:,np.newaxis]*Vt, block, corr[np.newaxis,:]), axis=0)
+        ss += ( corr**2 ).sum()
+      ss += ( block**2 ).sum()
+      S, Vt = la.svd(M, full_matrices=False)[1:]
+      S = S[:kk]; Vt = Vt[:kk,:]
+      cmean = ( n*cmean + nb*bmean ) / (n+nb); n += nb
+    eig = S[:k]**2 / ss; eof = Vt[:k,:].T
+  else:
+    X = prepare(X)
+    if method == 'eigh':
+      R = np.cov(X.transpose()) # covariance matrix
+      eig, eof = la.eigh(R) # eigenvalues, eigenvectors (of symmetric matrix)
+      ieig = np.argsort(eig,)[::-1] # sort in descending order
+      eig = eig[ieig]; eof = eof[:,ieig]
+      eig /= eig.sum() # normalize by total variance
+    elif method == 'randomized':
+      Xc = X - X.mean(axis=0, keepdims=True)
+      S, Vt = randomizedSVD(Xc, k, oversample=oversample, n_iter=n_iter, seed=seed)[1:]
+      eig = S**2 / ( Xc**2 ).sum(); eof = Vt.T
   # truncate EOF's
   if degree is not None:
       eig = eig[:degree]; eof = eof[:,:degree]
+  # make signs unique (except 'eigh', to remain consistent with earlier results)
+  if method != 'eigh': eof = eof * np.where(eof[np.abs(eof).argmax(axis=0),np.arange(eof.shape[1])] < 0, -1., 1.)
   # generate report/feedback
   if lfeedback:
     string = "Variance explained by {:s} PCA's: {:s}; total variance explained: {:2.0f}%"
@@ -448,12 +595,14 @@ def PCA(data, degree=None, lprewhiten=False, lpostwhiten=False, lEOF=False, lfee
     dgrstr = 'all' if degree is None else "{:d} leading".format(degree)
     print(string.format(dgrstr, eiglist, eig.sum()*100.))
   # project data onto (leading) EOF's
-  pca = np.dot(data,eof) # inverse order, because the are transposed
+  if X is None: pca = np.concatenate([np.dot(prepare(block),eof) for block in blocks()], axis=0) # one block at a time
+  else: pca = np.dot(X,eof) # inverse order, because the are transposed
   # post-whiten features
   if lpostwhiten:
     pca -= pca.mean(axis=0, keepdims=True)
     pca /= pca.std(axis=0, keepdims=True)
   # return results
+  eof[lnan,:] = np.NaN # invalid points
   if lEOF: return pca, eig, eof
   else: return pca, eig  
 
@@ -484,6 +633,85 @@ def percentile(a, q, axis=None, interpolation='linear', keepdims=False):
   parr = np.rollaxis(parr, axis=0, start=parr.ndim) # move percentile axis to the back
   return parr
 
+# streaming histogram and percentile estimator
+class StreamingHistogram(object):
+  ''' A fixed-bin histogram that is accumulated block by block along a sample axis for all points at 
+      once (single pass, memory independent of sample size); values outside the bins are counted, 
+      but not included in the histogram (like numpy.histogram), and NaN's are ignored. Percentiles 
+      are estimated like numpy.percentile (linear interpolation between order statistics), where the 
+      samples in each bin are assumed to be evenly spaced (values outside the bins are placed between 
+      the bin edges and the minimum/maximum); the error is roughly one bin width. '''
+  
+  def __init__(self, binedgs):
+    ''' initialize with bin edges; counts are allocated with the first block '''
+    self.binedgs = np.asarray(binedgs, dtype=np.float_)
+    if self.binedgs.ndim != 1 or len(self.binedgs) < 2: raise ArgumentError(binedgs)
+    self.nbins = len(self.binedgs)-1
+    self.counts = None # underflow, bins, overflow
+    self.vmin = None; self.vmax = None
+    self.shape = None # shape of points (without sample axis)
+    
+  def update(self, data, axis=-1):
+    ''' add a block of samples (along axis) to the histograms of all points '''
+    if isinstance(data, np.ma.MaskedArray): data = data.astype(np.float_).filled(np.NaN)
+    data = np.moveaxis(np.asarray(data, dtype=np.float_), axis, -1)
+    shape = data.shape[:-1]
+    if self.shape is None: 
+      self.shape = shape; npts = int(np.prod(shape))
+      self.counts = np.zeros((npts,self.nbins+2), dtype=np.int64)
+      self.vmin = np.full(npts, np.inf); self.vmax = np.full(npts, -np.inf)
+    elif shape != self.shape: raise AxisError(shape)
+    data = data.reshape((-1,data.shape[-1]))
+    npts = len(data); nb = self.nbins+3 # underflow, bins, overflow, NaN
+    idx = np.searchsorted(self.binedgs, data, side='right') # 0 is underflow, nbins+1 overflow
+    idx[data == self.binedgs[-1]] = self.nbins # last bin includes right edge
+    idx[np.isnan(data)] = nb-1 # discard
+    idx += np.arange(npts)[:,np.newaxis]*nb # flat index for each point
+    self.counts += np.bincount(idx.ravel(), minlength=npts*nb).reshape((npts,nb))[:,:-1]
+    if data.shape[-1] > 0:
+      with np.errstate(invalid='ignore'):
+        self.vmin = np.fmin(self.vmin, np.nanmin(data, axis=-1)); self.vmax = np.fmax(self.vmax, np.nanmax(data, axis=-1))
+    return self
+  
+  def histogram(self, density=False):
+    ''' return histogram counts (or density) with the bin axis last '''
+    hist = self.counts[:,1:-1].astype(np.float_ if density else np.int64)
+    if density:
+      with np.errstate(divide='ignore', invalid='ignore'):
+        hist /= hist.sum(axis=-1, keepdims=True) * np.diff(self.binedgs)
+    return hist.reshape(self.shape+(self.nbins,))
+  
+  def percentile(self, q):
+    ''' estimate percentiles (q in %) for all points; the percentile axis is last '''
+    q = np.asarray(q, dtype=np.float_).reshape((-1,))
+    counts = self.counts.astype(np.float_)
+    n = counts.sum(axis=-1)
+    # edges for all bins, including underflow and overflow bins
+    lower = np.concatenate((np.minimum(self.vmin,self.binedgs[0])[:,np.newaxis], 
+                            np.broadcast_to(self.binedgs, (len(n),self.nbins+1))), axis=1)
+    upper = np.concatenate((np.broadcast_to(self.binedgs, (len(n),self.nbins+1)), 
+                            np.maximum(self.vmax,self.binedgs[-1])[:,np.newaxis]), axis=1)
+    cum = np.cumsum(counts, axis=-1)
+    rows = np.arange(len(n))
+    def orderStatistic(k):
+      ''' estimate the k-th smallest sample (0-based) at every point '''
+      ib = np.argmax(cum > k[:,np.newaxis], axis=-1) # bin that contains the k-th sample
+      c = counts[rows,ib]; j = k - (cum[rows,ib] - c)
+      with np.errstate(divide='ignore', invalid='ignore'):
+        x = lower[rows,ib] + (j+0.5)/c*(upper[rows,ib] - lower[rows,ib])
+      x = np.where(k <= 0, self.vmin, x) # minimum and maximum are known exactly
+      return np.where(k >= n-1, self.vmax, x)
+    qdata = np.empty((len(n),len(q)))
+    for i,qq in enumerate(q):
+      rank = qq/100. * np.maximum(n-1,0)
+      k0 = np.floor(rank); k1 = np.ceil(rank)
+      x0 = orderStatistic(k0); x1 = orderStatistic(k1)
+      qdata[:,i] = x0 + (rank-k0)*(x1-x0)
+    # clip to data range and remove points without data
+    qdata = np.clip(qdata, self.vmin[:,np.newaxis], self.vmax[:,np.newaxis])
+    qdata[n == 0,:] = np.NaN
+    return qdata.reshape(self.shape+(len(q),))
+
 # function to subtract the mean and divide by the standard deviation, i.e. standardize
 def standardize(var, axis=None, lcopy=True, **kwargs):
   ''' subtract mean, divide by standard deviation, and optionally smooth time series; key word arguments are passed on to smoothing function '''
@@ -501,12 +729,67 @@ def flip(a, axis=0):
   idx[axis] = slice(None, None, -1) # this one reverses the order
   return a[idx] # apply abd return
   
+# batched least-squares polynomial fit
+def polyfitBatch(x, data, degree=1, w=None, max_groups=16):
+  ''' fit polynomials to all columns of a 2D array (sample axis first) using a single shared QR 
+      factorization of the Vandermonde matrix, and return the fitted values (trend); columns with 
+      NaN's are grouped by mask pattern (each group with its own factorization) or, if there are 
+      too many patterns, solved individually with (vectorized) weighted normal equations '''
+  x = np.asarray(x, dtype=np.float_); data = np.asarray(data, dtype=np.float_)
+  if data.ndim != 2 or x.shape != data.shape[:1]: raise AxisError(data.shape)
+  # scale coordinates, so that the Vandermonde matrix is well conditioned
+  xs = x.std(); xs = (x - x.mean()) / (xs if xs > 0 else 1.)
+  V = np.vander(xs, degree+1)
+  if w is not None: 
+    w = np.asarray(w, dtype=np.float_)
+    V = V * w[:,np.newaxis]; data = data * w[:,np.newaxis]
+  trend = np.empty_like(data)
+  def qrSolve(V, Y):
+    ''' least-squares fit of several columns with one factorization '''
+    Q,R = la.qr(V, mode='economic')
+    return la.solve_triangular(R, np.dot(Q.T,Y))
+  nans = np.isnan(data)
+  valid = ~nans.any(axis=0)
+  # columns without NaN's: one shared factorization
+  if valid.any(): 
+    trend[:,valid] = np.dot(V, qrSolve(V, data[:,valid]))
+  # columns with NaN's
+  if not valid.all():
+    invalid = np.flatnonzero(~valid)
+    patterns, inverse = np.unique(nans[:,invalid].T, axis=0, return_inverse=True)
+    if len(patterns) <= max_groups:
+      # group columns by mask pattern and solve each group with its own factorization
+      for i,pattern in enumerate(patterns):
+        cols = invalid[inverse == i]; rows = ~pattern
+        if rows.sum() <= degree: trend[:,cols] = np.NaN # not enough points
+        else: trend[:,cols] = np.dot(V, qrSolve(V[rows,:], data[rows][:,cols]))
+    else:
+      # weighted normal equations (masked points have zero weight), solved as a stack
+      m = (~nans[:,invalid]).astype(np.float_)
+      Y = np.where(nans[:,invalid], 0., data[:,invalid])
+      G = np.einsum('ti,tc,tj->cij', V, m, V) # one Gram matrix per column
+      b = np.dot(Y.T, V) # right-hand side per column
+      lok = m.sum(axis=0) > degree
+      coef = np.zeros((len(invalid),degree+1))
+      coef[lok] = np.linalg.solve(G[lok], b[lok,:,np.newaxis])[...,0]
+      trend[:,invalid] = np.dot(V, coef.T)
+      trend[:,invalid[~lok]] = np.NaN
+  # remove weights from fitted values
+  if w is not None: 
+    with np.errstate(divide='ignore', invalid='ignore'): trend /= w[:,np.newaxis]
+  return trend
+
 # function to detrend a time-series
 def detrend(var, ax=None, lcopy=True, ldetrend=True, ltrend=False, degree=1, rcond=None, w=None,  
-            lsmooth=False, lresidual=False, window_len=11, window='hanning'): 
-  ''' subtract a linear trend from a time-series array (operation is in-place) '''
+            lsmooth=False, lresidual=False, window_len=11, window='hanning', axis=None): 
+  ''' subtract a linear trend from a time-series array (operation is in-place); if axis is given, 
+      all time-series along this axis are processed at once (see polyfitBatch; NaN's are ignored 
+      and rcond is not used) '''
   # check input
   if not isinstance(var,np.ndarray): raise NotImplementedError # too many checks
+  if axis is not None:
+    return _detrendAxis(var, ax=ax, axis=axis, lcopy=lcopy, ldetrend=ldetrend, ltrend=ltrend, degree=degree, w=w, 
+                        lsmooth=lsmooth, lresidual=lresidual, window_len=window_len, window=window)
   if lcopy: var = var.copy() # make copy - not in-place!
   # fit over entire array (usually not what we want...)
   if ax is None and ldetrend: ax = np.arange(var.size) # make dummy axis, if necessary
@@ -530,18 +813,116 @@ def detrend(var, ax=None, lcopy=True, ldetrend=True, ltrend=False, degree=1, rco
   if shape is not None: var = var.reshape(shape)
   return var
 
-# function to smooth a vector (numpy array): moving mean, nothing fancy
-def movingMean(x,i):
-  ''' smooth a vector (x, numpy array) using a moving mean of window width 2*i+1 '''
-  if x.ndim > 1: raise ValueError(x.ndim)
-  xs = x.copy() # smoothed output vector
-  i = 2*i
-  d = i+1 # denominator  for later
-  while i>0:    
-    t = x.copy(); t[i:] = t[:-i];  xs += t
-    t = x.copy(); t[:-i] = t[i:];  xs += t
-    i-=2
-  return xs/d
+# batched version of detrend along an axis
+def _detrendAxis(var, ax=None, axis=0, lcopy=True, ldetrend=True, ltrend=False, degree=1, w=None, 
+                 lsmooth=False, lresidual=False, window_len=11, window='hanning'):
+  ''' helper function that detrends and/or smoothes all time-series along an axis at once '''
+  lmask = isinstance(var, np.ma.MaskedArray)
+  if lmask: var = var.astype(np.float_).filled(np.NaN) # always a copy
+  elif lcopy: var = var.copy() # make copy - not in-place!
+  if ldetrend and ltrend: raise ArgumentError("Can either return trend/polyfit or residuals, not both.")
+  if ldetrend or ltrend:
+    if ax is None: ax = np.arange(var.shape[axis]) # make dummy axis, if necessary
+    data = np.moveaxis(var, axis, 0)
+    shape = data.shape
+    data = data.reshape((shape[0],-1)) # all other dimensions as columns
+    trend = polyfitBatch(ax, data, degree=degree, w=w).reshape(shape)
+    if ldetrend: np.subtract(var, np.moveaxis(trend, 0, axis), out=var, casting='unsafe') # residuals
+    else: var = np.moveaxis(trend, 0, axis) # trend
+  # apply optional smoothing
+  if lsmooth and lresidual: raise ArgumentError("Can either return smoothed array or residuals, not both.")
+  elif lsmooth: var = smooth(var, window_len=window_len, window=window, axis=axis)  
+  elif lresidual: var -= smooth(var, window_len=window_len, window=window, axis=axis)
+  if lmask: var = np.ma.masked_invalid(var, copy=False)
+  return var
+
+# helper function for running sums and extremes
+def _windowReduce(a, window, fct=np.add, fill=0):
+  ''' running sum (or maximum/minimum) of all full windows along the last axis; this is the van Herk/Gil-Werman 
+      algorithm, which uses block-wise prefix and suffix accumulations (independent of window size); since 
+      sums are only accumulated within blocks, round-off is relative to the window, not the whole series '''
+  n = a.shape[-1]; nwin = n-window+1
+  nblk = -(-n//window); npad = nblk*window - n # pad to full blocks
+  if npad > 0: a = np.concatenate((a, np.full(a.shape[:-1]+(npad,), fill, dtype=a.dtype)), axis=-1)
+  blks = a.reshape(a.shape[:-1]+(nblk,window))
+  pre = fct.accumulate(blks, axis=-1).reshape(a.shape) # from the beginning of each block
+  suf = fct.accumulate(blks[...,::-1], axis=-1)[...,::-1].reshape(a.shape) # to the end of each block
+  # N.B.: every window spans at most two blocks: the end of one and the beginning of the next
+  r = fct(suf[...,:nwin], pre[...,window-1:window-1+nwin])
+  if fct is np.add: r[...,::window] = suf[...,:nwin:window] # windows that coincide with a block
+  return r
+
+# helper function for running variances
+def _windowMoments(a, window):
+  ''' sum of squared deviations from the mean for all full windows along the last axis; like _windowReduce, 
+      but with running means and variances (Welford's algorithm) within blocks, which are combined pairwise 
+      (Chan et al.), so that precision only depends on the values in each window '''
+  n = a.shape[-1]; nwin = n-window+1
+  nblk = -(-n//window); npad = nblk*window - n # pad to full blocks
+  if npad > 0: a = np.concatenate((a, np.full(a.shape[:-1]+(npad,), np.NaN)), axis=-1)
+  blks = a.reshape(a.shape[:-1]+(nblk,window))
+  def welford(blks):
+    k = np.zeros(blks.shape); mean = np.zeros(blks.shape); m2 = np.zeros(blks.shape)
+    kk = np.zeros(blks.shape[:-1]); mm = np.zeros(blks.shape[:-1]); ss = np.zeros(blks.shape[:-1])
+    for i in xrange(window): # loop over position in block (vectorized over blocks)
+      x = blks[...,i]; valid = ~np.isnan(x)
+      x = np.where(valid, x, mm) # missing values do not change the moments
+      kk = kk + valid; delta = x - mm
+      mm = mm + delta/np.maximum(kk,1); ss = ss + delta*(x - mm)
+      k[...,i] = kk; mean[...,i] = mm; m2[...,i] = ss
+    return k, mean, m2
+  ka, ma, m2a = (b[...,::-1].reshape(a.shape)[...,:nwin] for b in welford(blks[...,::-1])) # suffix from window start
+  kb, mb, m2b = (b.reshape(a.shape)[...,window-1:window-1+nwin] for b in welford(blks)) # prefix to window end
+  for b in kb,m2b: b[...,::window] = 0 # windows that coincide with a block are covered by the suffix
+  with np.errstate(divide='ignore', invalid='ignore'):
+    m2 = m2a + m2b + (mb-ma)**2*ka*kb/(ka+kb)
+  return m2
+
+# moving-window statistics along an axis
+def movingWindow(x, window, stat='mean', axis=-1, mode='same', minobs=1, ddof=0):
+  ''' compute moving-window statistics ('mean', 'sum', 'max', 'min', 'std' or 'var') along an axis of an 
+      N-D array, using block-wise cumulative sums (mean, sum), running moments (std, var) or extremes (max, min); 
+      in 'same' mode the window is centered and truncated at the boundaries, in 'valid' mode only full 
+      windows are returned; NaN's and masked values are ignored and windows with less than minobs 
+      valid values are set to NaN (or masked) '''
+  if not isinstance(window,(int,np.integer)) or window < 1: raise ArgumentError(window)
+  if stat not in ('mean','sum','max','min','std','var'): raise ArgumentError(stat)
+  if mode not in ('same','valid'): raise ArgumentError(mode)
+  lmask = isinstance(x, np.ma.MaskedArray)
+  if lmask: x = x.astype(np.float_).filled(np.NaN)
+  a = np.moveaxis(np.asarray(x, dtype=np.float_), axis, -1)
+  n = a.shape[-1]
+  if mode == 'valid' and window > n: raise ArgumentError(window)
+  nl = (window-1)//2 if mode == 'same' else 0; nr = window-1-nl if mode == 'same' else 0
+  def pad(b, fill):
+    if nl + nr > 0: # pad, so that all windows are full (truncated in 'same' mode)
+      b = np.concatenate((np.full(b.shape[:-1]+(nl,), fill, dtype=b.dtype), b, 
+                          np.full(b.shape[:-1]+(nr,), fill, dtype=b.dtype)), axis=-1)
+    return b
+  windowReduce = lambda b, fct=np.add, fill=0: _windowReduce(pad(b, fill), window, fct=fct, fill=fill)
+  valid = ~np.isnan(a)
+  nobs = windowReduce(valid.astype(np.int64))
+  if stat in ('max','min'):
+    fill = -np.inf if stat == 'max' else np.inf
+    r = windowReduce(np.where(valid, a, fill), fct=np.maximum if stat == 'max' else np.minimum, fill=fill)
+  elif stat in ('sum','mean'):
+    r = windowReduce(np.where(valid, a, 0))
+    if stat == 'mean': 
+      with np.errstate(divide='ignore', invalid='ignore'): r /= nobs
+  else: # running moments, to avoid loss of precision in the sum of squares
+    r = _windowMoments(pad(a, np.NaN), window)
+    with np.errstate(divide='ignore', invalid='ignore'): r /= nobs-ddof
+    r[nobs-ddof <= 0] = np.NaN
+    if stat == 'std': r = np.sqrt(r)
+  r[nobs < max(minobs,1)] = np.NaN
+  r = np.moveaxis(r, -1, axis)
+  if lmask: r = np.ma.masked_where(np.isnan(r), r)
+  return r
+
+# function to smooth an array: moving mean, nothing fancy
+def movingMean(x, i, axis=-1, **kwargs):
+  ''' smooth an array (x) along an axis using a centered moving mean of window width 2*i+1 '''
+  return movingWindow(x, 2*i+1, stat='mean', axis=axis, **kwargs)
 
 
 # function to traverse nested lists recursively and perform the operation fct on the end members
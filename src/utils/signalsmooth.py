@@ -5,8 +5,9 @@ from: http://scipy.org/Cookbook/SignalSmooth
 """
 
 import numpy as np
+from scipy.fftpack import next_fast_len
 
-def smooth(x, window_len=11, window='hanning'):
+def smooth(x, window_len=11, window='hanning', axis=-1, lfft=None):
     """smooth the data using a window with requested size.
     
     This method is based on the convolution of a scaled window with the signal.
@@ -14,11 +15,18 @@ def smooth(x, window_len=11, window='hanning'):
     (with the window size) in both ends so that transient parts are minimized
     in the begining and end part of the output signal.
     
+    N-dimensional arrays are smoothed along 'axis' (all other dimensions are 
+    processed at once); NaN's (and masked values) are ignored and the window 
+    weights are renormalized, but NaN's remain NaN in the output. lfft selects 
+    FFT-based (True) or direct (False) convolution (None: FFT for long windows).
+    
     input:
         x: the input signal 
         window_len: the dimension of the smoothing window
         window: the type of window from 'flat', 'hanning', 'hamming', 'bartlett', 'blackman'
             flat window will produce a moving average smoothing.
+        axis: the axis along which the signal is smoothed
+        lfft: use FFT-based convolution
 
     output:
         the smoothed signal
@@ -38,10 +46,10 @@ def smooth(x, window_len=11, window='hanning'):
     TODO: the window parameter could be the window itself if an array instead of a string   
     """
 
-    if x.ndim != 1:
-        raise ValueError("smooth only accepts 1 dimension arrays.")
+    if x.ndim == 0:
+        raise ValueError("smooth does not accept scalars.")
 
-    if x.size < window_len:
+    if x.shape[axis] < window_len:
         raise ValueError("Input vector needs to be bigger than window size.")
 
     if window_len < 3:
@@ -50,39 +58,107 @@ def smooth(x, window_len=11, window='hanning'):
     if not window in ['flat', 'hanning', 'hamming', 'bartlett', 'blackman']:
         raise ValueError("Window is on of 'flat', 'hanning', 'hamming', 'bartlett', 'blackman'")
 
-    s=np.r_[2*x[0]-x[window_len:1:-1], x, 2*x[-1]-x[-1:-window_len:-1]]
+    lmask = isinstance(x, np.ma.MaskedArray)
+    if lmask: x = x.astype(np.float_).filled(np.NaN)
+    x = np.moveaxis(np.asarray(x, dtype=np.float_), axis, -1) # work on last axis
+    s = np.concatenate([2*x[...,:1]-x[...,window_len:1:-1], x, 2*x[...,-1:]-x[...,-1:-window_len:-1]], axis=-1)
     #print(len(s))
     
     if window == 'flat': #moving average
         w = np.ones(window_len,'d')
     else:
         w = getattr(np, window)(window_len)
-    y = np.convolve(w/w.sum(), s, mode='same')
-    return y[window_len-1:-window_len+1]
+    y = _normalized_convolution(s, w/w.sum(), mode='same', lfft=lfft)
+    y = y[...,window_len-1:-window_len+1]
+    y[np.isnan(x)] = np.NaN # gaps remain gaps
+    y = np.moveaxis(y, -1, axis)
+    if lmask: y = np.ma.masked_invalid(y, copy=False)
+    return y
+
+
+# helper functions for N-dimensional convolution along an axis
+
+def _convolve_axis(a, w, mode='same', lfft=None):
+    """ convolve a (N-D) with the 1D kernel w along the last axis, either in
+        Fourier space (lfft=True) or as a sum of shifted arrays (lfft=False);
+        mode is 'full', 'same' or 'valid' (like numpy.convolve) """
+    n = a.shape[-1]; m = len(w)
+    if lfft is None: lfft = m > 32 # FFT only pays off for long kernels
+    nfull = n + m - 1
+    if lfft:
+        nfft = next_fast_len(nfull)
+        full = np.fft.irfft(np.fft.rfft(a, nfft, axis=-1)*np.fft.rfft(w, nfft), nfft, axis=-1)[...,:nfull]
+    else:
+        # direct convolution: sum of shifted and weighted copies (vectorized over all other axes)
+        pad = np.zeros(a.shape[:-1]+(n+2*(m-1),), dtype=np.result_type(a,w))
+        pad[...,m-1:m-1+n] = a
+        full = np.zeros(a.shape[:-1]+(nfull,), dtype=pad.dtype)
+        for k in range(m):
+            full += w[k]*pad[...,m-1-k:m-1-k+nfull]
+    if mode == 'full': return full
+    elif mode == 'same':
+        i0 = (min(n,m)-1)//2
+        return full[...,i0:i0+max(n,m)]
+    elif mode == 'valid':
+        return full[...,min(n,m)-1:max(n,m)]
+    else: raise ValueError(mode)
+
+def _normalized_convolution(a, w, axes=(-1,), mode='same', lfft=None):
+    """ separable convolution of a with the 1D kernel(s) w along the given axes;
+        NaN's are ignored and the result is normalized by the sum of the weights
+        of the valid points (points without valid neighbours are NaN) """
+    if not isinstance(w, (list,tuple)): w = (w,)*len(axes)
+    nans = np.isnan(a)
+    lnan = np.any(nans)
+    num = np.where(nans, 0., a) if lnan else a
+    den = (~nans).astype(np.float_) if lnan else None
+    for ax,wk in zip(axes,w):
+        num = np.moveaxis(_convolve_axis(np.moveaxis(num, ax, -1), wk, mode=mode, lfft=lfft), -1, ax)
+        if lnan: den = np.moveaxis(_convolve_axis(np.moveaxis(den, ax, -1), wk, mode=mode, lfft=lfft), -1, ax)
+    if not lnan:
+        # without NaN's, normalization is only necessary, if the kernel is not normalized
+        den = 1.
+        for wk in w: den *= wk.sum()
+        return num/den if den != 1. else num
+    with np.errstate(divide='ignore', invalid='ignore'):
+        den[den < 1e-8*np.abs(den).max()] = np.NaN # roundoff errors from FFT
+        return num/den
+
 
-
 #*********** part2: 2d
 
 from scipy import signal
 
-def gauss_kern(size, sizey=None):
-    """ Returns a normalized 2D gauss kernel array for convolutions """
+def gauss_kern(size, sizey=None, lseparable=False):
+    """ Returns a normalized 2D gauss kernel array for convolutions; 
+        with lseparable=True the two normalized 1D kernels are returned
+        (their outer product is the 2D kernel) """
     size = int(size)
     if not sizey:
         sizey = size
     else:
         sizey = int(sizey)
+    if lseparable:
+        gx = np.exp(-np.arange(-size,size+1)**2/float(size))
+        gy = np.exp(-np.arange(-sizey,sizey+1)**2/float(sizey))
+        return gx / gx.sum(), gy / gy.sum()
     x, y = np.mgrid[-size:size+1, -sizey:sizey+1]
     g = np.exp(-(x**2/float(size) + y**2/float(sizey)))
     return g / g.sum()
 
-def blur_image(im, n, ny=None) :
+def blur_image(im, n, ny=None, axes=(0,1), mode='valid', lfft=None) :
     """ blurs the image by convolving with a gaussian kernel of typical
         size n. The optional keyword argument ny allows for a different
         size in the y direction.
+        The separable kernel is applied along two axes of an N-dimensional 
+        array, so stacks of images can be processed at once; NaN's (and 
+        masked values) are ignored and the weights are renormalized.
     """
-    g = gauss_kern(n, sizey=ny)
-    improc = signal.convolve(im, g, mode='valid')
+    gx, gy = gauss_kern(n, sizey=ny, lseparable=True)
+    lmask = isinstance(im, np.ma.MaskedArray)
+    if lmask: im = im.astype(np.float_).filled(np.NaN)
+    improc = _normalized_convolution(np.asarray(im, dtype=np.float_), (gx,gy), axes=axes, mode=mode, lfft=lfft)
+    if lmask: improc = np.ma.masked_invalid(improc, copy=False)
     return(improc)
 
 
@@ -14,12 +14,38 @@ from scipy.special import betainc
 
 # helper function
 def _betai(a, b, x):
-    x = np.asarray(x)
-    x = np.where(x < 1.0, x, 1.0)  # if x > 1 then return 1.0
+    x = np.asarray(x, dtype=np.float_)
+    x = np.minimum(x, 1.0)  # if x > 1 then return 1.0 (NaN's are propagated)
     return betainc(a, b, x)
 
+def _pearsonr_pval(r, df):
+    ''' helper function to compute the p-value of Pearson's r (also works with arrays) '''
+    r = np.clip(r, -1.0, 1.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_squared = r*r * (df / ((1.0 - r) * (1.0 + r)))
+        prob = _betai(0.5*df, 0.5, df / (df + t_squared))
+    return r, np.where(np.abs(r) == 1.0, 0.0, prob)
+
+def _corrcoef_nd(x, y, minlen=3):
+    ''' helper function to compute the correlation coefficient of 2D arrays along the last axis; 
+        pairs with NaN's in either array are ignored (the masked arrays and sample sizes are 
+        also returned) '''
+    if x.shape != y.shape: raise ValueError("Sample arrays need to have the same shape.")
+    nans = np.logical_or(np.isnan(x), np.isnan(y))
+    if np.any(nans):
+        x = np.where(nans, np.NaN, x); y = np.where(nans, np.NaN, y)
+    n = np.sum(~nans, axis=-1).astype(np.float_)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        xm = x - (np.nansum(x, axis=-1)/n)[:,np.newaxis]
+        ym = y - (np.nansum(y, axis=-1)/n)[:,np.newaxis]
+        r_num = np.nansum(xm * ym, axis=-1)
+        r_den = np.sqrt(np.nansum(xm**2, axis=-1) * np.nansum(ym**2, axis=-1))
+        r = r_num / r_den
+    r[n < minlen] = np.NaN
+    return r, n, x, y
+
 ## Pearson's linear correlation coefficient
-def pearsonr(x, y, dof=None):
+def pearsonr(x, y, dof=None, axis=None, minlen=3):
     """
     Calculates a Pearson correlation coefficient and the p-value for testing
     non-correlation.
@@ -38,7 +64,10 @@ def pearsonr(x, y, dof=None):
     reliable but are probably reasonable for datasets larger than 500 or so.
     
     This is a modified version that supports an optional argument to set the
-    degrees of freedom (dof) manually.
+    degrees of freedom (dof) manually. If an axis is specified, the correlation 
+    is computed along this axis for all other points at once (vectorized); in 
+    this case pairs with NaN's are ignored and points with less than minlen 
+    valid pairs return NaN.
 
     Parameters
     ----------
@@ -48,6 +77,8 @@ def pearsonr(x, y, dof=None):
         Input
     dof : int or None, optional
           Input
+    axis : int or None, optional
+           Sample axis for vectorized computation
 
     Returns
     -------
@@ -59,6 +90,13 @@ def pearsonr(x, y, dof=None):
     http://www.statsoft.com/textbook/glosp.html#Pearson%20Correlation
 
     """
+    if axis is not None:
+        # vectorized version along an axis
+        x, y, shape = _prep_2samp(x, y, axis=axis)
+        r, n, x, y = _corrcoef_nd(x, y, minlen=minlen)
+        df = n-2 if dof is None else dof
+        r, prob = _pearsonr_pval(r, df)
+        return r.reshape(shape), prob.reshape(shape)
     # x and y should have same length.
     x = np.asarray(x)
     y = np.asarray(y)
@@ -72,18 +110,13 @@ def pearsonr(x, y, dof=None):
 
     # Presumably, if abs(r) > 1, then it is only some small artifact of floating
     # point arithmetic.
-    r = max(min(r, 1.0), -1.0)
     df = n-2 if dof is None else dof
-    if abs(r) == 1.0:
-        prob = 0.0
-    else:
-        t_squared = r*r * (df / ((1.0 - r) * (1.0 + r)))
-        prob = _betai(0.5*df, 0.5, df / (df + t_squared))
-    return r, prob
+    r, prob = _pearsonr_pval(r, df)
+    return float(r), float(prob)
 
 
 ## Spearman's rank correlation coefficient
-def spearmanr(a, b=None, axis=0, dof=None):
+def spearmanr(a, b=None, axis=0, dof=None, lpaired=False, minlen=3):
     """
     Calculates a Spearman rank-order correlation coefficient and the p-value
     to test for non-correlation.
@@ -118,6 +151,11 @@ def spearmanr(a, b=None, axis=0, dof=None):
     dof : int or None, optional
         If dof=None (default), the degrees of freedom will be inferred from 
         the array length.
+    lpaired : bool, optional
+        If lpaired=True, a and b are treated as paired samples along axis and
+        the correlation coefficient is computed for all other points at once
+        (vectorized ranking); pairs with NaN's are ignored and points with
+        less than minlen valid pairs return NaN.
 
     Returns
     -------
@@ -180,6 +218,18 @@ def spearmanr(a, b=None, axis=0, dof=None):
     (0.052760927029710199, 0.60213045837062351)
 
     """
+    if lpaired:
+        if b is None or axis is None: raise ValueError("Paired mode requires two samples and an axis.")
+        a, b, shape = _prep_2samp(a, b, axis=axis)
+        # mask NaN pairs first, so that only valid pairs are ranked
+        nans = np.logical_or(np.isnan(a), np.isnan(b))
+        a = np.where(nans, np.NaN, a); b = np.where(nans, np.NaN, b)
+        rs, n, a, b = _corrcoef_nd(rankdata_nd(a, axis=-1), rankdata_nd(b, axis=-1), minlen=minlen)
+        if dof is not None: n = dof
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = rs * np.sqrt((n-2) / ((rs+1.0)*(1.0-rs)))
+            prob = distributions.t.sf(np.abs(t),n-2)*2
+        return rs.reshape(shape), prob.reshape(shape)
     a, axisout = _chk_asarray(a, axis)
     ar = np.apply_along_axis(rankdata,axisout,a)
 
@@ -202,6 +252,162 @@ def spearmanr(a, b=None, axis=0, dof=None):
     else:
         return rs, prob
 
+## vectorized two-sample tests
+# N.B.: the following functions operate along an axis of N-D arrays and are fully vectorized;
+#       NaN's are treated as missing values and points with less than 'minlen' valid values
+#       in either sample return NaN
+
+def _prep_2samp(a, b, axis=-1):
+    ''' helper function to move the sample axis to the end and flatten the remaining axes '''
+    a = np.rollaxis(np.asarray(a, dtype=np.float_), axis, np.ndim(a))
+    b = np.rollaxis(np.asarray(b, dtype=np.float_), axis, np.ndim(b))
+    if a.shape[:-1] != b.shape[:-1]: raise ValueError("Sample arrays are not broadcastable.")
+    shape = a.shape[:-1]
+    a = a.reshape((-1,a.shape[-1])); b = b.reshape((-1,b.shape[-1]))
+    return a, b, shape
+
+def _sort_ties(data):
+    ''' helper function that sorts 2D data along the last axis (NaN's last) and returns the sort 
+        index, the sorted array, and the first and last index of the tie group of each element '''
+    idx = np.argsort(data, axis=-1, kind='mergesort')
+    srt = data[np.arange(len(data))[:,np.newaxis],idx]
+    n = srt.shape[-1]; pos = np.arange(n)
+    # N.B.: NaN's compare unequal, so each NaN forms its own group
+    new = np.ones(srt.shape, dtype=np.bool_); new[:,1:] = srt[:,1:] != srt[:,:-1]
+    last = np.ones(srt.shape, dtype=np.bool_); last[:,:-1] = new[:,1:]
+    first = np.maximum.accumulate(np.where(new, pos, 0), axis=-1)
+    last = np.minimum.accumulate(np.where(last, pos, n-1)[:,::-1], axis=-1)[:,::-1]
+    return idx, srt, first, last
+
+def rankdata_nd(a, axis=-1, ltie=False):
+    ''' Vectorized version of scipy.stats.rankdata that ranks along an axis; ties are assigned
+        the average rank and NaN's are not ranked (NaN). Optionally the tie sum (sum of t**3-t 
+        over all tie groups) is also returned. '''
+    a = np.rollaxis(np.asarray(a, dtype=np.float_), axis, np.ndim(a))
+    shape = a.shape; data = a.reshape((-1,shape[-1]))
+    idx, srt, first, last = _sort_ties(data)
+    nans = np.isnan(srt)
+    sranks = np.where(nans, np.NaN, 0.5*(first+last)+1.)
+    ranks = np.empty_like(sranks)
+    ranks[np.arange(len(data))[:,np.newaxis],idx] = sranks
+    ranks = np.rollaxis(ranks.reshape(shape), -1, axis if axis >= 0 else len(shape)+axis)
+    if ltie:
+        t = (last - first + 1).astype(np.float_)
+        tie = np.where(nans, 0., t**2-1.).sum(axis=-1).reshape(shape[:-1])
+        return ranks, tie
+    else: return ranks
+
+def ks_2samp(a, b, axis=-1, minlen=3):
+    ''' Vectorized Kolmogorov-Smirnov Test on two samples along an axis; returns the test 
+        statistic D and the p-value (same asymptotic approximation as scipy.stats.ks_2samp). '''
+    a, b, shape = _prep_2samp(a, b, axis=axis)
+    n1 = np.sum(~np.isnan(a), axis=-1).astype(np.float_); n2 = np.sum(~np.isnan(b), axis=-1).astype(np.float_)
+    data = np.concatenate((a,b), axis=-1)
+    label = np.zeros(data.shape, dtype=np.float_); label[:,a.shape[-1]:] = 1.
+    idx, srt, first, last = _sort_ties(data)
+    label = label[np.arange(len(data))[:,np.newaxis],idx]
+    nans = np.isnan(srt)
+    c2 = np.cumsum(np.where(nans, 0., label), axis=-1)
+    c1 = np.cumsum(np.where(nans, 0., 1.-label), axis=-1)
+    # evaluate ECDF's only at the end of each tie group
+    pos = np.arange(data.shape[-1])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        diff = np.abs(c1/n1[:,np.newaxis] - c2/n2[:,np.newaxis])
+        diff = np.where(np.logical_and(last == pos, ~nans), diff, 0.)
+        D = diff.max(axis=-1)
+        en = np.sqrt(n1*n2/(n1+n2))
+        pval = distributions.kstwobign.sf((en + 0.12 + 0.11/en)*D)
+    invalid = np.logical_or(n1 < minlen, n2 < minlen)
+    D[invalid] = np.NaN; pval[invalid] = np.NaN
+    return D.reshape(shape), pval.reshape(shape)
+
+def ttest_ind(a, b, axis=-1, equal_var=True, minlen=3):
+    ''' Vectorized Student's T-test for two independent samples along an axis, ignoring NaN's; 
+        returns the t-statistic and the two-sided p-value. '''
+    a, b, shape = _prep_2samp(a, b, axis=axis)
+    n1 = np.sum(~np.isnan(a), axis=-1).astype(np.float_); n2 = np.sum(~np.isnan(b), axis=-1).astype(np.float_)
+    invalid = np.logical_or(n1 < minlen, n2 < minlen)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        m1 = np.nansum(a, axis=-1)/n1; m2 = np.nansum(b, axis=-1)/n2
+        v1 = np.nansum((a-m1[:,np.newaxis])**2, axis=-1)/(n1-1.)
+        v2 = np.nansum((b-m2[:,np.newaxis])**2, axis=-1)/(n2-1.)
+        if equal_var:
+            df = n1 + n2 - 2.
+            denom = np.sqrt( ((n1-1.)*v1 + (n2-1.)*v2) / df * (1./n1 + 1./n2) )
+        else:
+            vn1 = v1/n1; vn2 = v2/n2
+            df = (vn1 + vn2)**2 / (vn1**2/(n1-1.) + vn2**2/(n2-1.))
+            df = np.where(np.isnan(df), 1., df) # same as scipy
+            denom = np.sqrt(vn1 + vn2)
+        t = (m1 - m2)/denom
+        pval = distributions.t.sf(np.abs(t), df)*2.
+    t[invalid] = np.NaN; pval[invalid] = np.NaN
+    return t.reshape(shape), pval.reshape(shape)
+
+def _pooled_ranks(a, b):
+    ''' helper function to rank the pooled samples and return the rank sum of the first sample, 
+        the sample sizes, and the tie sum '''
+    data = np.concatenate((a,b), axis=-1)
+    ranks, tie = rankdata_nd(data, axis=-1, ltie=True)
+    r1 = np.nansum(ranks[:,:a.shape[-1]], axis=-1)
+    n1 = np.sum(~np.isnan(a), axis=-1).astype(np.float_); n2 = np.sum(~np.isnan(b), axis=-1).astype(np.float_)
+    return r1, n1, n2, tie
+
+def mannwhitneyu(a, b, axis=-1, use_continuity=True, minlen=3):
+    ''' Vectorized Mann-Whitney Rank Test on two samples along an axis, ignoring NaN's; returns 
+        the U statistic and the one-sided p-value (like scipy.stats.mannwhitneyu with the default
+        alternative=None). '''
+    a, b, shape = _prep_2samp(a, b, axis=axis)
+    r1, n1, n2, tie = _pooled_ranks(a, b)
+    n = n1 + n2
+    u1 = n1*n2 + n1*(n1+1.)/2. - r1
+    u2 = n1*n2 - u1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        T = 1. - tie/(n**3 - n) # tie correction
+        sd = np.sqrt(T*n1*n2*(n+1.)/12.)
+        z = (np.maximum(u1,u2) - (n1*n2/2. + 0.5*use_continuity)) / sd
+        pval = distributions.norm.sf(np.abs(z))
+    u = np.minimum(u1,u2)
+    invalid = np.logical_or(n1 < minlen, n2 < minlen)
+    u[invalid] = np.NaN; pval[invalid] = np.NaN
+    return u.reshape(shape), pval.reshape(shape)
+
+def ranksums(a, b, axis=-1, minlen=3):
+    ''' Vectorized Wilcoxon Ranksum Test on two samples along an axis, ignoring NaN's; returns 
+        the z-statistic and the two-sided p-value. '''
+    a, b, shape = _prep_2samp(a, b, axis=axis)
+    r1, n1, n2, tie = _pooled_ranks(a, b); del tie
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = (r1 - n1*(n1+n2+1.)/2.) / np.sqrt(n1*n2*(n1+n2+1.)/12.)
+        pval = 2. * distributions.norm.sf(np.abs(z))
+    invalid = np.logical_or(n1 < minlen, n2 < minlen)
+    z[invalid] = np.NaN; pval[invalid] = np.NaN
+    return z.reshape(shape), pval.reshape(shape)
+
+
+## Taylor diagram statistics
+def taylor_stats(samples, reference, axis=-1, dof=None, minlen=3):
+    ''' compute the statistics for a Taylor diagram for many samples in one vectorized pass; samples 
+        can have arbitrary leading dimensions (e.g. members, variables, regions) and the reference 
+        is broadcast against the samples; pairs with NaN's are ignored. Returns a dictionary with the 
+        correlation coefficient ('corr') and p-value ('pval'), the standard deviations of samples and 
+        reference ('std','ref_std'), their ratio ('std_ratio'), the centred RMS difference ('crmsd'), 
+        the means ('mean','ref_mean') and the number of valid pairs ('n'). '''
+    samples, reference = np.broadcast_arrays(np.asarray(samples), np.asarray(reference))
+    x, y, shape = _prep_2samp(samples, reference, axis=axis)
+    r, n, x, y = _corrcoef_nd(x, y, minlen=minlen)
+    df = n-2 if dof is None else dof
+    r, pval = _pearsonr_pval(r, df)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mx = np.nansum(x, axis=-1)/n; my = np.nansum(y, axis=-1)/n
+        xm = x - mx[:,np.newaxis]; ym = y - my[:,np.newaxis]
+        sx = np.sqrt(np.nansum(xm**2, axis=-1)/n); sy = np.sqrt(np.nansum(ym**2, axis=-1)/n)
+        crmsd = np.sqrt(np.nansum((xm-ym)**2, axis=-1)/n)
+        ratio = sx/sy
+    pval[n < minlen] = np.NaN
+    stats = dict(corr=r, pval=pval, std=sx, ref_std=sy, std_ratio=ratio, crmsd=crmsd, mean=mx, ref_mean=my, n=n)
+    return {key:value.reshape(shape) for key,value in stats.items()}
+
 
 if __name__ == '__main__':
     pass
\ No newline at end of file